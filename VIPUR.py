@@ -352,9 +352,10 @@ import optparse
 # bigger modules
 
 # custom modules
-from run_methods import run_VIPUR_serially #, run_VIPUR_deprecated , run_VIPUR_parallel , run_VIPUR_in_stages
+from run_methods import run_VIPUR_serially , run_VIPUR_locally_in_parallel #, run_VIPUR_deprecated , run_VIPUR_parallel , run_VIPUR_in_stages
 from pbs_run_methods import run_VIPUR_PBS
 from slurm_run_methods import run_VIPUR_SLURM
+from pilot_run_methods import run_VIPUR_with_pilots
 
 ################################################################################
 # MAIN
@@ -413,7 +414,13 @@ if __name__ == '__main__':
 
     parser.add_option( '-r' , dest = 'run_mode' ,
         default = 'serial' ,
-        help = 'choose how to run + manage VIPUR jobs: serial, PBS, Slurm' )
+        help = 'choose how to run + manage VIPUR jobs: serial, parallel, PBS, Slurm, pilot' )
+    parser.add_option( '-n' , dest = 'workers' ,
+        default = 0 , type = 'int' ,
+        help = 'for the parallel run mode, how many cores the commands can use at once (default 0, use all cores), for the pilot run mode, how many workers to start (default 0, use the settings)' )
+    parser.add_option( '-q' , dest = 'pilot_queue' ,
+        default = '' ,
+        help = 'for the pilot run mode, where to start the workers: local, slurm, or pbs (default from the settings)' )
 
     # optionally allow specification of input paths
     # well...do this another day...
@@ -430,6 +437,8 @@ if __name__ == '__main__':
 #    sequence_only = bool( options.sequence_only )
     demo = bool( options.demo )
     run_mode = options.run_mode
+    workers = options.workers
+    pilot_queue = options.pilot_queue
 
 
     if run_mode.lower() == 'serial':
@@ -437,6 +446,11 @@ if __name__ == '__main__':
             out_path = out_path , write_numbering_map = write_numbering_map ,
             single_relax = False , delete_intermediate_relax_files = True ,
             demo = demo )
+    elif run_mode.lower() == 'parallel':
+        run_VIPUR_locally_in_parallel( pdb_filename = pdb_filename , variants_filename = variants_filename ,
+            out_path = out_path , write_numbering_map = write_numbering_map ,
+            single_relax = False , delete_intermediate_relax_files = True ,
+            demo = demo , workers = workers )
     elif run_mode.lower() == 'pbs':
         run_VIPUR_PBS( pdb_filename = pdb_filename , variants_filename = variants_filename ,
             out_path = out_path , write_numbering_map = write_numbering_map ,
@@ -447,6 +461,16 @@ if __name__ == '__main__':
             out_path = out_path , write_numbering_map = write_numbering_map ,
             single_relax = True , delete_intermediate_relax_files = True ,
             demo = demo )
+    elif run_mode.lower() == 'pilot':
+        pilot_options = {}
+        if workers:
+            pilot_options['workers'] = workers
+        if pilot_queue:
+            pilot_options['queue'] = pilot_queue.lower()
+        run_VIPUR_with_pilots( pdb_filename = pdb_filename , variants_filename = variants_filename ,
+            out_path = out_path , write_numbering_map = write_numbering_map ,
+            single_relax = False , delete_intermediate_relax_files = True ,
+            demo = demo , **pilot_options )
 
 #    quit()    # why is this here?
 
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# :noTabs=true:
+
+"""
+adaptive sampling of the separate relax trajectories (see ADAPTIVE_RELAX in
+vipur_settings.py)
+
+the trajectories of each variant (and the native) run in waves of
+ADAPTIVE_RELAX_WAVE_SIZE, each wave waits on the previous wave of its own
+structure and of the native (the native waits on every variant)
+once a wave is done, the quartile features and the classifier P are
+bootstrapped from the trajectories so far, if both are stable the rest of the
+variant's trajectories are "skipped" and its rescore can run right away
+(the quartile features are compared by their terms in the classifier, weight
+x normalized value, raw Rosetta energies are on very different scales)
+
+the relax score files lack the terms only the rescore adds, these quartile
+features are left at their training set means while deciding (no effect on P)
+as are the probe + ddg_monomer features until those commands are done
+"""
+
+################################################################################
+# IMPORT
+
+# common modules
+import math
+import random
+
+# bigger modules
+
+# custom modules
+from vipur_settings import ROSETTA_RELAX_OPTIONS , ROSETTA_TERMS_TO_COMPARE , ADAPTIVE_RELAX_WAVE_SIZE , ADAPTIVE_RELAX_BOOTSTRAP_SAMPLES , ADAPTIVE_RELAX_P_TOLERANCE , ADAPTIVE_RELAX_FEATURE_TOLERANCE , ADAPTIVE_RELAX_SEED
+
+from rosetta_feature_generation import extract_scores_from_scorefile , extract_quartile_score_terms_from_scorefiles
+from post_processing import find_important_tasks , extract_variant_features
+
+from classification import VIPUR_classifier
+
+################################################################################
+# WAVE METHODS
+
+# the separate relax trajectories of  <variant>  ("native" for the native)
+# as command indices, in order
+def get_relax_trajectories( task_summary , variant ):
+    return [i for i in xrange( len( task_summary['commands'] ) ) if
+        task_summary['commands'][i]['feature'] in ['relax' , 'relax_native'] and
+        task_summary['commands'][i]['variant'] == variant]
+
+# the trajectories  <job_pair>  waits on, the previous wave of its own
+# structure and of the native, the native waits on the previous wave of every
+# variant so it stops once they do (none for the first wave or single_relax)
+def determine_relax_wave_dependencies( task_summaries , job_pair , wave_size = ADAPTIVE_RELAX_WAVE_SIZE ):
+    task_summary = task_summaries[job_pair[0]]
+    command_dict = task_summary['commands'][job_pair[1]]
+    if not command_dict['feature'] in ['relax' , 'relax_native']:
+        return []
+
+    wave = get_relax_trajectories( task_summary , command_dict['variant'] ).index( job_pair[1] )/wave_size
+    if not wave:
+        return []
+    variants = [command_dict['variant'] , 'native']
+    if command_dict['variant'] == 'native':
+        variants = sorted( set( [i['variant'] for i in task_summary['commands'] if i['feature'] == 'relax'] ) ) + ['native']
+    return [(job_pair[0] , j) for i in variants for j in get_relax_trajectories( task_summary , i )[(wave - 1)*wave_size:wave*wave_size]]
+
+# how many whole waves of these  <trajectories>  are done
+def count_finished_waves( task_summary , trajectories , wave_size = ADAPTIVE_RELAX_WAVE_SIZE ):
+    finished = 0
+    for i in trajectories:
+        run = task_summary['commands'][i].get( 'run' , '' )
+        if not ( 'success' in run or 'failure' in run ):
+            break
+        finished += 1
+    return finished/wave_size
+
+################################################################################
+# CONVERGENCE METHODS
+
+# the decision made for each variant after each wave, so it is only made once
+# (root filename , variant , waves) : converged
+ADAPTIVE_RELAX_DECISIONS = {}
+
+# the features that do not come from relax, once they are available
+# root filename : variant features (see extract_variant_features)
+ADAPTIVE_RELAX_FEATURES = {}
+
+# the relax scores of the successful  <trajectories>  as  { term : [values] }
+def load_trajectory_scores( task_summary , trajectories , terms = ROSETTA_TERMS_TO_COMPARE ):
+    scores = {}
+    for i in trajectories:
+        command_dict = task_summary['commands'][i]
+        if not command_dict.get( 'run' ) == 'success':
+            continue
+        trajectory = extract_scores_from_scorefile( ROSETTA_RELAX_OPTIONS['out:file:scorefile']( command_dict['output_filename'].replace( '.silent' , '' ) ) )
+        for term in terms:
+            if term in trajectory.keys():
+                scores.setdefault( term , [] ).extend( trajectory[term] )
+    return scores
+
+# the probe, ddg_monomer etc. features of each variant, {} until their
+# commands are all successful
+def collect_variant_features( task_summary ):
+    if not task_summary['root_filename'] in ADAPTIVE_RELAX_FEATURES.keys():
+        important_tasks = find_important_tasks( task_summary )
+        if [i for i in ['psiblast' , 'probe' , 'ddg_monomer'] if not important_tasks.get( i , {} ).get( 'run' ) == 'success']:
+            return {}
+        ADAPTIVE_RELAX_FEATURES[task_summary['root_filename']] = extract_variant_features( task_summary , important_tasks )
+    return ADAPTIVE_RELAX_FEATURES[task_summary['root_filename']]
+
+# P of the combined classifier for these  <features> , anything missing is
+# left at its training set mean (no contribution)
+def classify_partial_features( features , classifier = VIPUR_classifier.combined_classifier ):
+    instance = dict( zip( classifier.description , classifier.means ) )
+    instance.update( features )
+    return classifier.classify_instance( instance )['P']
+
+def determine_standard_deviation( values ):
+    mean = sum( values )/float( len( values ) )
+    return math.sqrt( sum( [(i - mean)**2 for i in values] )/len( values ) )
+
+# resample the trajectories of the variant and the native  <samples>  times,
+# returns the standard error of P and the largest standard error of the term
+# (weight x normalized value) of any quartile feature the classifier uses
+# <features>  are the other features of the variant
+def bootstrap_relax_features( variant_scores , native_scores , features = {} ,
+        samples = ADAPTIVE_RELAX_BOOTSTRAP_SAMPLES , seed = ADAPTIVE_RELAX_SEED , classifier = VIPUR_classifier.combined_classifier ):
+    terms = [i for i in ROSETTA_TERMS_TO_COMPARE if i in variant_scores.keys() and i in native_scores.keys()]
+    # normalize_input multiplies by the stored (inverse) standard deviation
+    used = dict( [(classifier.description[i] , abs( classifier.weights[i]*classifier.stds[i] )) for i in classifier.relevant_indices] )
+    variant_count = len( variant_scores[terms[0]] )
+    native_count = len( native_scores[terms[0]] )
+
+    generator = random.Random( seed )
+    bootstrap_P = []
+    bootstrap_features = {}
+    for i in xrange( samples ):
+        variant_sample = [generator.randrange( variant_count ) for j in xrange( variant_count )]
+        native_sample = [generator.randrange( native_count ) for j in xrange( native_count )]
+        quartile_features = extract_quartile_score_terms_from_scorefiles(
+            dict( [(j , [variant_scores[j][k] for k in variant_sample]) for j in terms] ) ,
+            dict( [(j , [native_scores[j][k] for k in native_sample]) for j in terms] ) , terms = terms )
+
+        instance = {}
+        instance.update( features )
+        instance.update( quartile_features )
+        bootstrap_P.append( classify_partial_features( instance ) )
+        for j in quartile_features.keys():
+            if j in used.keys():
+                bootstrap_features.setdefault( j , [] ).append( quartile_features[j] )
+
+    return determine_standard_deviation( bootstrap_P ) , max( [0] + [used[i]*determine_standard_deviation( j ) for i , j in bootstrap_features.items()] )
+
+# are the relax features of  <variant>  stable after  <waves>  waves?
+def check_relax_converged( task_summary , variant , waves , wave_size = ADAPTIVE_RELAX_WAVE_SIZE ,
+        P_tolerance = ADAPTIVE_RELAX_P_TOLERANCE , feature_tolerance = ADAPTIVE_RELAX_FEATURE_TOLERANCE ):
+    variant_scores = load_trajectory_scores( task_summary , get_relax_trajectories( task_summary , variant )[:waves*wave_size] )
+    native_scores = load_trajectory_scores( task_summary , get_relax_trajectories( task_summary , 'native' )[:waves*wave_size] )
+    # need a spread to compare
+    if len( variant_scores.get( 'score' , [] ) ) < 2 or len( native_scores.get( 'score' , [] ) ) < 2:
+        return False
+
+    features = [j for i , j in collect_variant_features( task_summary ).items() if i.split( '_' )[-1] == variant]
+    P_error , feature_error = bootstrap_relax_features( variant_scores , native_scores , ( features + [{}] )[0] )
+    converged = P_error <= P_tolerance and feature_error <= feature_tolerance
+    print variant + ' relax after ' + str( len( variant_scores['score'] ) ) + ' trajectories: P +/- ' + str( round( P_error , 4 ) ) + ', quartile feature terms +/- ' + str( round( feature_error , 4 ) ) + ', ' + 'converged'*converged + 'sampling more'*(not converged)
+    return converged
+
+# has this trajectory been run, or submitted to a queue (see
+# record_submitted_jobs)?
+def check_trajectory_started( command_dict ):
+    return 'run' in command_dict.keys() or bool( command_dict.get( 'job_id' ) )
+
+# mark the trajectories that have not started as "skipped" for each variant
+# whose relax features converged, and for the native once no variant needs
+# any more, for the task summaries in  <task_list>
+def skip_converged_relax_trajectories( task_summaries , task_list , wave_size = ADAPTIVE_RELAX_WAVE_SIZE ):
+    for i in sorted( set( [j[0] for j in task_list] ) ):
+        task_summary = task_summaries[i]
+        native = get_relax_trajectories( task_summary , 'native' )
+        if len( native ) < 2:
+            # single_relax or no structure
+            continue
+        native_waves = count_finished_waves( task_summary , native , wave_size )
+
+        sampling = False
+        for variant in sorted( set( [j['variant'] for j in task_summary['commands'] if j['feature'] == 'relax'] ) ):
+            trajectories = get_relax_trajectories( task_summary , variant )
+            waves = min( count_finished_waves( task_summary , trajectories , wave_size ) , native_waves )
+            remaining = [j for j in trajectories[waves*wave_size:] if not check_trajectory_started( task_summary['commands'][j] )]
+            if not remaining:
+                continue
+            decision = (task_summary['root_filename'] , variant , waves)
+            if waves and not decision in ADAPTIVE_RELAX_DECISIONS.keys():
+                ADAPTIVE_RELAX_DECISIONS[decision] = check_relax_converged( task_summary , variant , waves , wave_size )
+
+            if waves and ADAPTIVE_RELAX_DECISIONS[decision]:
+                for j in remaining:
+                    task_summary['commands'][j]['run'] = 'skipped'
+            else:
+                sampling = True
+
+        # nor are the native waves after these
+        if not sampling:
+            for j in native[native_waves*wave_size:]:
+                if not check_trajectory_started( task_summary['commands'][j] ):
+                    task_summary['commands'][j]['run'] = 'skipped'
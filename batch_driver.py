@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# :noTabs=true:
+
+"""
+runs the commands of a packed job inside a single queue job, several at once
+
+the manifest has one command per line as "<sentinel filename>\t<command>"
+when each command finishes, its exit status and runtime (s) are written to
+its sentinel filename so the run methods can check on each command, its
+output goes to the sentinel filename with a .log extension
+
+usage: python batch_driver.py <manifest filename> <how many at once>
+"""
+
+################################################################################
+# IMPORT
+
+# common modules
+import os
+import sys
+
+# custom modules
+from process_methods import start_process , check_process_finished , wait_for_processes , stop_processes_on_signals
+
+################################################################################
+# METHODS
+
+# sentinel filename + command for each line
+def load_manifest( manifest_filename ):
+    f = open( manifest_filename , 'r' )
+    lines = [i.rstrip( '\n' ).split( '\t' , 1 ) for i in f.readlines() if i.strip()]
+    f.close()
+    return lines
+
+# write the exit status and runtime
+def write_sentinel( sentinel_filename , exit_status , runtime ):
+    f = open( sentinel_filename , 'w' )
+    f.write( str( exit_status ) +' '+ str( int( round( runtime ) ) ) +'\n' )
+    f.close()
+
+# run the commands in  <manifest_filename> ,  <workers>  at a time
+# returns the number of commands that did not exit cleanly
+def run_packed_commands( manifest_filename , workers = 1 , check_interval = 1 ):
+    pending = load_manifest( manifest_filename )
+    # skip anything that already finished e.g. this job was requeued
+    pending = [i for i in pending if not os.path.isfile( i[0] )]
+    print str( len( pending ) ) + ' commands to run, ' + str( workers ) + ' at a time'
+
+    # a qdel or walltime kill signals this driver, not the commands
+    stop_processes_on_signals()
+    running = {}
+    failures = 0
+    while pending or running:
+        # start as many as allowed
+        while pending and len( running ) < workers:
+            sentinel_filename , command = pending.pop( 0 )
+            print 'starting: ' + command
+            running[sentinel_filename] = start_process( command , os.path.splitext( sentinel_filename )[0] + '.log' )
+
+        # record any that finished
+        for sentinel_filename in running.keys():
+            process = running[sentinel_filename]
+            if not check_process_finished( process ):
+                continue
+
+            print 'finished (' + str( process['exit_status'] ) + ') after ' + str( int( process['runtime'] ) ) + 's: ' + sentinel_filename
+            write_sentinel( sentinel_filename , process['exit_status'] , process['runtime'] )
+            failures += bool( process['exit_status'] )
+            del running[sentinel_filename]
+
+        # until the next one finishes
+        if running:
+            wait_for_processes( running.values() , check_interval )
+
+    return failures
+
+################################################################################
+# MAIN
+
+if __name__ == '__main__':
+    if len( sys.argv ) < 2:
+        print __doc__
+        sys.exit( 1 )
+
+    workers = 1
+    if len( sys.argv ) > 2:
+        workers = max( int( sys.argv[2] ) , 1 )
+
+    sys.exit( bool( run_packed_commands( sys.argv[1] , workers ) ) )
@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+# :noTabs=true:
+
+"""
+benchmark the SLURM and PBS run methods against fake_scheduler.py, no cluster
+needed
+
+each run submits <jobs> synthetic commands (each just sleeps, then writes its
+output file) grouped into task summaries like the relax trajectories of a
+protein, and reports:
+    makespan         how long the run methods took (s)
+    throughput       commands finished per second
+    utilization      how much of the fake allocation the commands kept busy
+    poll latency     how long after each job ended the queue was next checked
+                     (mean + max, s)
+    submit/status    how many sbatch/qsub and squeue/qstat calls were made
+                     and their mean duration (s, once the fake command
+                     started)
+    cpu              CPU time of the run methods themselves (s), the
+                     orchestration overhead, and of the queue commands they
+                     called
+
+the allocation, queue delay and monitor delays are set for the run by
+replacing the values in vipur_settings.py before the run methods are imported
+
+usage: python benchmark_scheduler.py [options]    (-h for the options)
+"""
+
+################################################################################
+# IMPORT
+
+# common modules
+import bisect
+import optparse
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+# custom modules
+import vipur_settings
+from pre_processing import write_task_summary
+# the run methods (slurm_run_methods, pbs_run_methods, scheduling_methods) are
+# imported in MAIN, once the settings are replaced
+
+################################################################################
+# SETTINGS
+
+BENCHMARK_JOB_COUNTS = [10 , 1000 , 100000]
+BENCHMARK_COMMANDS_PER_TASK = 10    # commands per task summary, like relax trajectories
+BENCHMARK_COMMAND_RUNTIME = 1    # seconds each synthetic command takes
+BENCHMARK_FEATURE = 'benchmark'    # not a real feature, always "successful"
+
+################################################################################
+# SYNTHETIC TASK SUMMARIES
+
+# <jobs>  commands that each sleep for  <runtime>  seconds, as task summaries
+# of  <commands_per_task>  each, written to  <out_path>  ready for  <queue>
+def write_benchmark_task_summaries( out_path , jobs , queue , runtime = BENCHMARK_COMMAND_RUNTIME ,
+        commands_per_task = BENCHMARK_COMMANDS_PER_TASK , use_job_arrays = False ):
+
+    task_summaries = []
+    for i in xrange( 0 , jobs , commands_per_task ):
+        root_filename = out_path +'/benchmark_'+ str( i/commands_per_task )
+        task_summary = {
+            'root_filename' : root_filename ,
+            'out_path' : out_path ,
+            'filenames' : {'task_summary_filename' : root_filename + '.task_summary'} ,
+            'other' : {} ,
+            'variants' : {} ,
+            'commands' : []
+            }
+
+        for j in xrange( min( commands_per_task , jobs - i ) ):
+            output_filename = root_filename +'_'+ str( j ) + '.out'
+            command_dict = {
+                'feature' : BENCHMARK_FEATURE ,
+                'variant' : 'native' ,
+                'output_filename' : output_filename ,
+                'command' : 'sleep ' + str( runtime ) +';touch '+ output_filename
+                }
+            task_summary['commands'].append( command_dict )
+
+            # one script per command, as run_VIPUR_SLURM and run_VIPUR_PBS write them
+            if queue == 'slurm':
+                script_filename = root_filename +'_'+ str( j ) + '.slurm_script.sh'
+                f = open( script_filename , 'w' )
+                f.write( vipur_settings.SLURM_BASH_SCRIPT( slurm_run_methods.add_sentinel_to_command( command_dict['command'] , slurm_run_methods.get_sentinel_filename( script_filename ) ) ) )
+                f.close()
+
+                slurm_options = {}
+                slurm_options.update( vipur_settings.SLURM_JOB_OPTIONS )
+                for k in slurm_options.keys():
+                    if '__call__' in dir( slurm_options[k] ):
+                        slurm_options[k] = slurm_options[k]( script_filename )
+                slurm_options['N'] = '1'
+                slurm_options['n'] = '1'
+                cores , memory = scheduling_methods.determine_command_resources( task_summary , command_dict )
+                slurm_options['c'] = str( cores )
+                slurm_options['-mem'] = str( int( 1024*memory ) )    # MB
+                command_dict['script_filename'] = script_filename
+                command_dict['sbatch_command'] = slurm_run_methods.create_executable_str( 'sbatch' , [script_filename] , slurm_options )
+            else:
+                script_filename = root_filename +'_'+ str( j ) + '.pbs_script.sh'
+                f = open( script_filename , 'w' )
+                f.write( vipur_settings.PBS_BASH_SCRIPT( command_dict['command'] ) )
+                f.close()
+                command_dict['script_filename'] = script_filename
+                command_dict['queue'] = 'serial'
+
+        # or one job array per task summary
+        if use_job_arrays and queue == 'slurm':
+            slurm_run_methods.write_slurm_array_scripts( task_summary , root_filename , features = [BENCHMARK_FEATURE] )
+        elif use_job_arrays:
+            pbs_run_methods.write_pbs_array_scripts( task_summary , root_filename , features = [BENCHMARK_FEATURE] )
+
+        write_task_summary( task_summary , task_summary['filenames']['task_summary_filename'] )
+        task_summaries.append( task_summary )
+
+    return task_summaries
+
+################################################################################
+# MEASUREMENTS
+
+# the lines of a fake scheduler file, split
+def load_fake_scheduler_log( directory , name ):
+    filename = os.path.join( directory , name )
+    if not os.path.isfile( filename ):
+        return []
+    f = open( filename , 'r' )
+    lines = [i.split( ' ' ) for i in f.read().split( '\n' ) if i]
+    f.close()
+    return lines
+
+def determine_mean( values ):
+    if not values:
+        return 0
+    return sum( values )/float( len( values ) )
+
+# the measurements of one run from the fake scheduler's "events" and "calls"
+def summarize_benchmark( fake_directory , makespan , cores , run_cpu , call_cpu ):
+    events = load_fake_scheduler_log( fake_directory , 'events' )
+    calls = load_fake_scheduler_log( fake_directory , 'calls' )
+
+    started = dict( [(i[2] , float( i[0] )) for i in events if i[1] == 'started'] )
+    ended = dict( [(i[2] , float( i[0] )) for i in events if i[1] in ['ended' , 'cancelled']] )
+    busy = sum( [ended[i] - started[i] for i in ended.keys() if i in started.keys()] )
+
+    # how long until the queue was next checked, after each job ended
+    status_times = sorted( [float( i[0] ) for i in calls if i[2] in ['squeue' , 'qstat']] )
+    latencies = []
+    for i in ended.values():
+        j = bisect.bisect_left( status_times , i )
+        if j < len( status_times ):
+            latencies.append( status_times[j] - i )
+
+    submit_calls = [float( i[1] ) for i in calls if i[2] in ['sbatch' , 'qsub']]
+    status_calls = [float( i[1] ) for i in calls if i[2] in ['squeue' , 'qstat']]
+    return {
+        'jobs' : len( ended ) ,
+        'makespan' : makespan ,
+        'throughput' : len( ended )/makespan if makespan else 0 ,
+        'utilization' : busy/( cores*makespan ) if makespan else 0 ,
+        'poll latency' : (determine_mean( latencies ) , max( [0] + latencies )) ,
+        'submit calls' : (len( submit_calls ) , determine_mean( submit_calls )) ,
+        'status calls' : (len( status_calls ) , determine_mean( status_calls )) ,
+        'cpu' : (run_cpu , call_cpu)
+        }
+
+def format_benchmark_summary( queue , jobs , summary ):
+    return '\t'.join( [queue , str( jobs ) , str( summary['jobs'] ) ,
+        '%.1f' % summary['makespan'] , '%.2f' % summary['throughput'] , '%.2f' % summary['utilization'] ,
+        '%.2f/%.2f' % summary['poll latency'] ,
+        '%i/%.3f' % summary['submit calls'] , '%i/%.3f' % summary['status calls'] ,
+        '%.1f/%.1f' % summary['cpu']] )
+
+BENCHMARK_SUMMARY_HEADER = '\t'.join( ['queue' , 'commands' , 'jobs' , 'makespan' , 'throughput' , 'utilization' ,
+    'poll latency (mean/max)' , 'submit calls (n/mean s)' , 'status calls (n/mean s)' , 'cpu (run/calls)'] )
+
+################################################################################
+# BENCHMARK
+
+# run  <jobs>  synthetic commands through the  <queue>  ("slurm" or "pbs") run
+# methods on a fresh fake scheduler in  <out_path> , returns the measurements
+def run_scheduler_benchmark( out_path , queue , jobs , cores , memory , delay = 0 ,
+        runtime = BENCHMARK_COMMAND_RUNTIME , commands_per_task = BENCHMARK_COMMANDS_PER_TASK , use_job_arrays = False ):
+    out_path = os.path.abspath( out_path ) +'/'+ queue +'_'+ str( jobs )
+    if os.path.isdir( out_path ):
+        shutil.rmtree( out_path )
+    os.makedirs( out_path )
+    fake_directory = out_path +'/fake_scheduler'
+    bin_directory = out_path +'/bin'
+    fake_scheduler = os.path.dirname( os.path.abspath( __file__ ) ) +'/fake_scheduler.py'
+
+    # the fake commands come first
+    subprocess.check_call( [sys.executable , fake_scheduler , 'install' , fake_directory , bin_directory] )
+    server_log = open( out_path +'/fake_scheduler.log' , 'w' )
+    server = subprocess.Popen( [sys.executable , fake_scheduler , 'serve' , fake_directory , str( cores ) , str( memory ) , str( delay )] ,
+        stdout = server_log , stderr = subprocess.STDOUT )
+    path = os.environ['PATH']
+    os.environ['PATH'] = bin_directory +':'+ path
+
+    task_summaries = write_benchmark_task_summaries( out_path , jobs , queue , runtime , commands_per_task , use_job_arrays )
+    task_list = [(i , j) for i in xrange( len( task_summaries ) ) for j in xrange( len( task_summaries[i]['commands'] ) )]
+
+    # the run methods are chatty, keep it in a log
+    stdout = sys.stdout
+    sys.stdout = open( out_path +'/run.log' , 'w' )
+    times = os.times()
+    start = time.time()
+    try:
+        if queue == 'slurm':
+            slurm_run_methods.run_VIPUR_tasks_SLURM( task_summaries , task_list )
+        else:
+            pbs_run_methods.run_VIPUR_tasks_PBS( task_summaries , task_list )
+    finally:
+        makespan = time.time() - start
+        times = [j - i for i , j in zip( times , os.times() )]
+        sys.stdout.close()
+        sys.stdout = stdout
+
+        os.environ['PATH'] = path
+        open( fake_directory +'/stop' , 'w' ).close()
+        server.wait()
+        server_log.close()
+
+    return summarize_benchmark( fake_directory , makespan , cores , times[0] + times[1] , times[2] + times[3] )
+
+################################################################################
+# MAIN
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option( '-q' , dest = 'queues' ,
+        default = 'slurm,pbs' ,
+        help = 'which run methods to benchmark, "slurm" and/or "pbs" (comma separated)' )
+    parser.add_option( '-n' , dest = 'job_counts' ,
+        default = ','.join( [str( i ) for i in BENCHMARK_JOB_COUNTS] ) ,
+        help = 'how many commands to run in each benchmark (comma separated)' )
+    parser.add_option( '-c' , dest = 'cores' ,
+        default = 0 , type = 'int' ,
+        help = 'cores of the fake allocation, the queue\'s ALLOCATION_CORES by default' )
+    parser.add_option( '-m' , dest = 'memory' ,
+        default = 0 , type = 'float' ,
+        help = 'memory (GB) of the fake allocation, the queue\'s ALLOCATION_MEMORY by default' )
+    parser.add_option( '-d' , dest = 'delay' ,
+        default = 0 , type = 'float' ,
+        help = 'seconds each job waits in the fake queue before it can start' )
+    parser.add_option( '-r' , dest = 'runtime' ,
+        default = BENCHMARK_COMMAND_RUNTIME , type = 'float' ,
+        help = 'seconds each synthetic command takes' )
+    parser.add_option( '-t' , dest = 'commands_per_task' ,
+        default = BENCHMARK_COMMANDS_PER_TASK , type = 'int' ,
+        help = 'synthetic commands per task summary' )
+    parser.add_option( '-p' , dest = 'monitor_delay' ,
+        default = 0 , type = 'float' ,
+        help = 'override the longest wait between queue checks (s), the settings are used by default' )
+    parser.add_option( '-a' , dest = 'use_job_arrays' ,
+        default = False , action = 'store_true' ,
+        help = 'submit the commands of each task summary as a job array' )
+    parser.add_option( '-o' , dest = 'out_path' ,
+        default = 'scheduler_benchmark' ,
+        help = 'where to write the synthetic commands, logs and fake scheduler files' )
+    (options , args) = parser.parse_args()
+
+    # the run methods read these when they are imported
+    if options.cores:
+        vipur_settings.SLURM_ALLOCATION_CORES = vipur_settings.PBS_ALLOCATION_CORES = options.cores
+    if options.memory:
+        vipur_settings.SLURM_ALLOCATION_MEMORY = vipur_settings.PBS_ALLOCATION_MEMORY = options.memory
+    if options.monitor_delay:
+        vipur_settings.SLURM_QUEUE_MONITOR_DELAY = vipur_settings.PBS_QUEUE_MONITOR_DELAY = options.monitor_delay
+        vipur_settings.SLURM_QUEUE_MONITOR_MIN_DELAY = min( vipur_settings.SLURM_QUEUE_MONITOR_MIN_DELAY , options.monitor_delay )
+        vipur_settings.SLURM_SENTINEL_CHECK_INTERVAL = min( vipur_settings.SLURM_SENTINEL_CHECK_INTERVAL , options.monitor_delay )
+    import slurm_run_methods , pbs_run_methods , scheduling_methods
+
+    print BENCHMARK_SUMMARY_HEADER
+    for queue in options.queues.lower().split( ',' ):
+        cores = options.cores or getattr( vipur_settings , queue.upper() + '_ALLOCATION_CORES' )
+        memory = options.memory or getattr( vipur_settings , queue.upper() + '_ALLOCATION_MEMORY' )
+        for jobs in [int( i ) for i in options.job_counts.split( ',' )]:
+            summary = run_scheduler_benchmark( options.out_path , queue , jobs , cores , memory , options.delay ,
+                options.runtime , options.commands_per_task , options.use_job_arrays )
+            print format_benchmark_summary( queue , jobs , summary )
+            sys.stdout.flush()
@@ -0,0 +1,580 @@
+#!/usr/bin/env python
+# :noTabs=true:
+
+"""
+an offline stand-in for the SLURM (sbatch, squeue, scancel) and PBS (qsub,
+qstat, qdel) commands the queue run methods use, so they can be exercised and
+benchmarked without a cluster (see benchmark_scheduler.py)
+
+one server runs the submitted scripts as local processes, as many at once as
+fit in its cores + memory, each no sooner than a fixed queue delay after it
+was submitted
+the commands only append to and read files in the server's directory:
+    next_job_id    the last job id handed out
+    submitted      one JSON line per submission
+    cancelled      one job id per line
+    queue          "<job id> <state> <name>" for each job (array element) the
+                   queue still shows, rewritten by the server as it changes,
+                   after a "submitted <offset>" line, how far it has read
+                   (later submissions show as queued)
+    events         "<time> <event> <job id>" as each job starts and ends
+    calls          "<time> <duration (s)> <command>" for each command called
+
+only what VIPUR sends is understood: the job id, state, resource, output,
+array and environment options, everything else is ignored
+
+usage:
+    python fake_scheduler.py serve <directory> [cores] [memory (GB)] [queue delay (s)]
+    python fake_scheduler.py install <directory> <bin directory>
+    <bin directory>/sbatch ...    (etc. once installed, put it first on PATH)
+"""
+
+################################################################################
+# IMPORT
+
+# common modules
+import fcntl
+import getpass
+import json
+import os
+import re
+import signal
+import subprocess
+import sys
+import time
+
+################################################################################
+# SETTINGS
+
+# the commands that are installed, and which queue system they imitate
+FAKE_SCHEDULER_COMMANDS = {
+    'sbatch' : 'slurm' ,
+    'squeue' : 'slurm' ,
+    'scancel' : 'slurm' ,
+    'qsub' : 'pbs' ,
+    'qstat' : 'pbs' ,
+    'qdel' : 'pbs'
+    }
+
+FAKE_SCHEDULER_HOSTNAME = 'fake'    # PBS job ids are "<job id>.<hostname>"
+FAKE_SCHEDULER_FIRST_JOB_ID = 1000
+FAKE_SCHEDULER_CHECK_INTERVAL = .05    # seconds, how often the server looks for changes
+FAKE_SCHEDULER_KEEP_FINISHED = 5    # seconds finished jobs still show in the queue
+
+# job states, as each queue system reports them
+FAKE_SCHEDULER_STATES = {
+    'slurm' : {'queued' : 'PD' , 'running' : 'R' , 'success' : 'CD' , 'failure' : 'F' , 'cancelled' : 'CA'} ,
+    'pbs' : {'queued' : 'Q' , 'running' : 'R' , 'success' : 'C' , 'failure' : 'C' , 'cancelled' : 'C'}
+    }
+
+################################################################################
+# SHARED FILE METHODS
+
+def get_fake_scheduler_filename( directory , name ):
+    return os.path.join( directory , name )
+
+# the directory the installed commands talk to
+def get_fake_scheduler_directory():
+    directory = os.environ.get( 'FAKE_SCHEDULER_PATH' , '' )
+    if not directory or not os.path.isdir( directory ):
+        raise Exception( '??? FAKE_SCHEDULER_PATH is not a fake scheduler directory, start one with \"fake_scheduler.py serve\" ???' )
+    return directory
+
+# append  <lines>  to  <filename>  while holding the lock, optionally hand out
+# a new job id first (written into each line where "{job_id}" appears)
+def append_locked( directory , filename , lines , new_job_id = False ):
+    lock = open( get_fake_scheduler_filename( directory , 'lock' ) , 'a' )
+    fcntl.flock( lock , fcntl.LOCK_EX )
+    try:
+        job_id = ''
+        if new_job_id:
+            counter_filename = get_fake_scheduler_filename( directory , 'next_job_id' )
+            job_id = FAKE_SCHEDULER_FIRST_JOB_ID
+            if os.path.isfile( counter_filename ):
+                f = open( counter_filename , 'r' )
+                job_id = int( f.read().strip() ) + 1
+                f.close()
+            f = open( counter_filename , 'w' )
+            f.write( str( job_id ) +'\n' )
+            f.close()
+            job_id = str( job_id )
+            lines = [i.replace( '{job_id}' , job_id ) for i in lines]
+
+        f = open( get_fake_scheduler_filename( directory , filename ) , 'a' )
+        f.write( ''.join( [i +'\n' for i in lines] ) )
+        f.close()
+    finally:
+        fcntl.flock( lock , fcntl.LOCK_UN )
+        lock.close()
+    return job_id
+
+# the complete lines added to  <filename>  since  <offset> , and the new offset
+def read_new_lines( filename , offset ):
+    if not os.path.isfile( filename ):
+        return [] , offset
+    f = open( filename , 'r' )
+    f.seek( offset )
+    text = f.read()
+    f.close()
+
+    # a line still being written is picked up next time
+    text = text[:text.rfind( '\n' ) + 1]
+    return [i for i in text.split( '\n' ) if i] , offset + len( text )
+
+# the jobs the queue currently shows as [job id , state , name]
+# including submissions the server has not read yet, as queued
+def load_queue( directory ):
+    queue = []
+    offset = 0
+    filename = get_fake_scheduler_filename( directory , 'queue' )
+    if os.path.isfile( filename ):
+        f = open( filename , 'r' )
+        queue = [i.split( ' ' ) for i in f.read().split( '\n' ) if i]
+        f.close()
+        if queue and queue[0][0] == 'submitted':
+            offset = int( queue.pop( 0 )[1] )
+
+    for i in read_new_lines( get_fake_scheduler_filename( directory , 'submitted' ) , offset )[0]:
+        queue += [[str( j['job_id'] ) , FAKE_SCHEDULER_STATES[j['scheduler']]['queued'] , str( j['name'] )] for j in expand_submission( json.loads( i ) , 0 )]
+    return queue
+
+# "0-4,7,9-10%3" (or "0-9:2" for PBS Pro) as the array indices and the "%" limit
+def parse_array_indices( array_indices ):
+    limit = 0
+    if '%' in array_indices:
+        array_indices , limit = array_indices.split( '%' )
+        limit = int( limit )
+
+    indices = []
+    for i in array_indices.split( ',' ):
+        step = 1
+        if ':' in i:
+            i , step = i.split( ':' )
+            step = int( step )
+        i = i.split( '-' )
+        indices += range( int( i[0] ) , int( i[-1] ) + 1 , step )
+    return indices , limit
+
+# the (option , value) pairs and the script from a command line, every option
+# VIPUR uses takes a value, as "-x value", "--xx value" or "--xx=value"
+def parse_submission_arguments( arguments ):
+    options = []
+    script_filename = ''
+    i = 0
+    while i < len( arguments ):
+        if arguments[i].startswith( '-' ) and '=' in arguments[i]:
+            options.append( tuple( arguments[i].lstrip( '-' ).split( '=' , 1 ) ) )
+        elif arguments[i].startswith( '-' ) and i + 1 < len( arguments ):
+            options.append( (arguments[i].lstrip( '-' ) , arguments[i + 1]) )
+            i += 1
+        else:
+            script_filename = arguments[i]
+        i += 1
+    return dict( options ) , script_filename
+
+################################################################################
+# SUBMISSION COMMANDS
+
+# write a submission for the server, returns the new job id
+def submit_fake_job( directory , scheduler , script_filename , cores , memory , output_filename = '' , error_filename = '' ,
+        array_indices = '' , environment = {} ):
+    if not os.path.isfile( script_filename ):
+        raise IOError( script_filename + ' does not exist' )
+
+    indices , limit = [] , 0
+    if array_indices:
+        indices , limit = parse_array_indices( array_indices )
+    submission = {
+        'job_id' : '{job_id}' ,
+        'scheduler' : scheduler ,
+        'script_filename' : os.path.abspath( script_filename ) ,
+        'directory' : os.getcwd() ,
+        'cores' : cores ,
+        'memory' : memory ,
+        'output_filename' : output_filename ,
+        'error_filename' : error_filename ,
+        'array_indices' : indices ,
+        'array_limit' : limit ,
+        'environment' : environment ,
+        'submitted' : time.time()
+        }
+    return append_locked( directory , 'submitted' , [json.dumps( submission )] , new_job_id = True )
+
+# sbatch [options] <script>
+def fake_sbatch( directory , arguments ):
+    options , script_filename = parse_submission_arguments( arguments )
+    cores = int( options.get( 'n' , options.get( 'ntasks' , 1 ) ) )*int( options.get( 'c' , options.get( 'cpus-per-task' , 1 ) ) )
+    memory = float( options.get( 'mem' , 1024 ) )/1024    # MB
+
+    job_id = submit_fake_job( directory , 'slurm' , script_filename , cores , memory ,
+        options.get( 'o' , options.get( 'output' , '' ) ) , options.get( 'e' , options.get( 'error' , '' ) ) ,
+        options.get( 'array' , options.get( 'a' , '' ) ) )
+    return 'Submitted batch job ' + job_id
+
+# qsub [options] <script>
+def fake_qsub( directory , arguments ):
+    options , script_filename = parse_submission_arguments( arguments )
+    resources = options.get( 'l' , '' )
+    nodes = re.findall( 'nodes=(\d+)' , resources )
+    ppn = re.findall( 'ppn=(\d+)' , resources )
+    cores = int( ( nodes + ['1'] )[0] )*int( ( ppn + ['1'] )[0] )
+    memory = 1.
+    for value , unit in re.findall( 'mem=(\d+)([gm]b)' , resources ):
+        memory = float( value )/( 1024 if unit == 'mb' else 1 )
+
+    # "-v NAME=value,..."
+    environment = dict( [i.split( '=' , 1 ) for i in options.get( 'v' , '' ).split( ',' ) if '=' in i] )
+    array_indices = options.get( 't' , options.get( 'J' , '' ) )
+
+    job_id = submit_fake_job( directory , 'pbs' , script_filename , cores , memory ,
+        options.get( 'o' , '' ) , options.get( 'e' , '' ) , array_indices , environment )
+    return job_id + '[]'*bool( array_indices ) +'.'+ FAKE_SCHEDULER_HOSTNAME
+
+# scancel/qdel <job id> ... , array elements as "123_4" or "123[4]"
+def fake_cancel( directory , arguments ):
+    job_ids = [i.split( '.' )[0] for i in arguments if not i.startswith( '-' )]
+    if job_ids:
+        append_locked( directory , 'cancelled' , job_ids )
+    return ''
+
+################################################################################
+# STATUS COMMANDS
+
+# pending SLURM array elements show together e.g. "123_[5-9,12%4]"
+def group_pending_array_elements( queue , pending_state = FAKE_SCHEDULER_STATES['slurm']['queued'] ):
+    grouped = []
+    pending = {}
+    for job_id , state , name in queue:
+        if not '_' in job_id or not state == pending_state:
+            grouped.append( [job_id , state , name] )
+            continue
+        base_id , index = job_id.split( '_' )
+        if not base_id in pending.keys():
+            pending[base_id] = [[] , name]
+            grouped.append( base_id )
+        pending[base_id][0].append( int( index ) )
+
+    for i in xrange( len( grouped ) ):
+        if isinstance( grouped[i] , str ):
+            indices = sorted( pending[grouped[i]][0] )
+            ranges = []
+            for j in indices:
+                if ranges and j == ranges[-1][1] + 1:
+                    ranges[-1][1] = j
+                else:
+                    ranges.append( [j , j] )
+            ranges = ','.join( [str( j[0] ) + ('-' + str( j[1] ))*( j[1] > j[0] ) for j in ranges] )
+            grouped[i] = [grouped[i] +'_['+ ranges +']' , pending_state , pending[grouped[i]][1]]
+    return grouped
+
+# squeue [-h] [-o "%i %t"] [-j <job id>,...] [-u <user>]
+def fake_squeue( directory , arguments ):
+    options = {}
+    header = True
+    i = 0
+    while i < len( arguments ):
+        if arguments[i] == '-h':
+            header = False
+        elif arguments[i].startswith( '-' ) and i + 1 < len( arguments ):
+            options[arguments[i]] = arguments[i + 1]
+            i += 1
+        i += 1
+
+    queue = [j for j in load_queue( directory ) if not '[' in j[0]]
+    if '-j' in options.keys():
+        job_ids = options['-j'].split( ',' )
+        queue = [j for j in queue if j[0].split( '_' )[0] in job_ids]
+    queue = group_pending_array_elements( queue )
+
+    user = getpass.getuser()
+    if '-o' in options.keys():
+        fields = {'%i' : 0 , '%t' : 1 , '%j' : 2}
+        lines = [re.sub( '%[a-zA-Z]' , lambda x : j[fields[x.group( 0 )]] if x.group( 0 ) in fields.keys() else user , options['-o'] ) for j in queue]
+    else:
+        lines = ['JOBID PARTITION NAME USER ST TIME NODES NODELIST(REASON)']*header
+        lines += [' '.join( [j[0] , FAKE_SCHEDULER_HOSTNAME , j[2] , user , j[1] , '0:00' , '1' , 'localhost'] ) for j in queue]
+    return '\n'.join( lines )
+
+# qstat [-t] [-u <user>]
+def fake_qstat( directory , arguments ):
+    queue = [i for i in load_queue( directory ) if not '_' in i[0]]
+    if not '-t' in arguments:
+        # array elements show once, as the whole array
+        arrays = {}
+        single = []
+        for job_id , state , name in queue:
+            if not '[' in job_id:
+                single.append( [job_id , state , name] )
+                continue
+            base_id = job_id.split( '[' )[0] +'[]'
+            if not base_id in arrays.keys():
+                arrays[base_id] = [base_id , state , name]
+                single.append( arrays[base_id] )
+            elif state == 'R' or arrays[base_id][1] == 'C':
+                arrays[base_id][1] = state
+        queue = single
+    if not queue:
+        return ''
+
+    user = getpass.getuser()
+    lines = ['' , FAKE_SCHEDULER_HOSTNAME +':' ,
+        ' '*67 + 'Req\'d    Req\'d       Elap' ,
+        'Job ID                  Username    Queue    Jobname          SessID NDS   TSK Memory   Time    S Time' ,
+        '----------------------- ----------- -------- ---------------- ------ ----- --- ------ -------- - --------']
+    lines += [' '.join( [i[0] +'.'+ FAKE_SCHEDULER_HOSTNAME , user , 'fake' , i[2][:16] , '--' , '1' , '1' , '--' , '--' , i[1] , '--'] ) for i in queue]
+    return '\n'.join( lines ) +'\n'
+
+################################################################################
+# SERVER
+
+# the jobs (each array element separately) for a submission
+def expand_submission( submission , delay ):
+    jobs = []
+    elements = [None]
+    if submission['array_indices']:
+        elements = submission['array_indices']
+
+    for index in elements:
+        job = {}
+        job.update( submission )
+        job['array_id'] = submission['job_id']
+        job['index'] = index
+        job['eligible'] = submission['submitted'] + delay
+        job['state'] = 'queued'
+        job['name'] = os.path.basename( submission['script_filename'] )
+
+        # "123_4" or "123[4]" for array elements
+        environment = {}
+        environment.update( submission['environment'] )
+        output_filename = submission['output_filename']
+        error_filename = submission['error_filename']
+        if submission['scheduler'] == 'slurm':
+            environment['SLURM_JOB_ID'] = submission['job_id']
+            if not index is None:
+                job['job_id'] = submission['job_id'] +'_'+ str( index )
+                environment['SLURM_ARRAY_JOB_ID'] = submission['job_id']
+                environment['SLURM_ARRAY_TASK_ID'] = str( index )
+            for pattern , value in [('%A' , submission['job_id']) , ('%a' , str( index )) , ('%j' , submission['job_id'])]:
+                output_filename = output_filename.replace( pattern , value )
+                error_filename = error_filename.replace( pattern , value )
+        else:
+            environment['PBS_JOBID'] = submission['job_id'] +'.'+ FAKE_SCHEDULER_HOSTNAME
+            environment['PBS_O_WORKDIR'] = submission['directory']
+            if not index is None:
+                job['job_id'] = submission['job_id'] +'['+ str( index ) +']'
+                environment['PBS_ARRAYID'] = str( index )
+                environment['PBS_ARRAY_INDEX'] = str( index )
+                output_filename += ( '-'+ str( index ) )*bool( output_filename )
+                error_filename += ( '-'+ str( index ) )*bool( error_filename )
+        job['environment'] = environment
+        job['output_filename'] = output_filename
+        job['error_filename'] = error_filename
+        jobs.append( job )
+    return jobs
+
+# run the script of  <job>  in its own process group (so it can be cancelled)
+def start_fake_job( job ):
+    environment = {}
+    environment.update( os.environ )
+    environment.update( job['environment'] )
+    output_file = open( job['output_filename'] or os.devnull , 'a' )
+    error_file = output_file
+    if job['error_filename'] and not job['error_filename'] == job['output_filename']:
+        error_file = open( job['error_filename'] , 'a' )
+
+    job['process'] = subprocess.Popen( ['bash' , job['script_filename']] , cwd = job['directory'] , env = environment ,
+        stdout = output_file , stderr = error_file , preexec_fn = os.setsid )
+    output_file.close()
+    if not error_file is output_file:
+        error_file.close()
+
+def stop_fake_job( job ):
+    try:
+        os.killpg( job['process'].pid , signal.SIGKILL )
+    except OSError:
+        # already gone
+        pass
+    job['process'].wait()
+
+# can  <job>  start with the  <cores>  and  <memory>  that are free?
+# jobs bigger than the whole server are shrunk to fit
+def check_fake_job_fits( job , cores , memory , total_cores , total_memory , running_elements ):
+    if job['array_limit'] and running_elements.get( job['array_id'] , 0 ) >= job['array_limit']:
+        return False
+    return min( job['cores'] , total_cores ) <= cores and min( job['memory'] , total_memory ) <= memory
+
+# run submitted jobs until  <directory>/stop  appears
+def run_fake_scheduler( directory , cores = 40 , memory = 120 , delay = 0 , check_interval = FAKE_SCHEDULER_CHECK_INTERVAL ,
+        keep_finished = FAKE_SCHEDULER_KEEP_FINISHED ):
+    """
+    Runs the jobs submitted to the fake scheduler in  <directory>  as local
+    processes, as many at once as fit into  <cores>  and  <memory>  (GB),
+    each no sooner than  <delay>  seconds after it was submitted (in the
+    order they were submitted, smaller jobs fill in around bigger ones)
+
+    Keeps the "queue" file up to date for the status commands, records when
+    each job starts and ends in the "events" file, stops once a "stop" file
+    is written to  <directory>
+    """
+    if not os.path.isdir( directory ):
+        os.makedirs( directory )
+    stop_filename = get_fake_scheduler_filename( directory , 'stop' )
+    if os.path.isfile( stop_filename ):
+        os.remove( stop_filename )
+
+    jobs = {}
+    queued = []
+    running = []
+    finished = []
+    offsets = {'submitted' : 0 , 'cancelled' : 0}
+    free_cores , free_memory = cores , memory
+    print 'fake scheduler in ' + directory + ' running jobs on ' + str( cores ) + ' cores and ' + str( memory ) + 'GB, after ' + str( delay ) + 's in the queue'
+    while not os.path.isfile( stop_filename ):
+        now = time.time()
+        changed = False
+        events = []
+
+        # new submissions
+        lines , offsets['submitted'] = read_new_lines( get_fake_scheduler_filename( directory , 'submitted' ) , offsets['submitted'] )
+        for i in lines:
+            for job in expand_submission( json.loads( i ) , delay ):
+                jobs[job['job_id']] = job
+                queued.append( job['job_id'] )
+            changed = True
+
+        # cancellations, of whole arrays or single elements
+        lines , offsets['cancelled'] = read_new_lines( get_fake_scheduler_filename( directory , 'cancelled' ) , offsets['cancelled'] )
+        for i in lines:
+            for job_id in [j for j in queued + running if j == i or jobs[j]['array_id'] == i]:
+                job = jobs[job_id]
+                if job['state'] == 'running':
+                    stop_fake_job( job )
+                    running.remove( job_id )
+                    free_cores += min( job['cores'] , cores )
+                    free_memory += min( job['memory'] , memory )
+                else:
+                    queued.remove( job_id )
+                job['state'] = 'cancelled'
+                job['ended'] = now
+                finished.append( job_id )
+                events.append( ('cancelled' , job_id , '') )
+            changed = True
+
+        # finished jobs
+        for job_id in list( running ):
+            job = jobs[job_id]
+            exit_status = job['process'].poll()
+            if exit_status is None:
+                continue
+            running.remove( job_id )
+            free_cores += min( job['cores'] , cores )
+            free_memory += min( job['memory'] , memory )
+            job['state'] = 'failure' if exit_status else 'success'
+            job['ended'] = now
+            finished.append( job_id )
+            events.append( ('ended' , job_id , str( exit_status )) )
+            changed = True
+
+        # start whatever fits, in order
+        running_elements = {}
+        for job_id in running:
+            running_elements[jobs[job_id]['array_id']] = running_elements.get( jobs[job_id]['array_id'] , 0 ) + 1
+        for job_id in list( queued ):
+            job = jobs[job_id]
+            if job['eligible'] > now or free_cores < 1:
+                # the rest were submitted later, or nothing else fits
+                break
+            if not check_fake_job_fits( job , free_cores , free_memory , cores , memory , running_elements ):
+                continue
+            start_fake_job( job )
+            queued.remove( job_id )
+            running.append( job_id )
+            running_elements[job['array_id']] = running_elements.get( job['array_id'] , 0 ) + 1
+            free_cores -= min( job['cores'] , cores )
+            free_memory -= min( job['memory'] , memory )
+            job['state'] = 'running'
+            events.append( ('started' , job_id , str( job['submitted'] )) )
+            changed = True
+
+        # finished jobs leave the queue after a while
+        for job_id in [i for i in finished if jobs[i]['ended'] + keep_finished < now]:
+            finished.remove( job_id )
+            del jobs[job_id]
+            changed = True
+
+        if events:
+            f = open( get_fake_scheduler_filename( directory , 'events' ) , 'a' )
+            f.write( ''.join( [' '.join( [str( now )] + [j for j in i if j] ) +'\n' for i in events] ) )
+            f.close()
+        if changed:
+            # written whole, then moved into place, so readers never see half of it
+            queue_filename = get_fake_scheduler_filename( directory , 'queue' )
+            f = open( queue_filename + '.temp' , 'w' )
+            f.write( 'submitted '+ str( offsets['submitted'] ) +'\n' )
+            f.write( ''.join( [i +' '+ FAKE_SCHEDULER_STATES[jobs[i]['scheduler']][jobs[i]['state']] +' '+ jobs[i]['name'] +'\n' for i in running + queued + finished] ) )
+            f.close()
+            os.rename( queue_filename + '.temp' , queue_filename )
+
+        time.sleep( check_interval )
+
+    # nothing outlives the server
+    for job_id in running:
+        stop_fake_job( jobs[job_id] )
+
+################################################################################
+# INSTALL
+
+# write a wrapper for each command into  <bin_directory>  that talks to the
+# server in  <directory> , put  <bin_directory>  first on PATH to use them
+def install_fake_scheduler_commands( directory , bin_directory , commands = FAKE_SCHEDULER_COMMANDS ):
+    if not os.path.isdir( bin_directory ):
+        os.makedirs( bin_directory )
+    for command in commands.keys():
+        filename = os.path.join( bin_directory , command )
+        f = open( filename , 'w' )
+        f.write( '#!/bin/sh\nFAKE_SCHEDULER_PATH=\"' + os.path.abspath( directory ) + '\" exec \"' + sys.executable + '\" \"' + os.path.abspath( __file__ ).replace( '.pyc' , '.py' ) + '\" ' + command + ' \"$@\"\n' )
+        f.close()
+        os.chmod( filename , 0755 )
+
+# run one of the installed commands, recording how long it took
+def run_fake_scheduler_command( command , arguments ):
+    start = time.time()
+    directory = get_fake_scheduler_directory()
+    if command == 'sbatch':
+        output = fake_sbatch( directory , arguments )
+    elif command == 'qsub':
+        output = fake_qsub( directory , arguments )
+    elif command in ['scancel' , 'qdel']:
+        output = fake_cancel( directory , arguments )
+    elif command == 'squeue':
+        output = fake_squeue( directory , arguments )
+    elif command == 'qstat':
+        output = fake_qstat( directory , arguments )
+    else:
+        raise Exception( '??? ' + command + ' is not one of the fake scheduler commands ???' )
+
+    f = open( get_fake_scheduler_filename( directory , 'calls' ) , 'a' )
+    f.write( str( start ) +' '+ str( time.time() - start ) +' '+ command +'\n' )
+    f.close()
+    return output
+
+################################################################################
+# MAIN
+
+if __name__ == '__main__':
+    if len( sys.argv ) < 2:
+        print __doc__
+        sys.exit( 1 )
+
+    if sys.argv[1] == 'serve' and len( sys.argv ) > 2:
+        settings = [float( i ) for i in sys.argv[3:6]]
+        run_fake_scheduler( sys.argv[2] , *settings )
+    elif sys.argv[1] == 'install' and len( sys.argv ) > 3:
+        install_fake_scheduler_commands( sys.argv[2] , sys.argv[3] )
+    elif sys.argv[1] in FAKE_SCHEDULER_COMMANDS.keys():
+        output = run_fake_scheduler_command( sys.argv[1] , sys.argv[2:] )
+        if output:
+            sys.stdout.write( output + '\n'*( not output.endswith( '\n' ) ) )
+    else:
+        print __doc__
+        sys.exit( 1 )
@@ -0,0 +1,463 @@
+#!/usr/bin/env python
+# :noTabs=true:
+
+"""
+offline stand-ins for the external programs VIPUR runs (PSIBLAST, PROBE,
+Rosetta ddg_monomer, relax and score, and PyMOL, blastdbcmd and makeblastdb
+for sharded searches), so the whole pipeline can run (and be benchmarked or
+regression tested) on any machine
+
+each reads the same options VIPUR passes and writes output in the same format
+as the real program, replayed from example_output/:
+    psiblast       the example .pssm (.pb, .cp, .ss) for the same sequence,
+                   otherwise a PSSM assembled from example rows of the same
+                   amino acids, one after the other for several queries
+                   (searching with a checkpoint, just an example .pb)
+    blastdbcmd     the size of any database, a made up sequence for any entry
+    makeblastdb    a database (its index file) for any FASTA file
+    probe          the example block for the same structure + residue,
+                   otherwise one sized by the residue's atoms
+    ddg_monomer    the example ddG line for the same structure + variant,
+                   otherwise an example line picked for it
+    relax          example .sc + .silent trajectories of the same structure
+                   (or of a native/variant like it), one per nstruct
+    score          the example rescore line for each structure in the silent
+                   file, with the score terms the silent file already has
+    pymol          the example variant .pdb, otherwise the input structure
+                   with the residue renamed and its side chain trimmed
+everything is picked by a seed from the filenames (and -run:jran), so the same
+command writes the same output, score terms are jittered a little so separate
+trajectories differ
+
+each waits FAKE_TOOL_DELAYS (times $FAKE_TOOL_DELAY_SCALE, relax once per
+nstruct) and the commands VIPUR runs (not PyMOL) fail (exit 1, write nothing)
+with probability $FAKE_TOOL_FAILURE_RATE, both set when the tools are installed
+
+usage:
+    python fake_tools.py install <bin directory> [delay scale] [failure rate]
+    then set PATH_TO_VIPUR_EXECUTABLES = <bin directory> and
+    PATH_TO_PYMOL = <bin directory>/pymol in vipur_settings.py
+"""
+
+################################################################################
+# IMPORT
+
+# common modules
+import os
+import random
+import re
+import shutil
+import sys
+import time
+import zlib
+
+# custom modules
+from vipur_settings import PATH_TO_PSIBLAST , PATH_TO_BLASTDBCMD , PATH_TO_MAKEBLASTDB , PATH_TO_PROBE , PATH_TO_ROSETTA_DDG_MONOMER , PATH_TO_ROSETTA_RELAX , PATH_TO_ROSETTA_SCORE , PATH_TO_PYMOL , AMINO_ACID_CODES
+
+################################################################################
+# SETTINGS
+
+FAKE_TOOL_EXAMPLES = os.path.dirname( os.path.abspath( __file__ ) ) + '/example_output'
+
+# installed as the executable each setting points to
+FAKE_TOOLS = {
+    'psiblast' : PATH_TO_PSIBLAST ,
+    'blastdbcmd' : PATH_TO_BLASTDBCMD ,
+    'makeblastdb' : PATH_TO_MAKEBLASTDB ,
+    'probe' : PATH_TO_PROBE ,
+    'ddg_monomer' : PATH_TO_ROSETTA_DDG_MONOMER ,
+    'relax' : PATH_TO_ROSETTA_RELAX ,
+    'score' : PATH_TO_ROSETTA_SCORE ,
+    'pymol' : PATH_TO_PYMOL
+    }
+
+# seconds each call takes (relax: each structure), before the delay scale
+FAKE_TOOL_DELAYS = {
+    'psiblast' : 5 ,
+    'blastdbcmd' : .1 ,
+    'makeblastdb' : .2 ,
+    'probe' : .1 ,
+    'ddg_monomer' : 2 ,
+    'relax' : 1 ,
+    'score' : .2 ,
+    'pymol' : .5
+    }
+
+FAKE_TOOL_JITTER = .02    # relative standard deviation added to each score term
+
+# only these fail at random, PyMOL runs during preprocessing which does not retry
+FAKE_TOOL_FAILURES = ['psiblast' , 'probe' , 'ddg_monomer' , 'relax' , 'score']
+
+# standard residue names, for writing variant structures
+FAKE_TOOL_RESIDUE_NAMES = dict( [(j , i) for i , j in AMINO_ACID_CODES.items() if i in
+    ['ALA' , 'CYS' , 'ASP' , 'GLU' , 'PHE' , 'GLY' , 'HIS' , 'ILE' , 'LYS' , 'LEU' , 'MET' , 'ASN' , 'PRO' , 'GLN' , 'ARG' , 'SER' , 'THR' , 'VAL' , 'TRP' , 'TYR']] )
+
+################################################################################
+# SHARED METHODS
+
+# Rosetta/BLAST style "-option value" and "-flag" arguments
+def parse_tool_arguments( arguments ):
+    options = {}
+    i = 0
+    while i < len( arguments ):
+        if arguments[i].startswith( '-' ):
+            if i + 1 < len( arguments ) and not arguments[i + 1].startswith( '-' ):
+                options[arguments[i].lstrip( '-' )] = arguments[i + 1]
+                i += 1
+            else:
+                options[arguments[i].lstrip( '-' )] = ''
+        i += 1
+    return options
+
+# the same choices for the same inputs
+def get_tool_random( *keys ):
+    return random.Random( zlib.crc32( '|'.join( [str( i ) for i in keys] ) ) )
+
+def read_text( filename ):
+    f = open( filename , 'r' )
+    text = f.read()
+    f.close()
+    return text
+
+def write_text( filename , text , append = False ):
+    f = open( filename , 'a'*append or 'w' )
+    f.write( text )
+    f.close()
+
+# the example output files ending in  <extension> , by their basename
+def find_example_files( extension ):
+    examples = {}
+    for directory in sorted( os.listdir( FAKE_TOOL_EXAMPLES ) ):
+        directory = FAKE_TOOL_EXAMPLES +'/'+ directory
+        if not os.path.isdir( directory ):
+            continue
+        for i in sorted( os.listdir( directory ) ):
+            if i.endswith( extension ):
+                examples[i] = directory +'/'+ i
+    return examples
+
+# the example for  <basename>  if there is one, otherwise one picked for it
+# from those that  <similar>  accepts
+def choose_example_file( extension , basename , similar = lambda x : True ):
+    examples = find_example_files( extension )
+    if basename + extension in examples.keys():
+        return examples[basename + extension]
+    candidates = [examples[i] for i in sorted( examples.keys() ) if similar( i )] or [examples[i] for i in sorted( examples.keys() )]
+    return get_tool_random( basename , extension ).choice( candidates )
+
+# each number in  <line>  changed by a little, keeping the columns lined up
+def jitter_numbers( line , generator , jitter = FAKE_TOOL_JITTER ):
+    def jitter_number( match ):
+        value = float( match.group( 0 ) )*( 1 + generator.gauss( 0 , jitter ) )
+        decimals = len( match.group( 0 ).split( '.' )[1] )
+        return ( '%.'+ str( decimals ) +'f' ) % value
+    return re.sub( ' *-?\d+\.\d+' , lambda x : jitter_number( x ).rjust( len( x.group( 0 ) ) ) , line )
+
+# the structure root e.g. "2C35.chain_A_E14R" from  <filename>
+def get_structure_root( filename ):
+    return os.path.basename( filename ).replace( '.pdb' , '' ).replace( '.silent' , '' )
+
+################################################################################
+# PSIBLAST
+
+def load_fasta_sequence( fasta_filename ):
+    return ''.join( [i.strip() for i in read_text( fasta_filename ).split( '\n' ) if not i.startswith( '>' )] )
+
+# the position rows of an example .pssm as (amino acid , row after the amino
+# acid), and the text before and after them
+def load_example_pssm( pssm_filename ):
+    lines = read_text( pssm_filename ).split( '\n' )
+    rows = [i for i in xrange( len( lines ) ) if re.match( ' *\d+ [A-Z] ' , lines[i] )]
+    return [(lines[i][6] , lines[i][7:]) for i in rows] , '\n'.join( lines[:rows[0]] ) , '\n'.join( lines[rows[-1] + 1:] )
+
+# the (id , sequence) of each query in  <fasta_filename>
+def load_fasta_queries( fasta_filename ):
+    return [(i.split( '\n' , 1 )[0].split( ' ' )[0] , ''.join( i.split( '\n' )[1:] ).replace( ' ' , '' )) for i in read_text( fasta_filename ).split( '>' )[1:]]
+
+# the output of searching  <query>  as { extension : text }
+def fake_psiblast_query( query_id , query , extensions ):
+    # the very same sequence, replay it
+    for basename , fasta_filename in find_example_files( '.fa' ).items():
+        if load_fasta_sequence( fasta_filename ) == query:
+            texts = dict( [(i , read_text( fasta_filename.replace( '.fa' , i ) )) for i in extensions] )
+            texts['.pb'] = re.sub( '# Query: .*' , '# Query: ' + query_id , texts['.pb'] )
+            return texts
+
+    # otherwise build it from rows of the example PSSMs for each amino acid
+    rows = {}
+    for i in sorted( find_example_files( '.pssm' ).values() ):
+        example_rows , header , footer = load_example_pssm( i )
+        for amino_acid , row in example_rows:
+            rows.setdefault( amino_acid , [] ).append( row )
+    generator = get_tool_random( query )
+    pssm = [header]
+    for i in xrange( len( query ) ):
+        pssm.append( '%5i %s' % (i + 1 , query[i]) + generator.choice( rows.get( query[i] , sum( rows.values() , [] ) ) ) )
+    texts = {'.pssm' : '\n'.join( pssm + [footer] )}
+
+    # the rest are not read by VIPUR, only the query changes
+    example = choose_example_file( '.pb' , query )
+    for i in extensions[1:]:
+        texts[i] = read_text( example.replace( '.pb' , i ) )
+        if i == '.pb':
+            texts[i] = re.sub( '# Query: .*' , '# Query: ' + query_id , texts[i] )
+    return texts
+
+# several queries (a batch) are searched one after the other, their output
+# written one after the other
+def fake_psiblast( options ):
+    if 'in_pssm' in options.keys():
+        # one iteration of a sharded search, only the hits are read
+        write_text( options['out'] , read_text( choose_example_file( '.pb' , os.path.basename( options['in_pssm'] ) ) ) )
+        return
+
+    queries = load_fasta_queries( options['query'] )
+    if len( queries ) == 1:
+        queries = [(options['query'] , queries[0][1])]
+    outputs = [('out_ascii_pssm' , '.pssm') , ('out' , '.pb') , ('out_pssm' , '.cp') , ('export_search_strategy' , '.ss')]
+
+    texts = [fake_psiblast_query( i , j , [k[1] for k in outputs] ) for i , j in queries]
+    for option , extension in outputs:
+        if option in options.keys():
+            write_text( options[option] , ''.join( [i[extension] for i in texts] ) )
+
+# -info: the size of -db, -entry_batch: a sequence for each entry, to -out
+def fake_blastdbcmd( options ):
+    generator = get_tool_random( options['db'] )
+    if 'info' in options.keys():
+        sequences = generator.randint( 1000 , 100000 )
+        sys.stdout.write( 'Database: ' + os.path.basename( options['db'] ) +'\n\t' + '{:,}'.format( sequences ) +' sequences; '+ '{:,}'.format( 300*sequences ) +' total letters\n' )
+        return
+
+    text = ''
+    for i in read_text( options['entry_batch'] ).split():
+        generator = get_tool_random( options['db'] , i )
+        text += '>' + i +'\n'+ ''.join( [generator.choice( 'ACDEFGHIKLMNPQRSTVWY' ) for j in xrange( generator.randint( 50 , 500 ) )] ) +'\n'
+    write_text( options['out'] , text )
+
+# only the index file, fake psiblast never reads the database
+def fake_makeblastdb( options ):
+    write_text( options['out'] + '.pin' , str( len( read_text( options['in'] ).split( '>' ) ) - 1 ) +' sequences from '+ options['in'] +'\n' )
+
+################################################################################
+# PROBE
+
+# the example blocks, by the residue and structure they are for
+def load_example_probe_blocks():
+    blocks = {}
+    for i in find_example_files( '.probe_out' ).values():
+        for block in read_text( i ).split( 'program: ' )[1:]:
+            command = re.findall( 'command: .* -Q (\S+) .* (\S+)\n' , block )
+            if command:
+                blocks[(command[0][0] , get_structure_root( command[0][1] ))] = 'program: ' + block.rstrip( '\n' ) +'\n\n'
+    return blocks
+
+# probe -Q <residue> ... <pdb> , written to stdout
+def fake_probe( arguments ):
+    residue = arguments[arguments.index( '-Q' ) + 1]
+    pdb_filename = arguments[-1]
+    run = 'program: probe.2.12.071128, run ' + time.strftime( '%a %b %d %H:%M:%S %Y' ) +'\n'
+    command = 'command: ' + ' '.join( [FAKE_TOOLS['probe']] + arguments ) +'\n'
+
+    blocks = load_example_probe_blocks()
+    if (residue , get_structure_root( pdb_filename )) in blocks.keys():
+        block = blocks[(residue , get_structure_root( pdb_filename ))].split( '\n' , 2 )[2]
+        sys.stdout.write( run + command + block )
+        return
+
+    # otherwise the area this residue's atoms could have, exposed like some
+    # example residue is
+    atoms = len( [i for i in read_text( pdb_filename ).split( '\n' ) if i[:4] == 'ATOM' and i[22:27].strip() == residue] )
+    areas = []
+    for block in blocks.values():
+        potential = float( re.findall( 'potential area: (\S+)' , block )[0] )
+        contact = float( re.findall( 'contact surface area: (\S+)' , block )[0] )
+        selected = float( re.findall( 'atoms selected: (\S+)' , block )[0] )
+        if selected and potential:
+            areas.append( (potential/selected , contact/potential) )
+    per_atom , exposed = get_tool_random( pdb_filename , residue ).choice( areas )
+    potential = atoms*per_atom
+    sys.stdout.write( run + command +
+        'selection: external\nname: dots\ndensity: 16.0 dots per A^2\nprobeRad: 1.400 A\nVDWrad: (r * 1.000) + 0.000 A\n        \n' +
+        'subgroup: extern dots\natoms selected: ' + str( atoms ) +'\npotential dots: '+ str( int( 16*potential ) ) +'\npotential area: %.1f A^2\n' % potential +
+        '  type                 #      %%\n             tot:   %6i %5.1f%%\n\n' % (int( 16*potential*exposed ) , 100*exposed) +
+        '   contact surface area: %.1f A^2\naccessible surface area: %.1f A^2\n\n' % (potential*exposed , 3.6*potential*exposed) )
+
+################################################################################
+# ROSETTA DDG_MONOMER
+
+# ddG lines for each variant in the -ddg::mut_file, to ddg_predictions.out
+def fake_ddg_monomer( options ):
+    pdb_filename = options['in:file:s']
+    lines = [i.split() for i in read_text( options['ddg::mut_file'] ).split( '\n' ) if len( i.split() ) == 3]
+    variants = [''.join( i ) for i in lines]
+
+    example = choose_example_file( '.mut' , get_structure_root( pdb_filename ) )
+    example = read_text( os.path.dirname( example ) + '/ddg_predictions.out' ).split( '\n' )
+    header = [i for i in example if 'description' in i][0]
+    example = dict( [(i.split()[1] , i) for i in example if i.startswith( 'ddG:' ) and not 'description' in i] )
+
+    text = header +'\n'
+    for variant in variants:
+        generator = get_tool_random( pdb_filename , variant , options.get( 'run:jran' , '' ) )
+        line = example.get( variant , generator.choice( [example[i] for i in sorted( example.keys() )] ) )
+        line = line.replace( 'ddG: '+ line.split()[1] , ('ddG: '+ variant).ljust( len( 'ddG: '+ line.split()[1] ) ) , 1 )
+        text += jitter_numbers( line , generator ) +'\n\n'
+    write_text( 'ddg_predictions.out' , text )
+
+################################################################################
+# ROSETTA RELAX
+
+# the SEQUENCE + SCORE header lines and (SCORE line , other lines , tag) for
+# each structure in a silent file
+def load_silent_structures( silent_filename ):
+    header = []
+    structures = []
+    for line in read_text( silent_filename ).split( '\n' ):
+        if not line:
+            continue
+        if line.startswith( 'SEQUENCE:' ) or ( line.startswith( 'SCORE:' ) and line.split()[1] == 'score' ):
+            if len( header ) < 2:
+                header.append( line )
+        elif line.startswith( 'SCORE:' ):
+            structures.append( [line , [] , line.split()[-1]] )
+        elif structures:
+            structures[-1][1].append( line )
+    return header , structures
+
+# -nstruct structures of -s, written (appended, as Rosetta does) to
+# -out:file:silent and -out:file:scorefile
+def fake_relax( options ):
+    root = get_structure_root( options['s'] )
+    native = not '.chain_' in root
+    example = choose_example_file( '.silent' , root , lambda x : ( not '.chain_' in x ) == native )
+    header , structures = load_silent_structures( example )
+
+    silent_filename = options['out:file:silent']
+    score_filename = options['out:file:scorefile']
+    silent_text = '\n'.join( header ) +'\n' if not os.path.isfile( silent_filename ) else ''
+    score_text = header[1] +'\n' if not os.path.isfile( score_filename ) else ''
+    for i in xrange( int( options.get( 'nstruct' , 1 ) ) ):
+        generator = get_tool_random( root , silent_filename , options.get( 'run:jran' , '' ) , i )
+        score_line , lines , tag = generator.choice( structures )
+        new_tag = root.replace( '.' , '_' ) +'_%04i' % ( i + 1 )
+        score_line = jitter_numbers( score_line[:score_line.rfind( tag )] , generator ) + new_tag
+        silent_text += score_line +'\n'+ '\n'.join( [j[:len( j ) - len( tag )] + new_tag if j.endswith( tag ) else j for j in lines] ) +'\n'
+        score_text += score_line +'\n'
+    write_text( silent_filename , silent_text , append = True )
+    write_text( score_filename , score_text , append = True )
+
+################################################################################
+# ROSETTA SCORE
+
+# a rescore line for each structure in -in:file:silent, to -out:file:scorefile
+def fake_score( options ):
+    silent_filename = options['in:file:silent']
+    header , structures = load_silent_structures( silent_filename )
+    terms = header[-1].split()[1:]
+
+    root = get_structure_root( silent_filename )
+    native = not '.chain_' in root
+    example = choose_example_file( '_rescore.sc' , root , lambda x : ( not '.chain_' in x ) == native )
+    example = [i for i in read_text( example ).split( '\n' ) if i.startswith( 'SCORE:' )]
+    example_terms = example[0].split()[1:]
+
+    score_filename = options['out:file:scorefile']
+    text = example[0] +'\n' if not os.path.isfile( score_filename ) else ''
+    for i in xrange( len( structures ) ):
+        values = dict( zip( terms , structures[i][0].split()[1:] ) )
+        values['silent_score'] = values.get( 'score' , '0.000' )
+        values['description'] = structures[i][2] + '_0001'
+        template = example[1 + i % ( len( example ) - 1 )].split()[1:]
+        text += 'SCORE: ' + ' '.join( [values.get( example_terms[j] , template[j] ).rjust( len( example_terms[j] ) ) for j in xrange( len( example_terms ) )] ) +'\n'
+    write_text( score_filename , text , append = True )
+
+################################################################################
+# PYMOL
+
+# pymol -qcr pymol_make_variant_structure.py -- -p <pdb> -m <variants> -c <chain> -r <root>
+def fake_pymol( arguments ):
+    options = parse_tool_arguments( arguments[arguments.index( '--' ) + 1:] )
+    chain = options.get( 'c' , 'A' )
+    root_filename = options.get( 'r' , options['p'].replace( '.pdb' , '' ) )
+    lines = [i for i in read_text( options['p'] ).split( '\n' ) if i[:6] in ['ATOM  ' , 'HETATM'] and i[21] == chain]
+
+    examples = find_example_files( '.pdb' )
+    for variant in options['m'].split( ',' ):
+        out_filename = root_filename + '.chain_' + chain +'_'+ variant.replace( '.' , '_' ) +'.pdb'
+        if os.path.basename( out_filename ) in examples.keys():
+            shutil.copy( examples[os.path.basename( out_filename )] , out_filename )
+            continue
+
+        # the new residue name, only the backbone (and CB) of the old residue
+        changes = dict( [(i[1:-1] , i[-1]) for i in variant.split( '.' )] )
+        variant_lines = []
+        for line in lines:
+            position = line[22:27].strip()
+            if position in changes.keys():
+                if not line[12:16].strip() in ['N' , 'CA' , 'C' , 'O' , 'OXT'] + ['CB']*( not changes[position] == 'G' ):
+                    continue
+                line = line[:17] + FAKE_TOOL_RESIDUE_NAMES[changes[position]] + line[20:]
+            variant_lines.append( line )
+        write_text( out_filename , '\n'.join( variant_lines + ['END'] ) +'\n' )
+
+################################################################################
+# INSTALL
+
+# write a wrapper named after each executable in vipur_settings.py into
+# <bin_directory>
+def install_fake_tools( bin_directory , delay_scale = 1 , failure_rate = 0 , tools = FAKE_TOOLS ):
+    if not os.path.isdir( bin_directory ):
+        os.makedirs( bin_directory )
+    for tool , executable in tools.items():
+        filename = os.path.join( bin_directory , os.path.basename( executable ) )
+        f = open( filename , 'w' )
+        f.write( '#!/bin/sh\nFAKE_TOOL_DELAY_SCALE=${FAKE_TOOL_DELAY_SCALE:-' + str( delay_scale ) + '} FAKE_TOOL_FAILURE_RATE=${FAKE_TOOL_FAILURE_RATE:-' + str( failure_rate ) + '} exec \"' +
+            sys.executable + '\" \"' + os.path.abspath( __file__ ).replace( '.pyc' , '.py' ) + '\" ' + tool + ' \"$@\"\n' )
+        f.close()
+        os.chmod( filename , 0755 )
+    print 'installed ' + ', '.join( sorted( tools.keys() ) ) + ' in ' + bin_directory
+
+# take as long as  <tool>  should, then maybe fail, then do the work
+def run_fake_tool( tool , arguments ):
+    delay = FAKE_TOOL_DELAYS[tool]*float( os.environ.get( 'FAKE_TOOL_DELAY_SCALE' , 1 ) )
+    options = {}
+    if not tool in ['probe' , 'pymol']:
+        options = parse_tool_arguments( arguments )
+    if tool == 'relax':
+        delay *= int( options.get( 'nstruct' , 1 ) )
+    time.sleep( delay )
+
+    if tool in FAKE_TOOL_FAILURES and random.random() < float( os.environ.get( 'FAKE_TOOL_FAILURE_RATE' , 0 ) ):
+        sys.stderr.write( 'fake ' + tool + ' failed (on purpose)\n' )
+        return 1
+
+    if tool == 'psiblast':
+        fake_psiblast( options )
+    elif tool == 'blastdbcmd':
+        fake_blastdbcmd( options )
+    elif tool == 'makeblastdb':
+        fake_makeblastdb( options )
+    elif tool == 'probe':
+        fake_probe( arguments )
+    elif tool == 'ddg_monomer':
+        fake_ddg_monomer( options )
+    elif tool == 'relax':
+        fake_relax( options )
+    elif tool == 'score':
+        fake_score( options )
+    elif tool == 'pymol':
+        fake_pymol( arguments )
+    return 0
+
+################################################################################
+# MAIN
+
+if __name__ == '__main__':
+    if len( sys.argv ) > 2 and sys.argv[1] == 'install':
+        install_fake_tools( sys.argv[2] , *[float( i ) for i in sys.argv[3:5]] )
+    elif len( sys.argv ) > 1 and sys.argv[1] in FAKE_TOOLS.keys():
+        sys.exit( run_fake_tool( sys.argv[1] , sys.argv[2:] ) )
+    else:
+        print __doc__
+        sys.exit( 1 )
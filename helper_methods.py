@@ -16,13 +16,15 @@ are contained within the script associated with those features
 
 # common modules
 import os
+import re
 import shutil
 import subprocess
 
 # bigger modules
 
 # custom modules
-from vipur_settings import PROTEIN_LETTERS
+from vipur_settings import PROTEIN_LETTERS , COMMAND_SCRATCH_EXTENSION , COMMAND_SCRATCH_OUTPUTS , COMMAND_STAGING_PATH , COMMAND_STAGING_FEATURES , COMMAND_STAGING_INPUT_OPTIONS , COMMAND_STAGING_OUTPUT_OPTIONS
+from process_methods import run_process
 
 ################################################################################
 # METHODS
@@ -68,6 +70,15 @@ def copy_file( filename , destination , display = False ):
             print 'copying ' + os.path.relpath( filename ) + ' to ' + os.path.relpath( destination )
     shutil.copy( filename , destination )
 
+# write  <text>  to  <filename>  under a temporary name and rename it, so
+# readers never see part of it
+def write_file_atomically( filename , text , mode = 'w' ):
+    temporary_filename = filename +'.'+ str( os.getpid() )
+    f = open( temporary_filename , mode )
+    f.write( text )
+    f.close()
+    os.rename( temporary_filename , filename )
+
 
 #####################
 # subprocess wrappers
@@ -111,14 +122,18 @@ def create_executable_str( executable , args = [] , options = {} , out_filename
     return perform
 
 # runs a commandline, usually combined with create_executable_str above
-def run_local_commandline( command , collect_stdout = False ):
+def run_local_commandline( command , collect_stdout = False , log_filename = '' ):
     """
     Runs the explicit  <command>  by performing a system call with subprocess
+
+    Optionally write its output to  <log_filename>  as it runs, returns the
+    exit status (or the output if  <collect_stdout> , for short output like
+    queue job ids)
     """
     # get the output
     print '\n'+ '='*80 + '\nPerforming system call:\n' + command + '\n' + '='*80 +'\n'
     if not collect_stdout:
-        subprocess.call( command , shell = True )    # just the command, no output piping
+        return run_process( command , log_filename )['exit_status']    # just the command, no output piping
 
     # older call that pipes the output into Python for manipulation
     else:
@@ -127,6 +142,55 @@ def run_local_commandline( command , collect_stdout = False ):
         stdout = subprocess.Popen( command , shell = True , stdout = subprocess.PIPE , stdin = subprocess.PIPE , stderr = subprocess.STDOUT ).communicate()[0]#.strip()    # for consistency
         return stdout
 
+# the files  <command>  reads and writes with these options, returns the
+# command using their basenames instead (to run from the directory they are
+# staged in) , the input filenames and the output filenames
+def stage_command_files( command , input_options = COMMAND_STAGING_INPUT_OPTIONS , output_options = COMMAND_STAGING_OUTPUT_OPTIONS ):
+    inputs = []
+    outputs = []
+    for option , filenames in [(i , inputs) for i in input_options] + [(i , outputs) for i in output_options]:
+        pattern = '(?<=\s-'+ re.escape( option ) +' )\S+'
+        for i in re.findall( pattern , command ):
+            if not i in filenames:
+                filenames.append( i )
+        command = re.sub( pattern , lambda x : os.path.basename( x.group( 0 ) ) , command )
+    return command , inputs , outputs
+
+# the shell text to run the command of  <command_dict>  in its own scratch
+# directory (see COMMAND_SCRATCH_EXTENSION), exits with the command's status
+# optionally on node-local storage (see COMMAND_STAGING_PATH)
+def isolate_command( command_dict , extension = COMMAND_SCRATCH_EXTENSION , outputs = COMMAND_SCRATCH_OUTPUTS ,
+        staging_path = COMMAND_STAGING_PATH , staging_features = COMMAND_STAGING_FEATURES ):
+    if not extension:
+        return command_dict['command']
+    output_filename = os.path.abspath( command_dict['output_filename'] )
+    scratch_path = output_filename + extension
+
+    # stay in the scratch directory, ignore the "cd" some commands start with
+    command = re.sub( '^(cd [^;]+; *)+' , '' , command_dict['command'].strip() ).rstrip( ';' )
+
+    # (scratch filename , destination) to move if it succeeds
+    moves = []
+    if command_dict['feature'] in outputs.keys():
+        moves.append( (outputs[command_dict['feature']] , output_filename) )
+    inputs = []
+    if staging_path and command_dict['feature'] in staging_features:
+        # separate for each run on the node, they all see the same directory
+        scratch_path = staging_path +'/'+ os.path.basename( output_filename ) +'.$$'+ extension
+        command , inputs , staged_outputs = stage_command_files( command )
+        # together, one move per directory
+        for i in sorted( set( [os.path.dirname( j ) for j in staged_outputs] ) ):
+            moves.append( (' '.join( [os.path.basename( j ) for j in staged_outputs if os.path.dirname( j ) == i] ) , i +'/') )
+
+    text = 'rm -rf '+ scratch_path +'; mkdir -p '+ scratch_path +' && cd '+ scratch_path
+    if inputs:
+        text += ' && cp '+ ' '.join( inputs ) +' .'
+    text += ' && { '+ command +' ; }; status=$?;'
+    for i , j in moves:
+        text += ' if [ $status = 0 ]; then mv -f '+ i +' '+ j +' 2> /dev/null; fi;'
+    text += ' cd '+ os.path.dirname( output_filename ) +'; rm -rf '+ scratch_path +'; ( exit $status )'
+    return text
+
 #######################
 # preprocessing methods
 
@@ -9,17 +9,25 @@ run methods specifically for submitting jobs in the PBS queuing system
 # IMPORT
 
 # common modules
+import math
+import re
 import subprocess
 import time
 
 # bigger modules
 
 # custom modules
-from vipur_settings import PBS_USER , PBS_ENVIRONMENT_SETUP , PBS_QUEUE_QUOTA , PBS_QUEUE_MONITOR_DELAY , PBS_SERIAL_JOB_OPTIONS , PBS_PARALLEL_JOB_OPTIONS , PBS_BASH_SCRIPT , ROSETTA_ENDING , PBS_PARALLEL_ROSETTA_ENDING , PBS_PARALLEL_ROSETTA_EXECUTION_COMMAND , ROSETTA_RELAX_PARALLEL_OPTIONS
-from helper_methods import run_local_commandline , create_executable_str
+from vipur_settings import PBS_USER , PBS_ENVIRONMENT_SETUP , PBS_QUEUE_QUOTA , PBS_ALLOCATION_CORES , PBS_ALLOCATION_MEMORY , PBS_PARALLEL_NODE_ALLOCATION , PBS_PARALLEL_PROCESSES_ALLOCATION , PBS_QUEUE_MONITOR_DELAY , PBS_SERIAL_JOB_OPTIONS , PBS_PARALLEL_JOB_OPTIONS , PBS_BASH_SCRIPT , ROSETTA_ENDING , PBS_PARALLEL_ROSETTA_ENDING , PBS_PARALLEL_ROSETTA_EXECUTION_COMMAND , ROSETTA_RELAX_PARALLEL_OPTIONS , PBS_BASH_SCRIPT_TEXT , PBS_USE_JOB_ARRAYS , PBS_ARRAY_FEATURES , PBS_ARRAY_OPTION , PBS_ARRAY_INDEX_VARIABLE , SPECULATIVE_EXECUTION
+from helper_methods import run_local_commandline , create_executable_str , isolate_command
 
 from pre_processing import *
-from run_methods import determine_check_successful_function
+from scheduling_methods import determine_command_resources , pack_tasks , determine_occupied_job_resources , write_array_script , unique_script_filenames , group_array_indices , compress_array_indices , get_queue_job_id , prioritize_tasks
+from scheduling_methods import select_packable_tasks , pack_short_tasks , determine_packed_job_resources , get_packed_script_filename , write_packed_job , finish_packed_command , expand_packed_job_status
+from scheduling_methods import select_straggling_tasks , track_job_start_times , determine_job_elapsed_times , record_job_runtime
+from run_methods import determine_check_successful_function , merge_relax_output_for_rescore , determine_task_dependencies , check_command_finished , select_ready_tasks
+from run_methods import record_submitted_jobs , forget_submitted_job , reattach_submitted_jobs
+from run_methods import get_speculative_command_dict , resolve_speculative_commands , stop_speculative_commands , list_speculative_jobs , count_speculative_retry
+from run_methods import start_preprocessing , stream_preprocessed_task_summaries , add_preprocessed_tasks , restore_target_order , stream_postprocessing , finish_postprocessing
 from rosetta_feature_generation import remove_intermediate_ddg_monomer_files
 from post_processing import *
 
@@ -29,7 +37,7 @@ from post_processing import *
 def run_VIPUR_PBS( pdb_filename = '' , variants_filename = '' ,
         out_path = '' , write_numbering_map = True ,
         single_relax = True , delete_intermediate_relax_files = True ,
-        demo = False , rerun_preprocessing = False ):
+        demo = False , rerun_preprocessing = False , use_job_arrays = PBS_USE_JOB_ARRAYS ):
     # for the example input
     if demo:
         pdb_filename = PATH_TO_VIPUR + '/example_input/2C35.pdb'
@@ -107,59 +115,69 @@ def run_VIPUR_PBS( pdb_filename = '' , variants_filename = '' ,
         run_local_commandline( PBS_ENVIRONMENT_SETUP )
 
     # pre processing
+    # in parallel, their jobs are submitted as soon as each is ready
+    target_order = []
+    more_task_summaries = stream_preprocessed_task_summaries( start_preprocessing( target_proteins , write_numbering_map = write_numbering_map ,
+            single_relax = single_relax , rerun_preprocessing = rerun_preprocessing , pymol_environment_setup = PBS_ENVIRONMENT_SETUP ) ,
+        target_order , prepare_task_summary = lambda x , i : prepare_task_summary_PBS( x , target_proteins[i] , single_relax = single_relax , use_job_arrays = use_job_arrays ) )
+
+
+    # run them all
+#    run_VIPUR_task_summaries_serially( task_summaries , single_relax = single_relax , delete_intermediate_relax_files = delete_intermediate_relax_files )
+    # each is post processed as soon as its jobs finish
     task_summaries = []
-    for i in target_proteins:
-        # guess what the task summary filename 'would' be, if it exists, keep going...
-        task_summary_filename = i[3]*bool( i[3] ) +'/'+ get_root_filename( i[0] ).split( '/' )[-1] + '.task_summary'
-        if os.path.isfile( task_summary_filename ) and not rerun_preprocessing:
-            print 'hmmm, ' + i[0] + ' seems to have run preprocessing already, skipping now'
-            #continue    # skip this one, do not add to list of tasks...?
-            # actually, skip running pre-processing BUT DO add it to the list of tasks
-        else:
-            task_summary_filename = run_preprocessing( i[0] , i[1] ,
-                sequence_only = i[2] , out_path = i[3] ,
-                task_summary_filename = task_summary_filename ,
-                write_numbering_map = write_numbering_map , single_relax = single_relax ,
-                pymol_environment_setup = PBS_ENVIRONMENT_SETUP )
+    postprocessed = {}
+    run_VIPUR_task_summaries_PBS( task_summaries , single_relax = single_relax , delete_intermediate_relax_files = delete_intermediate_relax_files ,
+        more_task_summaries = more_task_summaries , postprocessed = postprocessed )
+    task_summaries = restore_target_order( task_summaries , target_order )
 
 
-        # modify for PBS script
-        task_summary = load_task_summary( task_summary_filename )
-        for j in xrange( len( task_summary['commands'] ) ):
+    # post processing
+    # this look identical!!! :)
+    # anything left over
+    task_summaries = finish_postprocessing( task_summaries , [i[2] for i in target_proteins] , postprocessed )
+
+    return task_summaries
+
+# modify the commands of  <task_summary>  for  <target_protein>  to run in PBS
+# scripts, writes the scripts and the task summary
+def prepare_task_summary_PBS( task_summary , target_protein , single_relax = True , use_job_arrays = PBS_USE_JOB_ARRAYS ):
+    for j in xrange( len( task_summary['commands'] ) ):
 #            pbs_options = {}
 
-            command = task_summary['commands'][j]['command']
+        command = task_summary['commands'][j]['command']
 
-            # add for relax
-            if task_summary['commands'][j]['feature'].replace( '_native' , '' ) == 'relax' and not 'rescore' in task_summary['commands'][j]['feature']:
-                if not PBS_PARALLEL_ROSETTA_ENDING in command:
-                    command = command.replace( ROSETTA_ENDING , PBS_PARALLEL_ROSETTA_ENDING )
-                command = PBS_PARALLEL_ROSETTA_EXECUTION_COMMAND + ' '*bool( PBS_PARALLEL_ROSETTA_EXECUTION_COMMAND ) + command
+        # add for relax
+        # not for separate trajectories in array jobs, each is a single process
+        if task_summary['commands'][j]['feature'].replace( '_native' , '' ) == 'relax' and not 'rescore' in task_summary['commands'][j]['feature'] and (single_relax or not use_job_arrays):
+            if not PBS_PARALLEL_ROSETTA_ENDING in command:
+                command = command.replace( ROSETTA_ENDING , PBS_PARALLEL_ROSETTA_ENDING )
+            command = PBS_PARALLEL_ROSETTA_EXECUTION_COMMAND + ' '*bool( PBS_PARALLEL_ROSETTA_EXECUTION_COMMAND ) + command
 
-                if ROSETTA_RELAX_PARALLEL_OPTIONS:
-                    command += ' '+ ' '.join( ['-'+ k + (' '+ ROSETTA_RELAX_PARALLEL_OPTIONS[k])*bool( ROSETTA_RELAX_PARALLEL_OPTIONS[k] ) for k in ROSETTA_RELAX_PARALLEL_OPTIONS] )
+            if ROSETTA_RELAX_PARALLEL_OPTIONS:
+                command += ' '+ ' '.join( ['-'+ k + (' '+ ROSETTA_RELAX_PARALLEL_OPTIONS[k])*bool( ROSETTA_RELAX_PARALLEL_OPTIONS[k] ) for k in ROSETTA_RELAX_PARALLEL_OPTIONS] )
 #                command += ' -jd2:mpi_file_buf_job_distributor false'
 #                command += ' -run:multiple_processes_writing_to_one_directory'
-                
-                # also use the parallel options
-                pbs_options = 'parallel'#.update( PBS_PARALLEL_JOB_OPTIONS )
-            else:
-                pbs_options = 'serial'#.update( PBS_SERIAL_JOB_OPTIONS )
-
-            # put "cd" in front
-#            command = ('#!/bin/bash\n\ncd '+ i[3] +'\n\n')*bool( i[3] ) + command +'\n\n'
-            command = ('cd '+ i[3] +';')*bool( i[3] ) + command
             
-            # modify the task summary
-            task_summary['commands'][j]['command'] = command
-            
-            
-            # actually write the script...
-            # don't worry about optional #PBS header info
+            # also use the parallel options
+            pbs_options = 'parallel'#.update( PBS_PARALLEL_JOB_OPTIONS )
+        else:
+            pbs_options = 'serial'#.update( PBS_SERIAL_JOB_OPTIONS )
+
+        # put "cd" in front
+#            command = ('#!/bin/bash\n\ncd '+ target_protein[3] +'\n\n')*bool( target_protein[3] ) + command +'\n\n'
+        command = ('cd '+ target_protein[3] +';')*bool( target_protein[3] ) + command
+        
+        # modify the task summary
+        task_summary['commands'][j]['command'] = command
+        
+        
+        # actually write the script...
+        # don't worry about optional #PBS header info
 #            print i    # debug
-            # need to add the variant? no, just use the output_filename for this
-            script_filename = i[3] + '/'*bool( i[3] ) + get_root_filename( task_summary['commands'][j]['output_filename'].split( '/' )[-1] ) +'.'+ task_summary['commands'][j]['feature'] + '.pbs_script.sh'
-            task_summary['commands'][j]['script_filename'] = script_filename
+        # need to add the variant? no, just use the output_filename for this
+        script_filename = target_protein[3] + '/'*bool( target_protein[3] ) + get_root_filename( task_summary['commands'][j]['output_filename'].split( '/' )[-1] ) +'.'+ task_summary['commands'][j]['feature'] + '.pbs_script.sh'
+        task_summary['commands'][j]['script_filename'] = script_filename
 #            if 'variant' in task_summary['commands'][j].keys():
 #                print task_summary['commands'][j]['variant']
 #            print script_filename    # debug
@@ -167,47 +185,34 @@ def run_VIPUR_PBS( pdb_filename = '' , variants_filename = '' ,
 
 #            print '$$' , command
 #            print '$$' , PBS_BAST_SCRIPT( command )
-            f = open( script_filename , 'w' )
-            f.write( PBS_BASH_SCRIPT( command ) )
-            f.close()
-            
-            # use the script filename as the source for any log files
-            # control the output and error paths
+        f = open( script_filename , 'w' )
+        f.write( PBS_BASH_SCRIPT( isolate_command( task_summary['commands'][j] ) ) )
+        f.close()
+        
+        # use the script filename as the source for any log files
+        # control the output and error paths
 #            for k in pbs_options.keys():
 #                if '__call__' in dir( pbs_options[k] ):
 #                    pbs_options[k] = pbs_options[k]( script_filename )
 
-            # also generate the pbs call? might as well, keep it simple...
+        # also generate the pbs call? might as well, keep it simple...
 #            task_summary['commands'][j]['qsub_command'] = create_executable_str( 'qsub' , [script_filename] , pbs_options )
-            # no, uses ":" and "," characters...
-            task_summary['commands'][j]['queue'] = pbs_options
-
-        # rewrite the task summary
-        write_task_summary( task_summary , task_summary_filename )
-
-        task_summaries.append( task_summary )#_filename )
-
-
-    # run them all
-#    run_VIPUR_task_summaries_serially( task_summaries , single_relax = single_relax , delete_intermediate_relax_files = delete_intermediate_relax_files )
-    run_VIPUR_task_summaries_PBS( task_summaries , single_relax = single_relax , delete_intermediate_relax_files = delete_intermediate_relax_files )
+        # no, uses ":" and "," characters...
+        task_summary['commands'][j]['queue'] = pbs_options
 
+    # one array job per protein + feature for the relax trajectories
+    if use_job_arrays and not single_relax:
+        write_pbs_array_scripts( task_summary , target_protein[3] + '/'*bool( target_protein[3] ) + get_root_filename( target_protein[0] ).split( '/' )[-1] )
 
-    # post processing
-    # this look identical!!! :)
-    for i in xrange( len( task_summaries ) ):
-        # always okay to rerun post processing...should not make any difference
-        sequence_only = target_proteins[i][2]
-#        print sequence_only , 'post processing'    # debug
-        print '\n\n\nExtracting and Analyzing the Results:\n\n'
-        task_summaries[i] = run_postprocessing( task_summaries[i] , sequence_only = sequence_only )
+    # rewrite the task summary
+    write_task_summary( task_summary , task_summary['filenames']['task_summary_filename'] )
 
-    return task_summaries
+    return task_summary
 
 # different from serial method
 # collect up all jobs at once, fire off serially (lol) to queue
 # need to be cognizant of queue status, rescore must occur later
-def run_VIPUR_task_summaries_PBS( task_summaries , single_relax = True , delete_intermediate_relax_files = True ):
+def run_VIPUR_task_summaries_PBS( task_summaries , single_relax = True , delete_intermediate_relax_files = True , more_task_summaries = None , postprocessed = None ):
     # queue command can be derived from task itself
     # this method will run...until all jobs are complete
     
@@ -218,17 +223,12 @@ def run_VIPUR_task_summaries_PBS( task_summaries , single_relax = True , delete_
     
     # make a list of ALL jobs instead of per protein tasks - all commands have "cd" if there is an "out_path"
     # as a reference, need to track attempts etc. directly, rewrite task summaries frequently
-    non_rescore_tasks = sum( [[(i , j) for j in xrange( len( task_summaries[i]['commands'] ) )] for i in xrange( len( task_summaries ) )] , [] )
-    rescore_tasks = [i for i in non_rescore_tasks if 'rescore' in task_summaries[i[0]]['commands'][i[1]]['feature']]
-    # only rescore once ALL are complete
-    non_rescore_tasks = [i for i in non_rescore_tasks if not i in rescore_tasks]
-
+    task_list = sum( [[(i , j) for j in xrange( len( task_summaries[i]['commands'] ) )] for i in xrange( len( task_summaries ) )] , [] )
 
-    run_VIPUR_tasks_PBS( task_summaries , non_rescore_tasks )
-    
-    # run the rescore tasks
-    if rescore_tasks:
-        run_VIPUR_tasks_PBS( task_summaries , rescore_tasks )
+    # rescore waits on its own relax jobs, no need to wait for ALL relax jobs
+    # new proteins are added as they finish pre processing
+    run_VIPUR_tasks_PBS( task_summaries , task_list , single_relax = single_relax , delete_intermediate_relax_files = delete_intermediate_relax_files ,
+        more_task_summaries = more_task_summaries , postprocessed = postprocessed )
     
     # return anything?
     # task summaries should be updated with all the necessary files...
@@ -239,17 +239,38 @@ def run_VIPUR_task_summaries_PBS( task_summaries , single_relax = True , delete_
 
 
 # submit jobs until complete or too many attempts
-def run_VIPUR_tasks_PBS( task_summaries , task_list , max_pbs_tries = 2 , ddg_monomer_cleanup = True , single_relax = True , delete_intermediate_relax_files = False ):
-    # run the non_rescore tasks
+def run_VIPUR_tasks_PBS( task_summaries , task_list , max_pbs_tries = 2 , ddg_monomer_cleanup = True , single_relax = True , delete_intermediate_relax_files = False ,
+        more_task_summaries = None , postprocessed = None , speculate = SPECULATIVE_EXECUTION ):
+    # run the tasks, each only once the tasks it depends on are done
     completed = [i for i in task_list if 'run' in task_summaries[i[0]]['commands'][i[1]] and 'success' in task_summaries[i[0]]['commands'][i[1]]['run']]
+    dependencies = determine_task_dependencies( task_summaries , task_list )
     # should running_or_queued be saved? written to file?
-    running_or_queued = {}
+    # yes, each command records its job id, pick up any from an earlier run
+    running_or_queued = reattach_submitted_jobs( task_summaries , task_list )
+    reattached = running_or_queued.keys()
+    # when each job started running, and duplicates of any stragglers
+    start_times = {}
+    speculative = {}
+    speculated = []
     rounds = 0
     all_completed_jobs = []    # prevents annoying bulk output, only see it the first time it completes
 #    raw_input( 'start submitting + monitoring?' )    # debug
-    while not len( completed ) == len( task_list ):
+    while not len( completed ) == len( task_list ) or more_task_summaries:
         rounds += 1
         print '\n\nQUEUE MONITOR ROUND ' + str( rounds )
+        completed_before = len( completed )
+
+        # jobs for any proteins that finished pre processing
+        if more_task_summaries:
+            new_task_list = add_preprocessed_tasks( task_summaries , more_task_summaries , block = not running_or_queued and len( completed ) == len( task_list ) )
+            if new_task_list is None:
+                more_task_summaries = None
+            elif new_task_list:
+                task_list += new_task_list
+                completed += [i for i in new_task_list if 'run' in task_summaries[i[0]]['commands'][i[1]] and 'success' in task_summaries[i[0]]['commands'][i[1]]['run']]
+                dependencies.update( determine_task_dependencies( task_summaries , new_task_list ) )
+                running_or_queued.update( reattach_submitted_jobs( task_summaries , new_task_list ) )
+                reattached = running_or_queued.keys()
         
         # debug
 #        print running_or_queued
@@ -262,26 +283,86 @@ def run_VIPUR_tasks_PBS( task_summaries , task_list , max_pbs_tries = 2 , ddg_mo
         #for i in queue_status.keys():
         #    if queue_status[i] in ['R' , 'Q']:
 
-        queue_space_occupied = len( [i for i in queue_status.values() if not i in ['C' , 'R']] )    # ignore "C"ompleted jobs, "R"unning job quota are not set by us...
+        # elements of an array job only count once
+        queue_space_occupied = len( set( [get_queue_job_id( i ) for i in queue_status.keys() if not queue_status[i] in PBS_FINISHED_STATES + ['R']] ) )    # ignore "C"ompleted jobs, "R"unning job quota are not set by us...
         # if your queue system does not have a separate "R"un quota, remove 'R' from the above!
         available_space = PBS_QUEUE_QUOTA - queue_space_occupied
+        # each packed command reports the status of its job
+        queue_status = expand_packed_job_status( queue_status , running_or_queued.keys() )
+        # jobs from before a restart that the queue already forgot are done
+        for job_id in reattached:
+            if not job_id in queue_status.keys():
+                queue_status[job_id] = PBS_FINISHED_STATES[0]
+        reattached = []
+        track_job_start_times( start_times , queue_status , running_or_queued.keys() )
+
+        # whichever copy of a duplicated job finishes first counts, delete the other
+        if speculative:
+            retried = []
+            for job_id in resolve_speculative_commands( speculative , lambda x : not x in queue_status.keys() or queue_status[x] in PBS_FINISHED_STATES ,
+                    lambda x : run_local_commandline( 'qdel ' + x ) , single_relax = single_relax , retried = retried ):
+                queue_status[job_id] = PBS_FINISHED_STATES[0]
+            for job_id in retried:
+                count_speculative_retry( task_summaries[running_or_queued[job_id][0]]['commands'][running_or_queued[job_id][1]] )
+
+        # also cannot ask for more than our allocation (duplicates included)
+        occupied_cores , occupied_memory = determine_occupied_job_resources( task_summaries , dict( running_or_queued.items() + list_speculative_jobs( speculative , running_or_queued ).items() ) ,
+            PBS_ALLOCATION_CORES , PBS_ALLOCATION_MEMORY , resource_function = determine_command_resources_PBS )
+        print str( occupied_cores ) + ' cores and ' + str( occupied_memory ) + 'GB requested by jobs queued or running'
 
         
         # launch next jobs in available slots
         if available_space:
             print str( queue_space_occupied ) + ' jobs queued or running, could submit up to ' + str( available_space ) + ' more'
-            # choose the next job
-            jobs_to_run = [i for i in task_list if
-                not i in completed and
-                not i in running_or_queued.values() and
-                not ( 'run' in task_summaries[i[0]]['commands'][i[1]] and
-                    ('success' in task_summaries[i[0]]['commands'][i[1]]['run'] or
-                    'failure' in task_summaries[i[0]]['commands'][i[1]]['run']) )
-                ]
+            # choose the next job, only those whose dependencies are done
+            jobs_to_run = select_ready_tasks( task_summaries ,
+                [i for i in task_list if not i in completed and not i in running_or_queued.values()] ,
+                dependencies )
+            # jobs that can never run are done too
+            completed += [i for i in task_list if not i in completed and not i in running_or_queued.values() and check_command_finished( task_summaries[i[0]]['commands'][i[1]] )]
+            if not jobs_to_run and not running_or_queued and not len( completed ) == len( task_list ) and not more_task_summaries:
+                raise Exception( '??? none of the remaining jobs can run, the jobs they depend on are not finished ???' )
             print str( len( jobs_to_run ) ) + ' jobs still need to finish (after the currently running jobs complete)'
+            # the longest critical path first, the rest backfill
+            jobs_to_run = prioritize_tasks( task_summaries , jobs_to_run , dependencies )
+
+            # array job elements go in together, one qsub per script
+            array_jobs = [i for i in jobs_to_run if 'array_index' in task_summaries[i[0]]['commands'][i[1]].keys()]
+            for script_filename in unique_script_filenames( task_summaries , array_jobs ):
+                job_pairs = [i for i in array_jobs if task_summaries[i[0]]['commands'][i[1]]['script_filename'] == script_filename]
+
+                # only as many elements as fit
+                cores , memory = determine_command_resources_PBS( task_summaries[job_pairs[0][0]] , task_summaries[job_pairs[0][0]]['commands'][job_pairs[0][1]] )
+                cores = min( cores , PBS_ALLOCATION_CORES )
+                memory = min( memory , PBS_ALLOCATION_MEMORY )
+                limit = int( min( ( PBS_ALLOCATION_CORES - occupied_cores )/cores , ( PBS_ALLOCATION_MEMORY - occupied_memory )/memory if memory else float( 'inf' ) , len( job_pairs ) ) )
+                if limit < 1 or available_space < 1:
+                    continue
+
+                available_space -= submit_pbs_array( task_summaries , job_pairs[:limit] , running_or_queued )
+                occupied_cores += limit*cores
+                occupied_memory += limit*memory
+            jobs_to_run = [i for i in jobs_to_run if not i in array_jobs]
+
+            # short commands share a job, only worth it for more than one
+            for job_pairs in pack_short_tasks( task_summaries , select_packable_tasks( task_summaries , jobs_to_run ) , resource_function = determine_command_resources_PBS ):
+                if len( job_pairs ) < 2 or available_space < 1:
+                    continue
+                workers , cores , memory = determine_packed_job_resources( task_summaries , job_pairs ,
+                    total_cores = PBS_ALLOCATION_CORES , total_memory = PBS_ALLOCATION_MEMORY , resource_function = determine_command_resources_PBS )
+                if cores > PBS_ALLOCATION_CORES - occupied_cores or memory > PBS_ALLOCATION_MEMORY - occupied_memory:
+                    continue
+
+                submit_packed_job_PBS( task_summaries , job_pairs , running_or_queued , workers , cores , memory ,
+                    single_relax = single_relax , delete_intermediate_relax_files = delete_intermediate_relax_files )
+                available_space -= 1
+                occupied_cores += cores
+                occupied_memory += memory
+                jobs_to_run = [i for i in jobs_to_run if not i in job_pairs]
             
-            # only the next few
-            for i in jobs_to_run[:available_space]:
+            # only the next few, as many as fit
+            for i in pack_tasks( task_summaries , jobs_to_run , PBS_ALLOCATION_CORES - occupied_cores , PBS_ALLOCATION_MEMORY - occupied_memory ,
+                    PBS_ALLOCATION_CORES , PBS_ALLOCATION_MEMORY , resource_function = determine_command_resources_PBS )[:max( available_space , 0 )]:
                 command_dict = task_summaries[i[0]]['commands'][i[1]]
             
                 # write scripts as part of pre processing?...yeah...
@@ -292,41 +373,7 @@ def run_VIPUR_tasks_PBS( task_summaries , task_list , max_pbs_tries = 2 , ddg_mo
             
                 # if its a rescore and relax jobs were separated, need to recombine them!
                 if 'rescore' in command_dict['feature']:
-                    # combine the individual relax runs
-                    #relax_commands = [i for i in task_summary['commands'] if i['feature'].replace( '_native' , '' ) == 'relax']
-                    #silent_filenames = [j['output_filename'] for j in relax_commands if j['variant'] == i['variant'] and 'run' in j.keys() and j['run'] == 'success']
-                    silent_filenames = [j['output_filename'] for j in task_summaries[i[0]]['commands'] if
-                        j['feature'].replace( '_native' , '' ) == 'relax' and
-                        j['variant'] == command_dict['variant'] and
-                        'run' in j.keys() and
-                        'success' in j['run']
-                        ]
-                    # actually need to identify the combined_silent_filename, be sure the relax files have not already been merged
-                    # which variant
-                    target_variant = [j for j in task_summaries[i[0]]['variants'].keys() if j.split( '_' )[-1] == command_dict['variant'] and j.split( '_' )[0] in command_dict['command']]
-                    if not target_variant:
-                        # its native
-                        combined_silent_filename = task_summaries[i[0]]['other']['combined_native_silent_filename']
-                        combined_score_filename = task_summaries[i[0]]['other']['combined_native_score_filename']
-                    elif len( target_variant ) > 1:
-                        raise Exception( '??? found more than on matching variant ???\n' + ', '.join( target_variant ) )
-                    else:
-                        # found it
-                        combined_silent_filename = task_summaries[i[0]]['variants'][target_variant[0]]['combined_silent_filename']
-                        combined_score_filename = task_summaries[i[0]]['variants'][target_variant[0]]['combined_score_filename']
-
-                    #if not single_relax:    # AND post processing has not already be run...scan for the combined silent file
-                    if not single_relax and not os.path.isfile( combined_silent_filename ):
-                        if not len( silent_filenames ) == ROSETTA_RELAX_OPTIONS['nstruct']:
-                            raise Exception( '??? somehow the matching relax run(s) has failed ???\n' + str( i ) )
-                        score_filenames = [j.replace( '.silent' , '.sc' ) for j in silent_filenames]
-
-                        merge_rosetta_relax_output( silent_filenames , combined_silent_filename , score_filenames , combined_score_filename , delete_old_files = delete_intermediate_relax_files )
-                        # rescore already knows the proper filename
-                    else:
-                        # just a single match for each
-                        # output filename should be correct as is :)
-                        None
+                    merge_relax_output_for_rescore( task_summaries[i[0]] , command_dict , single_relax = single_relax , delete_intermediate_relax_files = delete_intermediate_relax_files )
 
             
                 # submit this script using a queue command
@@ -355,6 +402,13 @@ def run_VIPUR_tasks_PBS( task_summaries , task_list , max_pbs_tries = 2 , ddg_mo
                 # assume its queue
                 running_or_queued[new_job_id] = i
 
+            # and remember them, in case this run is interrupted
+            record_submitted_jobs( task_summaries , running_or_queued )
+
+            # duplicate any stragglers, into whatever room is left
+            if speculate:
+                submit_speculative_jobs_PBS( task_summaries , running_or_queued , speculative , speculated , start_times )
+
         else:
             print 'no new \"positions\" are available'
 
@@ -371,7 +425,8 @@ def run_VIPUR_tasks_PBS( task_summaries , task_list , max_pbs_tries = 2 , ddg_mo
                 print '\t'+ job_id , queue_status[job_id]# , job_id in running_or_queued.keys()
                 # could just skip it all now?
         
-            if queue_status[job_id] == 'C' and job_id in running_or_queued.keys():
+            # unless a duplicate still runs as the next try
+            if queue_status[job_id] in PBS_FINISHED_STATES and job_id in running_or_queued.keys() and not job_id in speculative.keys():
                 task_id = running_or_queued[job_id][0]
                 command_index = running_or_queued[job_id][1]
                 command_dict = task_summaries[task_id]['commands'][command_index]
@@ -406,21 +461,26 @@ def run_VIPUR_tasks_PBS( task_summaries , task_list , max_pbs_tries = 2 , ddg_mo
                     print job_id + ' completed successfully'
                     failure_summary = 'success' #+ str( tries ) + ' tries'
                 else:
-                    # record the number of tries
-                    print job_id + ' completed' + ' successfully'*complete
+                    # record the number of tries, submit it again
+                    print job_id + ' failed, will try again'
                     failure_summary = str( tries )
                 
                 # update the record
                 print 'updating with: ' + failure_summary    # debug
                 task_summaries[task_id]['commands'][command_index]['run'] = failure_summary
+                record_job_runtime( command_dict , start_times , job_id )
+                finish_packed_command( command_dict )
+                forget_submitted_job( command_dict )
             
                 # optionally cleanup
                 if ddg_monomer_cleanup and command_dict['feature'] == 'ddg_monomer':#'ddg' in i['output_filename']:
                     print 'ddg_monomer writes useless output files, deleting these now...'
-                    remove_intermediate_ddg_monomer_files()
+                    remove_intermediate_ddg_monomer_files( task_summaries[task_id]['out_path'] )
 
                 # jobs that have since been completed - consider them complete?
-                completed.append( running_or_queued[job_id] )    # good, so this grows
+                # not until they succeed or run out of tries, then they are submitted again
+                if check_command_finished( command_dict ):
+                    completed.append( running_or_queued[job_id] )    # good, so this grows
                 del running_or_queued[job_id]
                 # remove jobs to run?
 #                print 'updating the status...'    # debug
@@ -430,19 +490,22 @@ def run_VIPUR_tasks_PBS( task_summaries , task_list , max_pbs_tries = 2 , ddg_mo
 #            else:
 #                still_running += 1
 #        print str( still_running) + ' jobs still running (or queued)...'
-            if queue_status[job_id] == 'C' and not job_id in all_completed_jobs:
+            if queue_status[job_id] in PBS_FINISHED_STATES and not job_id in all_completed_jobs:
                 all_completed_jobs.append( job_id )    # prevent redundant update info
 
 
         # update task_summaries e.g. write them!
         # modified: so the task summary records its own name...bah!
+        # only what changed, appended to their journals
         for i in task_summaries:
             if not 'task_summary_filename' in i['filenames'].keys():
                 raise NotImplementedError( 'should input the task summary filename (not the summary itself)...' )
             else:
                 # write it out
-                print 'updating: ' + i['filenames']['task_summary_filename']
-                write_task_summary( i , i['filenames']['task_summary_filename'] )
+                journal_task_summary( i , i['filenames']['task_summary_filename'] )
+        # post process proteins that just finished
+        if len( completed ) > completed_before and not postprocessed is None:
+            stream_postprocessing( task_summaries , postprocessed )
 
         
         # pause...
@@ -453,8 +516,12 @@ def run_VIPUR_tasks_PBS( task_summaries , task_list , max_pbs_tries = 2 , ddg_mo
 
 #        raw_input( 'continue to next round?' )    # debug
 
+    # any duplicates left lost the race
+    stop_speculative_commands( speculative , lambda x : run_local_commandline( 'qdel ' + x ) )
+
     # return anything?
     # write one last time?
+    # also compacts the journals
     for i in task_summaries:
         if not 'task_summary_filename' in i['filenames'].keys():
             raise NotImplementedError( 'should input the task summary filename (not the summary itself)...' )
@@ -462,14 +529,165 @@ def run_VIPUR_tasks_PBS( task_summaries , task_list , max_pbs_tries = 2 , ddg_mo
             # write it out
             write_task_summary( i , i['filenames']['task_summary_filename'] )
 
+################################################################################
+# PBS PACKED JOBS
+
+# submit several short commands as one job, batch_driver.py runs them
+# <workers>  at a time, records each as "<job id>+<index>" in  <running_or_queued>
+def submit_packed_job_PBS( task_summaries , job_pairs , running_or_queued , workers , cores , memory , single_relax = True , delete_intermediate_relax_files = False ):
+    for i in job_pairs:
+        command_dict = task_summaries[i[0]]['commands'][i[1]]
+        if 'rescore' in command_dict['feature']:
+            merge_relax_output_for_rescore( task_summaries[i[0]] , command_dict , single_relax = single_relax , delete_intermediate_relax_files = delete_intermediate_relax_files )
+
+    script_filename = get_packed_script_filename( task_summaries , job_pairs )
+    write_packed_job( task_summaries , job_pairs , script_filename , workers , header = PBS_BASH_SCRIPT_TEXT )
+
+    # the serial queue, but with room for all of them
+    pbs_options = {}
+    pbs_options.update( PBS_SERIAL_JOB_OPTIONS )
+    for k in pbs_options.keys():
+        if '__call__' in dir( pbs_options[k] ):
+            pbs_options[k] = pbs_options[k]( script_filename )
+    pbs_options['l'] = re.sub( 'ppn=\d+' , 'ppn=' + str( cores ) , pbs_options['l'] )
+    pbs_options['l'] = re.sub( 'mem=\d+gb' , 'mem=' + str( int( math.ceil( memory ) ) ) + 'gb' , pbs_options['l'] )
+
+    new_job_id = run_local_commandline( create_executable_str( 'qsub' , [script_filename] , pbs_options ) , collect_stdout = True )
+    new_job_id = new_job_id.strip()
+    if '.' in new_job_id:
+        new_job_id = new_job_id[:new_job_id.find( '.' )]
+    print 'submitted ' + new_job_id + ' running ' + str( len( job_pairs ) ) + ' commands, ' + str( workers ) + ' at a time'
+
+    for i in job_pairs:
+        command_dict = task_summaries[i[0]]['commands'][i[1]]
+        command_dict['element_limit'] = str( workers )
+        running_or_queued[new_job_id +'+'+ command_dict['pack_index']] = i
+
+################################################################################
+# PBS SPECULATIVE JOBS
+
+# submit a duplicate of each job taking much longer than its siblings (see
+# select_straggling_tasks), as many as fit in the allocation
+# records each in  <speculative>  by the job id of the original
+def submit_speculative_jobs_PBS( task_summaries , running_or_queued , speculative , speculated , start_times ):
+    job_ids = dict( [(j , i) for i , j in running_or_queued.items()] )
+    stragglers = select_straggling_tasks( task_summaries , determine_job_elapsed_times( start_times , running_or_queued ) , speculated )
+    occupied_cores , occupied_memory = determine_occupied_job_resources( task_summaries , dict( running_or_queued.items() + list_speculative_jobs( speculative , running_or_queued ).items() ) ,
+        PBS_ALLOCATION_CORES , PBS_ALLOCATION_MEMORY , resource_function = determine_command_resources_PBS )
+    for i in pack_tasks( task_summaries , stragglers , PBS_ALLOCATION_CORES - occupied_cores , PBS_ALLOCATION_MEMORY - occupied_memory ,
+            PBS_ALLOCATION_CORES , PBS_ALLOCATION_MEMORY , resource_function = determine_command_resources_PBS ):
+        command_dict = task_summaries[i[0]]['commands'][i[1]]
+        speculative_dict = get_speculative_command_dict( command_dict )
+
+        # its own script, same command into its own output files
+        script_filename = os.path.splitext( speculative_dict['output_filename'] )[0] +'.'+ command_dict['feature'] + '.pbs_script.sh'
+        f = open( script_filename , 'w' )
+        f.write( PBS_BASH_SCRIPT( isolate_command( speculative_dict ) ) )
+        f.close()
+
+        # the same queue as the original
+        pbs_options = {}
+        if command_dict.get( 'queue' ) == 'parallel':
+            pbs_options.update( PBS_PARALLEL_JOB_OPTIONS )
+        else:
+            pbs_options.update( PBS_SERIAL_JOB_OPTIONS )
+        for k in pbs_options.keys():
+            if '__call__' in dir( pbs_options[k] ):
+                pbs_options[k] = pbs_options[k]( script_filename )
+
+        new_job_id = run_local_commandline( create_executable_str( 'qsub' , [script_filename] , pbs_options ) , collect_stdout = True )
+        new_job_id = new_job_id.strip()
+        if '.' in new_job_id:
+            new_job_id = new_job_id[:new_job_id.find( '.' )]
+        print 'submitted ' + new_job_id + ', a duplicate of the straggling job ' + job_ids[i]
+
+        speculative[job_ids[i]] = (command_dict , job_ids[i] , new_job_id , speculative_dict)
+        speculated.append( i )
+
+################################################################################
+# PBS ARRAY JOBS
+
+# write one script per feature for the commands in  <features>  (relax
+# trajectories), the commands are run by their array index
+def write_pbs_array_scripts( task_summary , script_root , features = PBS_ARRAY_FEATURES ):
+    for feature in features:
+        command_indices = [j for j in xrange( len( task_summary['commands'] ) ) if task_summary['commands'][j]['feature'] == feature]
+        if not command_indices:
+            continue
+
+        script_filename = script_root +'.'+ feature + '.pbs_array_script.sh'
+        for k in xrange( len( command_indices ) ):
+            task_summary['commands'][command_indices[k]]['array_index'] = str( k )
+            task_summary['commands'][command_indices[k]]['script_filename'] = script_filename
+            # each element is a single process
+            task_summary['commands'][command_indices[k]]['queue'] = 'serial'
+        write_array_script( script_filename , [isolate_command( task_summary['commands'][j] ) for j in command_indices] , PBS_ARRAY_INDEX_VARIABLE ,
+            header = PBS_BASH_SCRIPT_TEXT )
+
+# submit these elements of an array job, only the indices in  <job_pairs>
+# e.g. only the ones that failed
+# records each element as "<job id>[<array index>]" in  <running_or_queued>
+# returns the number of qsub calls
+def submit_pbs_array( task_summaries , job_pairs , running_or_queued , array_option = PBS_ARRAY_OPTION , index_variable = PBS_ARRAY_INDEX_VARIABLE ):
+    command_dicts = dict( [(task_summaries[i[0]]['commands'][i[1]]['array_index'] , i) for i in job_pairs] )
+    script_filename = task_summaries[job_pairs[0][0]]['commands'][job_pairs[0][1]]['script_filename']
+
+    # Torque takes a list of indices, PBS Pro only takes ranges
+    array_indices = [int( i ) for i in command_dicts.keys()]
+    if array_option == 't':
+        submissions = [(compress_array_indices( array_indices ) , array_indices)]
+    else:
+        submissions = [(str( i[0] ) +'-'+ str( i[1] ) , range( i[0] , i[1] + 1 )) for i in group_array_indices( array_indices )]
+
+    for array_range , array_indices in submissions:
+        pbs_options = {}
+        pbs_options.update( PBS_SERIAL_JOB_OPTIONS )
+        for k in pbs_options.keys():
+            if '__call__' in dir( pbs_options[k] ):
+                pbs_options[k] = pbs_options[k]( script_filename )
+        if len( array_indices ) == 1 and not array_option == 't':
+            # a range of one is not allowed, set the index directly
+            pbs_options['v'] = index_variable +'='+ str( array_indices[0] )
+        else:
+            pbs_options[array_option] = array_range
+
+        pbs_command = create_executable_str( 'qsub' , [script_filename] , pbs_options )
+        new_job_id = run_local_commandline( pbs_command , collect_stdout = True )
+        new_job_id = new_job_id.strip()
+        if '.' in new_job_id:
+            new_job_id = new_job_id[:new_job_id.find( '.' )]
+        print 'submitted ' + new_job_id + ' ' + array_range
+
+        base_id = new_job_id.split( '[' )[0]
+        for i in array_indices:
+            if 'v' in pbs_options.keys():
+                running_or_queued[base_id] = command_dicts[str( i )]
+            else:
+                running_or_queued[base_id +'['+ str( i ) +']'] = command_dicts[str( i )]
+
+    return len( submissions )
+
 ################################################################################
 # PBS INTERACTION METHODS
 
+# job states that will not change anymore, "X" for finished PBS Pro array elements
+PBS_FINISHED_STATES = ['C' , 'X' , 'F']
+
+# PBS reserves whatever the queue asks for, not just what the command uses
+def determine_command_resources_PBS( task_summary , command_dict ):
+    cores , memory = determine_command_resources( task_summary , command_dict )
+    if 'queue' in command_dict.keys() and command_dict['queue'] == 'parallel':
+        cores = max( cores , PBS_PARALLEL_NODE_ALLOCATION*PBS_PARALLEL_PROCESSES_ALLOCATION )
+    return cores , memory
+
 # ASSUMES it is the ONLY application submitting jobs as this user...
 # simple parse/scan the queue, use qstat -u 
-def get_pbs_queue_status( user = PBS_USER , header_lines = 5 , trailer_lines = 1 , only_job_status = True ):
+def get_pbs_queue_status( user = PBS_USER , header_lines = 5 , trailer_lines = 1 , only_job_status = True , array_elements = PBS_USE_JOB_ARRAYS ):
     # header_lines = 2 for FULL queue, = 5 for USER queue ("-u")
     command = 'qstat'
+    if array_elements:
+        # list each array job element e.g. "123[5]" separately
+        command += ' -t'
     if user:
         command += ' -u ' + user
 
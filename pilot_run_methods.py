@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+# :noTabs=true:
+
+"""
+run methods for the "pilot" mode, a few long-lived workers (local processes,
+or SLURM/PBS jobs) pull commands from a shared task store until it is
+drained, so each command does not wait in the queue on its own
+
+these methods only add commands to the store as they become ready and
+watch the store for the results
+"""
+
+################################################################################
+# IMPORT
+
+# common modules
+import os
+import re
+import subprocess
+import time
+
+# bigger modules
+
+# custom modules
+from vipur_settings import PILOT_WORKERS , PILOT_QUEUE , PILOT_WORKER_CORES , PILOT_WORKER_MEMORY , PILOT_WORKER_IDLE_TIMEOUT , PILOT_WORKER_HEARTBEAT , PILOT_WORKER_LEASE , PILOT_MONITOR_DELAY , PILOT_TASK_STORE_FILENAME , PILOT_WORKER_COMMAND
+from vipur_settings import SLURM_BASH_SCRIPT , SLURM_JOB_OPTIONS , PBS_BASH_SCRIPT , PBS_SERIAL_JOB_OPTIONS
+from helper_methods import run_local_commandline , create_executable_str , isolate_command
+
+from pre_processing import *
+from run_methods import determine_target_proteins , determine_check_successful_function , interpret_check_successful , merge_relax_output_for_rescore , determine_task_dependencies , check_command_finished , select_ready_tasks , determine_tasks_to_run , get_command_log_filename
+from run_methods import start_preprocessing , stream_preprocessed_task_summaries , add_preprocessed_tasks , restore_target_order , stream_postprocessing , finish_postprocessing
+from scheduling_methods import determine_task_priorities
+from task_store_methods import create_task_store , add_commands_to_store , release_expired_commands , collect_finished_commands , get_task_store_status , close_task_store
+from rosetta_feature_generation import remove_intermediate_ddg_monomer_files
+from post_processing import *
+
+################################################################################
+# PILOT RUN METHODS
+
+# run until complete or too many attempts
+def run_VIPUR_tasks_with_pilots( task_summaries , task_list , store_filename = PILOT_TASK_STORE_FILENAME ,
+        workers = PILOT_WORKERS , queue = PILOT_QUEUE , max_tries = 2 , single_relax = False , delete_intermediate_relax_files = False ,
+        monitor_delay = PILOT_MONITOR_DELAY , lease = PILOT_WORKER_LEASE , more_task_summaries = None , postprocessed = None ):
+    """
+    Runs the commands in  <task_list>  ((task index , command index) pairs
+    into  <task_summaries>) by starting  <workers>  workers on the  <queue>
+    (local, slurm, or pbs) that pull commands from a task store in
+    <store_filename> , and records the outcome of each command in its "run"
+    entry
+
+    Commands are only added to the store once the commands they depend on are
+    successful, commands that do not pass their success check are added
+    again, up to  <max_tries>  attempts, as are commands whose worker stopped
+    renewing its lease for  <lease>  seconds (it died)
+
+    Optionally add the commands of new task summaries as they are
+    preprocessed, from  <more_task_summaries>  (see
+    stream_preprocessed_task_summaries)
+
+    Optionally post process each protein as soon as its commands are
+    successful, into  <postprocessed>  (see stream_postprocessing)
+    """
+    dependencies = determine_task_dependencies( task_summaries , task_list )
+
+    # skip those that have alreay run
+    queued = determine_tasks_to_run( task_summaries , task_list )
+    tries = dict( [(i , 0) for i in queued] )
+    failure_summaries = dict( [(i , '') for i in queued] )
+    if not queued and not more_task_summaries:
+        return
+
+    # workers can start anywhere, use absolute paths
+    store_filename = os.path.abspath( store_filename )
+    store = create_task_store( store_filename )
+    worker_jobs = start_pilot_workers( store_filename , workers , queue )
+    print 'started ' + str( len( worker_jobs ) ) + ' workers (' + queue + ') for ' + str( len( queued ) ) + ' commands in ' + store_filename
+
+    outstanding = []
+    last_activity = time.time()
+    while queued or outstanding or more_task_summaries:
+        # commands for any proteins that finished preprocessing
+        if more_task_summaries:
+            new_task_list = add_preprocessed_tasks( task_summaries , more_task_summaries , block = not queued and not outstanding )
+            if new_task_list is None:
+                more_task_summaries = None
+            elif new_task_list:
+                task_list += new_task_list
+                dependencies.update( determine_task_dependencies( task_summaries , new_task_list ) )
+                new_task_list = determine_tasks_to_run( task_summaries , new_task_list )
+                queued += new_task_list
+                tries.update( dict( [(i , 0) for i in new_task_list] ) )
+                failure_summaries.update( dict( [(i , '') for i in new_task_list] ) )
+
+        # add any commands whose dependencies are done
+        ready = select_ready_tasks( task_summaries , queued , dependencies )
+        queued = [i for i in queued if not check_command_finished( task_summaries[i[0]]['commands'][i[1]] ) and not i in ready]
+        if queued and not ready and not outstanding and not more_task_summaries:
+            raise Exception( '??? none of the remaining commands can run, their dependencies are not in this set of tasks ???' )
+
+        for i in ready:
+            command_dict = task_summaries[i[0]]['commands'][i[1]]
+            # if its a rescore and relax jobs were separated, need to recombine them!
+            if 'rescore' in command_dict['feature']:
+                merge_relax_output_for_rescore( task_summaries[i[0]] , command_dict , single_relax = single_relax , delete_intermediate_relax_files = delete_intermediate_relax_files )
+            tries[i] += 1
+        if ready:
+            # workers take the longest critical path first
+            priorities = determine_task_priorities( task_summaries , ready , dependencies )
+            add_commands_to_store( store , [(i[0] , i[1] , isolate_command( task_summaries[i[0]]['commands'][i[1]] ) , priorities[i] , get_command_log_filename( task_summaries[i[0]]['commands'][i[1]] )) for i in ready] )
+            outstanding += ready
+
+        # commands whose worker died go back to the store as another
+        # attempt, or fail if that was the last one
+        for i in release_expired_commands( store , lease , [j for j in outstanding if tries[j] >= max_tries] ):
+            print task_summaries[i[0]]['commands'][i[1]]['output_filename'] + ' was lost with its worker, trying again'
+            tries[i] += 1
+            task_summaries[i[0]]['commands'][i[1]]['run'] = str( tries[i] - 1 )
+
+        # assess outcome of completed commands
+        finished = collect_finished_commands( store )
+        for task_index , command_index , exit_status , runtime in finished:
+            i = (task_index , command_index)
+            outstanding.remove( i )
+            command_dict = task_summaries[i[0]]['commands'][i[1]]
+            command_dict['runtime'] = str( int( round( runtime ) ) )
+            check_successful = determine_check_successful_function( command_dict , single_relax = single_relax )
+            complete , failure_summary = interpret_check_successful( check_successful( command_dict ) )
+            failure_summaries[i] += failure_summary
+
+            if complete:
+                command_dict['run'] = 'success'
+            elif tries[i] < max_tries:
+                # try again
+                print command_dict['output_filename'] + ' was not generated properly (exit status ' + str( exit_status ) + '), trying again'
+                command_dict['run'] = str( tries[i] )
+                queued.append( i )
+            else:
+                print command_dict['output_filename'] + ' failed with ' + str( tries[i] ) + ' attempts'
+                command_dict['run'] = str( tries[i] ) +' tries;failure ' + failure_summaries[i]
+
+        status = get_task_store_status( store )
+        if finished:
+            print str( status['pending'] ) + ' commands waiting for a worker, ' + str( status['running'] ) + ' running, ' + str( len( queued ) ) + ' waiting on other commands'
+            # only what changed, appended to their journals
+            for i in set( [j[0] for j in finished] ):
+                journal_task_summary( task_summaries[i] , task_summaries[i]['filenames']['task_summary_filename'] )
+            if not postprocessed is None:
+                stream_postprocessing( task_summaries , postprocessed )
+
+        # workers stop after being idle for a while e.g. waiting for relax
+        # before the rescore commands, start more if nothing is being run
+        # (local workers can be checked directly)
+        if status['running'] or finished:
+            last_activity = time.time()
+        elif status['pending'] and ( ( queue == 'local' and not [i for i in worker_jobs if i.poll() is None] ) or
+                ( not queue == 'local' and time.time() - last_activity > 2*PILOT_WORKER_IDLE_TIMEOUT ) ):
+            print 'no workers are running, starting more'
+            worker_jobs = start_pilot_workers( store_filename , workers , queue )
+            last_activity = time.time()
+
+        # pause...
+        if ( outstanding or more_task_summaries ) and not finished:
+            time.sleep( monitor_delay )
+
+    # let the workers go
+    close_task_store( store )
+    store.close()
+
+# start  <workers>  workers pulling from  <store_filename>
+# local processes (returns the processes) or queue jobs (returns the job ids)
+def start_pilot_workers( store_filename , workers = PILOT_WORKERS , queue = PILOT_QUEUE ,
+        cores = PILOT_WORKER_CORES , memory = PILOT_WORKER_MEMORY , idle_timeout = PILOT_WORKER_IDLE_TIMEOUT , heartbeat = PILOT_WORKER_HEARTBEAT ):
+    worker_jobs = []
+    for i in xrange( workers ):
+        worker_name = queue +'_worker_'+ str( i + 1 )
+        worker_command = PILOT_WORKER_COMMAND +' '+ store_filename +' '+ worker_name +' '+ str( idle_timeout ) +' '+ str( heartbeat )
+
+        if queue == 'local':
+            worker_jobs.append( subprocess.Popen( worker_command , shell = True ) )
+            continue
+        elif not queue in ['slurm' , 'pbs']:
+            raise NotImplementedError( 'cannot start pilot workers on \"' + queue + '\", use local, slurm, or pbs' )
+
+        script_filename = store_filename.replace( '.db' , '' ) +'.'+ worker_name +'.sh'
+        f = open( script_filename , 'w' )
+        if queue == 'slurm':
+            f.write( SLURM_BASH_SCRIPT( worker_command ) )
+            queue_options = {}
+            queue_options.update( SLURM_JOB_OPTIONS )
+        else:
+            # PBS jobs start in the home directory
+            f.write( PBS_BASH_SCRIPT( 'cd $PBS_O_WORKDIR;' + worker_command ) )
+            queue_options = {}
+            queue_options.update( PBS_SERIAL_JOB_OPTIONS )
+        f.close()
+
+        for k in queue_options.keys():
+            if '__call__' in dir( queue_options[k] ):
+                queue_options[k] = queue_options[k]( script_filename )
+        if queue == 'slurm':
+            queue_options['N'] = '1'
+            queue_options['n'] = '1'
+            queue_options['c'] = str( cores )
+            queue_options['-mem'] = str( int( 1024*memory ) )    # MB
+            job_id = run_local_commandline( create_executable_str( 'sbatch' , [script_filename] , queue_options ) , collect_stdout = True )
+            job_id = job_id.strip().split( ' ' )[-1]
+        else:
+            queue_options['l'] = re.sub( 'ppn=\d+' , 'ppn=' + str( cores ) , queue_options['l'] )
+            queue_options['l'] = re.sub( 'mem=\d+gb' , 'mem=' + str( int( memory ) ) + 'gb' , queue_options['l'] )
+            job_id = run_local_commandline( create_executable_str( 'qsub' , [script_filename] , queue_options ) , collect_stdout = True )
+            job_id = job_id.strip().split( '.' )[0]
+        print 'submitted ' + worker_name + ' as ' + job_id
+        worker_jobs.append( job_id )
+
+    return worker_jobs
+
+# collect up all commands across the task summaries and run them together
+def run_VIPUR_task_summaries_with_pilots( task_summaries , workers = PILOT_WORKERS , queue = PILOT_QUEUE ,
+        ddg_monomer_cleanup = True , max_tries = 2 ,
+        single_relax = False , delete_intermediate_relax_files = True , more_task_summaries = None , postprocessed = None ):
+    # reload? really how this should be done...
+    for i in xrange( len( task_summaries ) ):
+        if isinstance( task_summaries[i] , str ):
+            task_summaries[i] = load_task_summary( task_summaries[i] )
+        if not 'task_summary_filename' in task_summaries[i]['filenames'].keys():
+            raise NotImplementedError( 'should input the task summary filename (not the summary itself)...' )
+
+    # make a list of ALL jobs instead of per protein tasks
+    # rescore commands wait for their own relax commands, nothing else
+    task_list = sum( [[(i , j) for j in xrange( len( task_summaries[i]['commands'] ) )] for i in xrange( len( task_summaries ) )] , [] )
+    run_VIPUR_tasks_with_pilots( task_summaries , task_list , workers = workers , queue = queue , max_tries = max_tries ,
+        single_relax = single_relax , delete_intermediate_relax_files = delete_intermediate_relax_files ,
+        more_task_summaries = more_task_summaries , postprocessed = postprocessed )
+
+    # optionally cleanup, ddg_monomer commands "cd" into their out_path
+    # (unless they run in scratch directories)
+    if ddg_monomer_cleanup:
+        for i in task_summaries:
+            if [j for j in i['commands'] if j['feature'] == 'ddg_monomer']:
+                print 'ddg_monomer writes useless output files, deleting these now...'
+                remove_intermediate_ddg_monomer_files( i['out_path'] )
+
+    # rewrite the task summaries
+    for i in xrange( len( task_summaries ) ):
+        write_task_summary( task_summaries[i] , task_summaries[i]['filenames']['task_summary_filename'] )
+        task_summaries[i] = load_task_summary( task_summaries[i]['filenames']['task_summary_filename'] )
+
+    return task_summaries
+
+# identical to run_VIPUR_locally_in_parallel, except for running the commands
+def run_VIPUR_with_pilots( pdb_filename = '' , variants_filename = '' ,
+        out_path = '' , write_numbering_map = True ,
+        single_relax = False , delete_intermediate_relax_files = True ,
+        demo = False , rerun_preprocessing = False , workers = PILOT_WORKERS , queue = PILOT_QUEUE ):
+    target_proteins = determine_target_proteins( pdb_filename , variants_filename , out_path = out_path , demo = demo )
+
+    # pre processing
+    # in parallel, their commands are added as soon as each is ready
+    target_order = []
+    more_task_summaries = stream_preprocessed_task_summaries( start_preprocessing( target_proteins , write_numbering_map = write_numbering_map ,
+        single_relax = single_relax , rerun_preprocessing = rerun_preprocessing ) , target_order )
+
+    # run them all
+    # each is post processed as soon as its commands finish
+    postprocessed = {}
+    task_summaries = run_VIPUR_task_summaries_with_pilots( [] , workers = workers , queue = queue ,
+        single_relax = single_relax , delete_intermediate_relax_files = delete_intermediate_relax_files ,
+        more_task_summaries = more_task_summaries , postprocessed = postprocessed )
+    task_summaries = restore_target_order( task_summaries , target_order )
+
+    # post processing
+    # anything left over
+    task_summaries = finish_postprocessing( task_summaries , [i[2] for i in target_proteins] , postprocessed )
+
+    return task_summaries
+
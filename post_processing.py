@@ -18,7 +18,7 @@ from vipur_settings import AMINOCHANGE_GROUPS , PREDICTION_OUTPUT_HEADER
 
 from pre_processing import load_task_summary
 
-from psiblast_feature_generation import load_numbering_map , extract_pssm_from_psiblast_pssm
+from psiblast_feature_generation import load_numbering_map , extract_pssm_from_psiblast_pssm , load_pssm_arrays , get_pssm_array_position , load_pssm_index , extract_pssm_positions_from_psiblast_pssm
 from probe_feature_generation import extract_accp_from_probe
 from rosetta_feature_generation import extract_score_terms_from_ddg_monomer , extract_scores_from_scorefile , extract_quartile_score_terms_from_scorefiles
 
@@ -27,30 +27,9 @@ from classification import VIPUR_classifier , provide_additional_interpretation
 ################################################################################
 # MAIN POSTPROCESSING
 
-# ...not much it can do if the features are incomplete...
-# though I suppose that is the point, feature generation should take care of this
-
-def run_postprocessing( task_summary_filename , sequence_only = False ):
-    # load the tasks
-    if isinstance( task_summary_filename , str ) and os.path.isfile( task_summary_filename ):
-        task_summary = load_task_summary( task_summary_filename )
-    else:
-        # input is what we want
-        task_summary = task_summary_filename
-
-    # residue map
-    residue_map = {}
-    if 'numbering_map' in task_summary['filenames'].keys():
-#        filename = task_summary['out_path'] +'/'+ task_summary['filenames']['numbering_map']
-        filename = task_summary['filenames']['numbering_map']
-        residue_map = load_numbering_map( filename )
-    
-    
-    # extract the features
-    
-    # determine the "aminochange" values
-    evaluate_aminochange = lambda nat , var : 2 - int( [i for i in AMINOCHANGE_GROUPS if nat in i][0] == [i for i in AMINOCHANGE_GROUPS if var in i][0] ) - int( nat == var )
-
+# the task summary command each feature is extracted from, by feature
+# (relax rescores as "relax_rescore_<variant>")
+def find_important_tasks( task_summary ):
     # do this mapping once, rather than locate each task when needed
     important_tasks = {}
     for i in task_summary['commands']:
@@ -76,6 +55,25 @@ def run_postprocessing( task_summary_filename , sequence_only = False ):
             important_tasks['relax_rescore_' + i['variant']] = i
         #else:
             # misc/relax runs...
+    return important_tasks
+
+# the sequence (psiblast) and structure (probe, ddg_monomer) features of each
+# variant that did not fail, everything except the relax features
+def extract_variant_features( task_summary , important_tasks , sequence_only = False ):
+    # residue map
+    residue_map = {}
+    if 'numbering_map' in task_summary['filenames'].keys():
+#        filename = task_summary['out_path'] +'/'+ task_summary['filenames']['numbering_map']
+        filename = task_summary['filenames']['numbering_map']
+        residue_map = load_numbering_map( filename )
+    
+    
+    # extract the features
+    
+    # determine the "aminochange" values
+    evaluate_aminochange = lambda nat , var : 2 - int( [i for i in AMINOCHANGE_GROUPS if nat in i][0] == [i for i in AMINOCHANGE_GROUPS if var in i][0] ) - int( nat == var )
+
+    variant_features = {}
     
     # psiblast
 #    psiblast_task = [i for i in task_summary['commands'] if i['feature'] == 'psiblast']
@@ -83,9 +81,22 @@ def run_postprocessing( task_summary_filename , sequence_only = False ):
     if not 'psiblast' in important_tasks.keys() or not 'run' in important_tasks['psiblast'].keys() or not 'success' in important_tasks['psiblast']['run']:
         raise Exception( 'psiblast did not complete successfully!!!' )
 
-    pssm = extract_pssm_from_psiblast_pssm( important_tasks['psiblast']['output_filename'] )
+    # as arrays if possible, otherwise parse only the variant positions
+    pssm_filename = important_tasks['psiblast']['output_filename']
+    pssm_arrays = load_pssm_arrays( pssm_filename )
+    pssm_index = not pssm_arrays and load_pssm_index( pssm_filename )
+    if pssm_arrays:
+        positions = range( 1 , len( pssm_arrays['sequence'] ) + 1 )
+        get_pssm_position = lambda x : get_pssm_array_position( pssm_arrays , x )
+    elif pssm_index:
+        positions = range( 1 , len( pssm_index[1] ) + 1 )
+        get_pssm_position = lambda x : extract_pssm_positions_from_psiblast_pssm( pssm_filename , [x] , pssm_index )[x]
+    else:
+        pssm = extract_pssm_from_psiblast_pssm( pssm_filename )
+        positions = pssm.keys()
+        get_pssm_position = lambda x : pssm[x]
     if not residue_map:
-        residue_map = dict( [(str( i ) , str( i )) for i in pssm.keys()] )
+        residue_map = dict( [(str( i ) , str( i )) for i in positions] )
 
     for i in task_summary['variants'].keys():
         if 'failed' in task_summary['variants'][i].keys():
@@ -96,13 +107,14 @@ def run_postprocessing( task_summary_filename , sequence_only = False ):
         pos = int( residue_map[pos] ) + 1    # shifted from parsing
         var = nat[-1]
         nat = nat[0]
+        pssm_position = get_pssm_position( pos )
         
-        task_summary['variants'][i]['features'] = {
+        variant_features[i] = {
             'aminochange' : evaluate_aminochange( nat , var ) ,
-            'pssm_native' : pssm[pos]['log-likelihood'][nat] ,
-            'pssm_variant' : pssm[pos]['log-likelihood'][var] ,
-            'pssm_difference' : pssm[pos]['log-likelihood'][nat] - pssm[pos]['log-likelihood'][var] ,
-            'pssm_information_content' : pssm[pos]['information content'] ,
+            'pssm_native' : pssm_position['log-likelihood'][nat] ,
+            'pssm_variant' : pssm_position['log-likelihood'][var] ,
+            'pssm_difference' : pssm_position['log-likelihood'][nat] - pssm_position['log-likelihood'][var] ,
+            'pssm_information_content' : pssm_position['information content'] ,
             }
 
     if not sequence_only:
@@ -126,7 +138,7 @@ def run_postprocessing( task_summary_filename , sequence_only = False ):
 
             pos = i.split( '_' )[-1][1:-1]
             if pos in accp_dict.keys():
-                task_summary['variants'][i]['features']['probe_accp'] = accp_dict[pos]
+                variant_features[i]['probe_accp'] = accp_dict[pos]
             else:
                 continue
 
@@ -148,9 +160,29 @@ def run_postprocessing( task_summary_filename , sequence_only = False ):
 #                print mutation
 #                print new_key
 #                print ddg_monomer_dict.keys()
-                task_summary['variants'][i]['features']['ddg_' + header[j]] = float( ddg_monomer_dict[new_key][j] )
+                variant_features[i]['ddg_' + header[j]] = float( ddg_monomer_dict[new_key][j] )
                 # added "ddg_" for legacy compatability, is artibrary, make more informative
-        
+
+    return variant_features
+
+# ...not much it can do if the features are incomplete...
+# though I suppose that is the point, feature generation should take care of this
+
+def run_postprocessing( task_summary_filename , sequence_only = False ):
+    # load the tasks
+    if isinstance( task_summary_filename , str ) and os.path.isfile( task_summary_filename ):
+        task_summary = load_task_summary( task_summary_filename )
+    else:
+        # input is what we want
+        task_summary = task_summary_filename
+
+    # extract the features
+    important_tasks = find_important_tasks( task_summary )
+    variant_features = extract_variant_features( task_summary , important_tasks , sequence_only )
+    for i in variant_features.keys():
+        task_summary['variants'][i]['features'] = variant_features[i]
+
+    if not sequence_only:
         # relax
         # get native relax reference scores
 #        native_task = [i for i in task_summary['commands'] if i['feature'] == 'relax_native_rescore']# and i['variant'] == 'native']
@@ -9,6 +9,7 @@ main preprocessing
 # IMPORT
 
 # common modules
+import copy
 import os
 import sys
 
@@ -17,10 +18,10 @@ import sys
 # custom modules
 from helper_methods import load_variants_file , check_variants , extract_chains_from_pdb , get_file_extension , get_root_filename , create_directory , copy_file
 
-from psiblast_feature_generation import load_fasta , extract_protein_sequence_from_pdb , run_psiblast
+from psiblast_feature_generation import load_fasta , extract_protein_sequence_from_pdb , run_psiblast , load_cached_pssm , run_psiblast_shards
 from probe_feature_generation import run_probe
 from rosetta_feature_generation import create_variant_protein_structures , write_mut_file , run_rosetta_ddg_monomer , run_rosetta_relax_local , run_rosetta_rescore
-from vipur_settings import ROSETTA_RELAX_OPTIONS
+from vipur_settings import ROSETTA_RELAX_OPTIONS , PSIBLAST_OPTIONS , PSIBLAST_BATCH_SPLITTER , PSIBLAST_SHARDS
 
 ################################################################################
 # MAIN PREPROCESSING
@@ -30,7 +31,7 @@ def run_preprocessing( pdb_filename , variants_filename , prediction_filename =
         target_chain = '' , sequence_filename = '' , write_numbering_map = True ,
         sequence_only = False , task_summary_filename = '' ,
         single_relax = False , rosetta_relax_options = ROSETTA_RELAX_OPTIONS ,
-        pymol_environment_setup = '' ):
+        pymol_environment_setup = '' , psiblast_batch = None ):
     # prepare output writing
     # support writing to  <out_path>
     #debug_time = [('start' , time.time())]
@@ -173,6 +174,23 @@ def run_preprocessing( pdb_filename , variants_filename , prediction_filename =
     print '[[VIPURLOG]]generating PSIBLAST run command'
     sys.stdout.flush()
     psiblast_command , psiblast_filename = run_psiblast( sequence_filename , run = False )
+    # or reuse the PSSM from an earlier search
+    psiblast_cached = not psiblast_batch and load_cached_pssm( sequence , psiblast_filename , PSIBLAST_OPTIONS['out']( psiblast_filename.replace( '.pssm' , '' ) ) )
+    # or search with the other proteins of its batch (see plan_psiblast_batches)
+    # the first protein of the batch runs the search, the rest copy their PSSM
+    psiblast_batch_details = ''
+    if psiblast_batch:
+        batch_filename , batch_search = psiblast_batch
+        psiblast_command = PSIBLAST_BATCH_SPLITTER +' '+ batch_filename +' '+ os.path.abspath( sequence_filename )
+        if batch_search:
+            psiblast_command = run_psiblast( batch_filename , run = False )[0] +' && '+ psiblast_command
+            psiblast_batch_details = 'psiblast_batch_search:' + batch_filename +','
+        else:
+            psiblast_batch_details = 'psiblast_batch:' + batch_filename +','
+    # or search the database in parts (see run_psiblast_shards)
+    psiblast_shard_commands = []
+    if PSIBLAST_SHARDS and not psiblast_batch and not psiblast_cached:
+        psiblast_shard_commands = run_psiblast_shards( sequence_filename )
     # extract features from pssm
 
 
@@ -289,7 +307,7 @@ def run_preprocessing( pdb_filename , variants_filename , prediction_filename =
     # write out a master summary file
     # root_filename| <root_filename>
     # out_path| # needed to create abs paths and cd for ddg_monomer (facepalms again)
-    # options| chain: , sequence_only:
+    # options| chain: , sequence_only: , sequence_length:
     # files| pdb_filename: , variants_filename: , prediction_filename: , sequence_filename:
     # (the rest of these can be multiple)
     # variant| name: , structure filename:
@@ -302,7 +320,7 @@ def run_preprocessing( pdb_filename , variants_filename , prediction_filename =
         out_path = os.getcwd()
     summary_text += 'out_path| ' + out_path +'\n'
 
-    summary_text += 'other| ' + 'target_chain:' + target_chain +','+ 'sequence_only:' + str( sequence_only ) +'\n'    # only these 2 for now...
+    summary_text += 'other| ' + 'target_chain:' + target_chain +','+ 'sequence_only:' + str( sequence_only ) +','+ 'sequence_length:' + str( len( sequence ) ) +'\n'    # only these 3 for now...
 
     summary_text += 'files| ' + 'pdb_filename:' + pdb_filename +','+ 'variants_filename:' + variants_filename +','+ 'prediction_filename:' + prediction_filename +','+ 'sequence_filename:' + sequence_filename
     # lol...wtf
@@ -327,7 +345,11 @@ def run_preprocessing( pdb_filename , variants_filename , prediction_filename =
 
     # commands
     # psiblast, simplest, for the entire protein
-    summary_text += 'command| ' + 'feature:psiblast' +','+ 'output_filename:' + psiblast_filename +','+ psiblast_command +'\n'
+    if psiblast_shard_commands:
+        for feature , search_round , output_filename , command in psiblast_shard_commands:
+            summary_text += 'command| ' + 'feature:' + feature +','+ 'output_filename:' + output_filename +','+ 'psiblast_round:' + str( search_round ) +','+ command +'\n'
+    else:
+        summary_text += 'command| ' + 'feature:psiblast' +','+ 'output_filename:' + psiblast_filename +','+ 'run:success,'*psiblast_cached + psiblast_batch_details + psiblast_command +'\n'
     if not sequence_only:
         # probe
         summary_text += 'command| ' + 'feature:probe' +','+ 'output_filename:' + probe_output_filename +','+ probe_command +'\n'
@@ -364,6 +386,8 @@ def run_preprocessing( pdb_filename , variants_filename , prediction_filename =
     f = open( task_summary_filename , 'w' )
     f.write( summary_text.rstrip( '\n' ) )
     f.close()
+    # a fresh start, forget any older changes
+    remove_task_journal( task_summary_filename )
     
     # testing   
 #    load_task_summary( task_summary_filename )
@@ -430,6 +454,9 @@ def load_task_summary( task_summary_filename ):
         'variants' : variants ,
         'commands' : commands
         }
+
+    # and any changes since it was written
+    replay_task_journal( summary , task_summary_filename )
     return summary
 
 # simple enough, wrapped for testing
@@ -464,6 +491,86 @@ def write_task_summary( task_summary , task_summary_filename ):
     f.write( summary_text.rstrip( '\n' ) )
     f.close()
 
+    # the journal is folded in now
+    remove_task_journal( task_summary_filename )
+    TASK_JOURNAL_SNAPSHOTS[task_summary_filename] = snapshot_task_summary( task_summary )
+
 #    return summary_text
 
+################################################################################
+# TASK JOURNAL
+
+# rewriting every task summary whenever anything changes is a lot of I/O for
+# many proteins, instead append only the changes in each command to
+# "<task summary filename>.journal", one line each:
+# <command index>\t<key>\t<new value>  (no value if the key was removed)
+# only whole lines count, the last one may have been cut short by a crash
+# load_task_summary replays the journal, write_task_summary compacts it
+
+# what is on disk (summary + journal) for each task summary filename
+TASK_JOURNAL_SNAPSHOTS = {}
+
+def get_task_journal_filename( task_summary_filename ):
+    return task_summary_filename + '.journal'
+
+def remove_task_journal( task_summary_filename ):
+    if os.path.isfile( get_task_journal_filename( task_summary_filename ) ):
+        os.remove( get_task_journal_filename( task_summary_filename ) )
+
+# a copy to compare against later
+def snapshot_task_summary( task_summary ):
+    return copy.deepcopy( task_summary )
+
+# apply the journal of  <task_summary_filename>  to  <task_summary>
+def replay_task_journal( task_summary , task_summary_filename ):
+    journal_filename = get_task_journal_filename( task_summary_filename )
+    if os.path.isfile( journal_filename ):
+        f = open( journal_filename , 'r' )
+        lines = f.read().split( '\n' )[:-1]
+        f.close()
+        for i in lines:
+            i = i.split( '\t' )
+            # skip anything malformed
+            if not len( i ) in [2 , 3] or not i[0].isdigit() or int( i[0] ) >= len( task_summary['commands'] ):
+                continue
+            command_dict = task_summary['commands'][int( i[0] )]
+            if len( i ) == 3:
+                command_dict[i[1]] = i[2]
+            elif i[1] in command_dict.keys():
+                del command_dict[i[1]]
+
+    TASK_JOURNAL_SNAPSHOTS[task_summary_filename] = snapshot_task_summary( task_summary )
+
+# fold the journal of  <task_summary_filename>  into the summary
+def compact_task_journal( task_summary_filename ):
+    write_task_summary( load_task_summary( task_summary_filename ) , task_summary_filename )
+
+# record what changed in the commands of  <task_summary>  since it was last
+# written (or loaded), the whole summary is rewritten if anything else changed
+def journal_task_summary( task_summary , task_summary_filename = '' ):
+    if not task_summary_filename:
+        task_summary_filename = task_summary['filenames']['task_summary_filename']
+
+    snapshot = TASK_JOURNAL_SNAPSHOTS.get( task_summary_filename )
+    if not snapshot or not len( snapshot['commands'] ) == len( task_summary['commands'] ) or [i for i in task_summary.keys() if not i == 'commands' and not task_summary[i] == snapshot.get( i )]:
+        write_task_summary( task_summary , task_summary_filename )
+        return
+
+    changes = []
+    for i in xrange( len( task_summary['commands'] ) ):
+        before = snapshot['commands'][i]
+        after = task_summary['commands'][i]
+        for j in after.keys():
+            if not after[j] == before.get( j ) and ( '\t' in j + after[j] or '\n' in j + after[j] ):
+                raise ValueError( 'cannot journal ' + repr( j ) + ' of command ' + str( i ) + ' in ' + task_summary_filename + ', tabs and newlines would break the journal' )
+        changes += [str( i ) +'\t'+ j +'\t'+ after[j] for j in after.keys() if not after[j] == before.get( j )]
+        changes += [str( i ) +'\t'+ j for j in before.keys() if not j in after.keys()]
+    if not changes:
+        return
+
+    f = open( get_task_journal_filename( task_summary_filename ) , 'a' )
+    f.write( '\n'.join( changes ) +'\n' )
+    f.close()
+    TASK_JOURNAL_SNAPSHOTS[task_summary_filename] = snapshot_task_summary( task_summary )
+
 
@@ -66,6 +66,9 @@ def run_probe( pdb_filename , variants , probe_output_filename = '' , run = True
 # simple, for now just check if empty or not
 def check_probe_output( probe_output_filename ):
     # simple enough, for now just check if empty
+    # (or missing, if it failed before writing anything)
+    if not os.path.isfile( probe_output_filename ):
+        return False
     f = open( probe_output_filename , 'r' )
     success = bool( f.read().strip() )    # load all of this!?
     f.close()
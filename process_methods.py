@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# :noTabs=true:
+
+"""
+methods for running local commands as child processes, the single way the
+serial, local parallel, pilot and packed job runners launch commands
+
+each process is a dict with its "command", the subprocess "process", where
+its stdout + stderr are written ("log_filename", straight to the file so
+nothing is held in memory), "start_time" and once it is done its
+"exit_status" and "runtime" (s)
+
+many can run at once, poll_processes and wait_for_processes report the ones
+that just finished so the run methods can react to each as soon as it is done
+
+each runs in its own session, so a Ctrl-C or a queue's kill no longer reaches
+it directly, instead every process still running is stopped when VIPUR gets
+SIGINT or SIGTERM (see stop_processes_on_signals)
+
+only uses standard modules, so batch_driver.py and the pilot workers can use
+it anywhere VIPUR is visible
+"""
+
+################################################################################
+# IMPORT
+
+# common modules
+import os
+import signal
+import subprocess
+import time
+
+################################################################################
+# PROCESS METHODS
+
+# the processes started here that have not finished (as far as anyone checked)
+RUNNING_PROCESSES = []
+
+# launch  <command>  in the background, writing its output to  <log_filename>
+# (or the terminal if there is none)
+# each runs in its own session, so kill_processes can stop the whole process
+# group and not just the shell that started it
+def start_process( command , log_filename = '' , append = False ):
+    log_file = None
+    if log_filename:
+        log_directory = os.path.dirname( log_filename )
+        if log_directory and not os.path.isdir( log_directory ):
+            os.makedirs( log_directory )
+        log_file = open( log_filename , 'a'*append or 'w' )
+
+    stop_processes_on_signals()
+    process = subprocess.Popen( command , shell = True , stdout = log_file , stderr = subprocess.STDOUT if log_file else None , preexec_fn = os.setsid )
+    process = {
+        'command' : command ,
+        'log_filename' : log_filename ,
+        'log_file' : log_file ,
+        'process' : process ,
+        # the shell leads its own group, which outlives it while its children run
+        'process_group' : process.pid ,
+        'start_time' : time.time()
+        }
+    RUNNING_PROCESSES.append( process )
+    return process
+
+# has this process finished? if so, record its exit status and runtime
+def check_process_finished( process ):
+    if 'exit_status' in process.keys():
+        return True
+
+    exit_status = process['process'].poll()
+    if exit_status is None:
+        return False
+
+    process['exit_status'] = exit_status
+    process['runtime'] = time.time() - process['start_time']
+    if process['log_file']:
+        process['log_file'].close()
+    if process in RUNNING_PROCESSES:
+        RUNNING_PROCESSES.remove( process )
+    return True
+
+# the  <processes>  that finished since they were last checked
+def poll_processes( processes ):
+    return [i for i in processes if not 'exit_status' in i.keys() and check_process_finished( i )]
+
+# wait until any of the  <processes>  finish (or  <timeout>  seconds pass)
+# returns the ones that finished
+def wait_for_processes( processes , timeout = None , check_interval = .1 ):
+    waited = 0
+    while True:
+        finished = poll_processes( processes )
+        if finished or not [i for i in processes if not 'exit_status' in i.keys()] or ( not timeout is None and waited >= timeout ):
+            return finished
+        time.sleep( check_interval )
+        waited += check_interval
+
+# run  <command>  to completion, returns the finished process
+def run_process( command , log_filename = '' , append = False ):
+    process = start_process( command , log_filename , append )
+    wait_for_processes( [process] )
+    return process
+
+# signal every process in the group of  <process>  (started by start_process)
+def signal_process_group( process , signal_number ):
+    try:
+        os.killpg( process['process_group'] , signal_number )
+    except OSError:
+        # already gone
+        pass
+
+# stop any of the  <processes>  still running, along with anything they
+# started: SIGTERM first, then SIGKILL if they have not stopped after
+# <grace_period>  seconds
+def kill_processes( processes , grace_period = 5 ):
+    running = [i for i in processes if not check_process_finished( i )]
+    for i in running:
+        signal_process_group( i , signal.SIGTERM )
+    wait_for_processes( running , timeout = grace_period )
+
+    for i in running:
+        if not check_process_finished( i ):
+            signal_process_group( i , signal.SIGKILL )
+            i['process'].wait()
+            check_process_finished( i )
+        # the shell may be gone while its children ignored SIGTERM
+        signal_process_group( i , signal.SIGKILL )
+
+# the signal handlers replaced by stop_processes_on_signals
+PREVIOUS_SIGNAL_HANDLERS = {}
+
+# stop every process still running, then handle  <signal_number>  as before
+def stop_running_processes( signal_number , frame ):
+    print 'stopping ' + str( len( RUNNING_PROCESSES ) ) + ' running processes'
+    kill_processes( list( RUNNING_PROCESSES ) )
+    signal.signal( signal_number , PREVIOUS_SIGNAL_HANDLERS[signal_number] or signal.SIG_DFL )
+    os.kill( os.getpid() , signal_number )
+
+# have SIGINT and SIGTERM stop the running processes first (only once, and
+# only possible from the main thread)
+def stop_processes_on_signals( signal_numbers = [signal.SIGINT , signal.SIGTERM] ):
+    for i in signal_numbers:
+        if i in PREVIOUS_SIGNAL_HANDLERS.keys():
+            continue
+        try:
+            PREVIOUS_SIGNAL_HANDLERS[i] = signal.signal( i , stop_running_processes )
+        except ValueError:
+            # not the main thread
+            pass
@@ -7,32 +7,50 @@ and parsing the output PSSM
 
 Note: the run options for PSIBLAST are setup in run_psiblast and set in
 settings.py in PSIBLAST_OPTIONS
+
+run on its own, splits the output of a batch search (see PSIBLAST_BATCH_SIZE)
+and copies the PSSM of each sequence file to where run_psiblast would write it
+or runs a step of a sharded search (see PSIBLAST_SHARDS)
+usage: python psiblast_feature_generation.py split <batch filename> [sequence filenames]
+       python psiblast_feature_generation.py search <sequence filename> <round> <database length> <shard index> <shard> [-num_threads N]
+       python psiblast_feature_generation.py merge <sequence filename> <round> <database length> <shards...> [-num_threads N]
 """
 
 ################################################################################
 # IMPORT
 
 # common modules
+import glob
+import hashlib
 import os
 import re
+import shutil
+import StringIO
+import sys
 
 # bigger modules
+try:
+    import numpy
+except ImportError:
+    # only for keeping PSSMs as arrays (see load_pssm_arrays)
+    numpy = None
 
 # custom modules
-from vipur_settings import AMINO_ACID_CODES , PATH_TO_PSIBLAST , PSIBLAST_OPTIONS , PROTEIN_LETTERS
-from helper_methods import create_executable_str , run_local_commandline
+from vipur_settings import AMINO_ACID_CODES , PATH_TO_PSIBLAST , PATH_TO_BLASTDBCMD , PATH_TO_MAKEBLASTDB , PSIBLAST_OPTIONS , PROTEIN_LETTERS , PSSM_CACHE_PATH , PSSM_CACHE_IGNORED_OPTIONS , PSSM_ARRAY_EXTENSION , PSSM_INDEX_EXTENSION , PSIBLAST_SHARDS , PSIBLAST_SHARD_THREADS , PSIBLAST_SHARD_SEARCHER , PSIBLAST_SHARD_MERGER
+from helper_methods import create_executable_str , run_local_commandline , write_file_atomically
 
 ################################################################################
 # METHODS
 
 # for sequence searches
-def extract_protein_sequence_from_pdb( pdb_filename , out_filename = '' , target_chain = 'A' , write_numbering_map = True ):
+def extract_protein_sequence_from_pdb( pdb_filename , out_filename = '' , target_chain = 'A' , write_numbering_map = True , write_sequence = True ):
     """
     Returns the protein sequence found in  <pdb_filename>  matching
     <target_chain>  and writes the sequence (in FASTA format) to  <out_filename>
     
     Optionally  <write_numbering_map>  that maps the PDB residue numbering to
-        the sequence (0-indexed) numbering*
+        the sequence (0-indexed) numbering*, the sequence file is not written
+        if not  <write_sequence>
     
     Note: although the sequence file is only required for input to PSIBLAST,
         the sequence and residue numbering map are useful for identifying
@@ -89,7 +107,7 @@ def extract_protein_sequence_from_pdb( pdb_filename , out_filename = '' , target
 
     # "optionally" write out the sequence
     # currently a default, not an option - will determine an appropriate  <out_filename>  if not provided as an argument
-    if out_filename:
+    if out_filename and write_sequence:
         # write it to output directory
         f = open( out_filename , 'w' )
         f.write( '>' + root_filename +'_chain_'+ target_chain +'\n'+ sequence )
@@ -126,16 +144,19 @@ def load_fasta( fasta_filename ):
     return sequences
 
 # local
-def run_psiblast( sequence_filename , run = True ):
+def run_psiblast( sequence_filename , run = True , options = {} ):
     """
     Runs PSIBLAST on  <sequence_filename>  using the default options in
     PSIBLAST_OPTIONS and returns the relevant output file: "out_ascii_pssm"
+
+    Optionally replace any of the default options with  <options>
     """
     root_filename = os.path.abspath( sequence_filename ).rstrip( '.fa' )
     
     # collect the options, set the input, derive the output filenames
     psiblast_options = {}
     psiblast_options.update( PSIBLAST_OPTIONS )
+    psiblast_options.update( options )
     psiblast_options['query'] = sequence_filename
     for i in psiblast_options.keys():
         if '__call__' in dir( psiblast_options[i] ):
@@ -187,6 +208,344 @@ def check_psiblast_output( psiblast_pssm , psiblast_output = None , failed_outpu
             
     return success , not_empty
 
+################################################################################
+# PSSM CACHE
+
+# the names, sizes and modification times of the files of the BLAST
+# <database> , any update to the database changes this
+def fingerprint_blast_database( database ):
+    return ';'.join( [os.path.basename( i ) +':'+ str( os.path.getsize( i ) ) +':'+ str( int( os.path.getmtime( i ) ) ) for i in sorted( glob.glob( database + '.*' ) )] )
+
+# the cache key for searching  <sequence>  with  <psiblast_options>
+# (output filenames and  <ignored_options>  do not matter)
+def get_pssm_cache_key( sequence , psiblast_options = PSIBLAST_OPTIONS , ignored_options = PSSM_CACHE_IGNORED_OPTIONS ):
+    options = sorted( [(i , str( j )) for i , j in psiblast_options.items() if not i in ignored_options and not '__call__' in dir( j )] )
+    return hashlib.sha1( sequence.upper() +'\n'+ repr( options ) +'\n'+ fingerprint_blast_database( psiblast_options['db'] ) ).hexdigest()
+
+def get_pssm_cache_filename( key , cache_path = PSSM_CACHE_PATH ):
+    return os.path.join( cache_path , key[:2] , key + '.pssm' )
+
+# copy the cached PSSM (and PSIBLAST output) for  <sequence>  to
+# <pssm_filename>  and  <psiblast_output_filename> , returns True if there
+# was one
+# copies, not links, in case the PSSM is ever written again in place
+def load_cached_pssm( sequence , pssm_filename , psiblast_output_filename , cache_path = PSSM_CACHE_PATH ):
+    if not cache_path:
+        return False
+    cached_filename = get_pssm_cache_filename( get_pssm_cache_key( sequence ) , cache_path )
+    if not os.path.isfile( cached_filename ):
+        return False
+
+    for i , j in [(cached_filename.replace( '.pssm' , '.pb' ) , psiblast_output_filename) , (cached_filename , pssm_filename)]:
+        if os.path.isfile( i ):
+            shutil.copy( i , j )
+    print 'found the PSSM for ' + pssm_filename + ' in the cache, no need to run PSIBLAST'
+    return True
+
+# add the PSSM (and PSIBLAST output) of a successful search for  <sequence>
+# to the cache, if it is not there already
+def store_cached_pssm( sequence , pssm_filename , psiblast_output_filename , cache_path = PSSM_CACHE_PATH ):
+    if not cache_path:
+        return
+    cached_filename = get_pssm_cache_filename( get_pssm_cache_key( sequence ) , cache_path )
+    if os.path.isfile( cached_filename ):
+        return
+
+    if not os.path.isdir( os.path.dirname( cached_filename ) ):
+        try:
+            os.makedirs( os.path.dirname( cached_filename ) )
+        except OSError:
+            # another run made it first
+            pass
+    # the PSSM last, its presence means the entry is complete
+    for i , j in [(psiblast_output_filename , cached_filename.replace( '.pssm' , '.pb' )) , (pssm_filename , cached_filename)]:
+        if os.path.isfile( i ):
+            f = open( i , 'r' )
+            write_file_atomically( j , f.read() )
+            f.close()
+
+################################################################################
+# BATCH SEARCH
+
+# each query of a batch is named after its sequence, so the output can be
+# matched to every protein with that sequence
+def get_psiblast_batch_query( sequence ):
+    return hashlib.sha1( sequence.upper() ).hexdigest()
+
+# where the PSIBLAST output for  <sequence>  goes once the search of
+# <batch_filename>  is split (without the extension)
+def get_psiblast_batch_root_filename( batch_filename , sequence ):
+    return os.path.abspath( batch_filename ).rstrip( '.fa' ) +'.'+ get_psiblast_batch_query( sequence )
+
+# write the (unique)  <sequences>  to  <batch_filename>  to search them at once
+def write_psiblast_batch( sequences , batch_filename ):
+    f = open( batch_filename , 'w' )
+    f.write( '\n'.join( ['>' + get_psiblast_batch_query( i ) +'\n'+ i for i in sequences] ) )
+    f.close()
+
+# the query sequence of  <pssm_text>  (a single "out_ascii_pssm" matrix)
+def extract_sequence_from_psiblast_pssm( pssm_text ):
+    return ''.join( re.findall( '\n *\d+ ([A-Z]) ' , pssm_text ) )
+
+# split the output of the PSIBLAST search of  <batch_filename>  into the
+# output + PSSM of each query (see get_psiblast_batch_root_filename)
+# the matrices follow one another, each is matched to its query by sequence
+# the output (-outfmt 7) of each iteration starts with its own "# PSIBLAST" line
+# a query without a PSSM (no hits) gets an empty one, like a search of its own
+def split_psiblast_batch( batch_filename ):
+    root_filename = os.path.abspath( batch_filename ).rstrip( '.fa' )
+    if not os.path.isfile( PSIBLAST_OPTIONS['out']( root_filename ) ):
+        raise IOError( 'cannot find ' + PSIBLAST_OPTIONS['out']( root_filename ) + ', the batch search failed!!?' )
+
+    pssms = {}
+    if os.path.isfile( PSIBLAST_OPTIONS['out_ascii_pssm']( root_filename ) ):
+        f = open( PSIBLAST_OPTIONS['out_ascii_pssm']( root_filename ) , 'r' )
+        for i in f.read().split( '\nLast position-specific' )[1:]:
+            i = '\nLast position-specific' + i
+            pssms[get_psiblast_batch_query( extract_sequence_from_psiblast_pssm( i ) )] = i
+        f.close()
+
+    outputs = {}
+    f = open( PSIBLAST_OPTIONS['out']( root_filename ) , 'r' )
+    for i in ( '\n' + f.read() ).split( '\n# PSIBLAST' )[1:]:
+        query = ( re.findall( '\n# Query: (\S+)' , i ) + [''] )[0]
+        outputs[query] = outputs.get( query , '' ) + '# PSIBLAST' + re.sub( '\n# BLAST processed .*' , '' , i.rstrip( '\n' ) ) +'\n'
+    f.close()
+
+    sequences = [i[1] for i in load_fasta( batch_filename )]
+    for sequence in sequences:
+        query = get_psiblast_batch_query( sequence )
+        query_root_filename = get_psiblast_batch_root_filename( batch_filename , sequence )
+        # the PSSM last, its presence means the query is done
+        for i , j in [(outputs.get( query , '' ) , PSIBLAST_OPTIONS['out']( query_root_filename )) , (pssms.get( query , '' ) , PSIBLAST_OPTIONS['out_ascii_pssm']( query_root_filename ))]:
+            write_file_atomically( j , i )
+
+    print 'split the PSIBLAST output for ' + batch_filename + ' into ' + str( len( sequences ) ) + ' queries, ' + str( len( [i for i in sequences if get_psiblast_batch_query( i ) in pssms.keys()] ) ) + ' with a PSSM'
+
+# copy the PSSM (and PSIBLAST output) for the sequence in  <sequence_filename>
+# from the split search of  <batch_filename>  to where run_psiblast would
+# write them, returns True if the batch has it
+def load_batched_pssm( batch_filename , sequence_filename ):
+    query_root_filename = get_psiblast_batch_root_filename( batch_filename , load_fasta( sequence_filename )[0][1] )
+    if not os.path.isfile( PSIBLAST_OPTIONS['out_ascii_pssm']( query_root_filename ) ):
+        return False
+
+    root_filename = os.path.abspath( sequence_filename ).rstrip( '.fa' )
+    for i in ['out' , 'out_ascii_pssm']:
+        shutil.copy( PSIBLAST_OPTIONS[i]( query_root_filename ) , PSIBLAST_OPTIONS[i]( root_filename ) )
+    print 'copied the PSSM for ' + sequence_filename + ' from the search of ' + batch_filename
+    return True
+
+################################################################################
+# SHARDED SEARCH
+
+# the lengths of the BLAST databases already looked up
+BLAST_DATABASE_LENGTHS = {}
+
+# the total length (residues) of the BLAST  <database> , from blastdbcmd
+def get_blast_database_length( database ):
+    if not database in BLAST_DATABASE_LENGTHS.keys():
+        info = run_local_commandline( create_executable_str( PATH_TO_BLASTDBCMD , options = {'db' : database , 'info' : ''} ) , collect_stdout = True )
+        length = re.findall( '([\d,]+) total (?:letters|residues)' , info )
+        if not length:
+            raise IOError( 'cannot find the length of the BLAST database ' + database + '!!?\n' + info )
+        BLAST_DATABASE_LENGTHS[database] = int( length[0].replace( ',' , '' ) )
+    return BLAST_DATABASE_LENGTHS[database]
+
+# the output of searching shard  <shard_index>  in round (iteration)
+# <search_round>  for the sequence of  <root_filename>
+def get_psiblast_shard_filename( root_filename , search_round , shard_index ):
+    return root_filename +'.round_'+ str( search_round ) +'.shard_'+ str( shard_index ) +'.pb'
+
+# written once the search of a shard exits successfully, psiblast creates
+# its output before it can fail
+def get_psiblast_shard_done_filename( shard_filename ):
+    return shard_filename + '.done'
+
+# the merged output of round  <search_round>  (without the extension), its
+# checkpoint ("out_pssm") is the PSSM searched in the next round
+def get_psiblast_round_root_filename( root_filename , search_round ):
+    return root_filename +'.round_'+ str( search_round )
+
+# the subject ids of the hits in  <psiblast_output>  (-outfmt 7)
+def extract_hits_from_psiblast_output( psiblast_output ):
+    f = open( psiblast_output , 'r' )
+    hits = [i.split( '\t' )[1] for i in f.read().split( '\n' ) if '\t' in i and not i[0] == '#']
+    f.close()
+    return hits
+
+def run_psiblast_shards( sequence_filename , shards = PSIBLAST_SHARDS , threads = PSIBLAST_SHARD_THREADS ):
+    """
+    Returns the commands to search the parts of the BLAST database  <shards>
+    for  <sequence_filename>  instead of run_psiblast, as tuples of
+    (feature , round , output filename , command)
+
+    Each round (iteration of PSIBLAST) searches every shard on its own, then
+    merges their hits (see merge_psiblast_shards), the merge of the last round
+    writes the same output as run_psiblast
+
+    Note: every search uses the length of all the  <shards>  so the E-values
+        match a search of the whole database
+    """
+    root_filename = os.path.abspath( sequence_filename ).rstrip( '.fa' )
+    database_length = sum( [get_blast_database_length( i ) for i in shards] )
+    search_rounds = int( PSIBLAST_OPTIONS['num_iterations'] )
+
+    commands = []
+    for k in xrange( 1 , search_rounds + 1 ):
+        for i in xrange( len( shards ) ):
+            commands.append( ('psiblast_shard' , k , get_psiblast_shard_filename( root_filename , k , i ) ,
+                ' '.join( [PSIBLAST_SHARD_SEARCHER , os.path.abspath( sequence_filename ) , str( k ) , str( database_length ) , str( i ) , shards[i] , '-num_threads' , str( threads )] )) )
+
+        # the last merge writes the PSSM
+        command = ' '.join( [PSIBLAST_SHARD_MERGER , os.path.abspath( sequence_filename ) , str( k ) , str( database_length )] + shards + ['-num_threads' , str( threads )] )
+        if k < search_rounds:
+            commands.append( ('psiblast_merge' , k , PSIBLAST_OPTIONS['out_pssm']( get_psiblast_round_root_filename( root_filename , k ) ) , command) )
+        else:
+            commands.append( ('psiblast' , k , PSIBLAST_OPTIONS['out_ascii_pssm']( root_filename ) , command) )
+
+    return commands
+
+# search  <shard>  (the  <shard_index> -th shard) in round  <search_round>
+# the first round with the query, later rounds with the PSSM of the last one
+# returns the exit status, marks the search done (see
+# get_psiblast_shard_done_filename) if it is 0
+def search_psiblast_shard( sequence_filename , search_round , database_length , shard_index , shard , threads = PSIBLAST_SHARD_THREADS ):
+    root_filename = os.path.abspath( sequence_filename ).rstrip( '.fa' )
+    done_filename = get_psiblast_shard_done_filename( get_psiblast_shard_filename( root_filename , search_round , shard_index ) )
+    if os.path.isfile( done_filename ):
+        # from an earlier attempt
+        os.remove( done_filename )
+
+    # a single iteration, no output filenames but its own
+    psiblast_options = dict( [(i , j) for i , j in PSIBLAST_OPTIONS.items() if not '__call__' in dir( j )] )
+    psiblast_options.update( {
+        'db' : shard ,
+        'dbsize' : database_length ,
+        'num_iterations' : 1 ,
+        'num_threads' : threads ,
+        'out' : get_psiblast_shard_filename( root_filename , search_round , shard_index )
+        } )
+    if search_round == 1:
+        psiblast_options['query'] = os.path.abspath( sequence_filename )
+    else:
+        checkpoint_filename = PSIBLAST_OPTIONS['out_pssm']( get_psiblast_round_root_filename( root_filename , search_round - 1 ) )
+        if not os.path.getsize( checkpoint_filename ):
+            # the search already ended (see merge_psiblast_shards)
+            open( psiblast_options['out'] , 'w' ).close()
+            open( done_filename , 'w' ).close()
+            return 0
+        psiblast_options['in_pssm'] = checkpoint_filename
+
+    status = run_local_commandline( create_executable_str( PATH_TO_PSIBLAST , options = psiblast_options ) )
+    if not status:
+        open( done_filename , 'w' ).close()
+    return status
+
+def merge_psiblast_shards( sequence_filename , search_round , database_length , shards , threads = PSIBLAST_SHARD_THREADS ):
+    """
+    Merges the shard searches of round  <search_round>  for
+    <sequence_filename> , returns the exit status
+
+    Every hit of the shards so far (this round and the ones before) is fetched
+    into a small BLAST database and searched with PSIBLAST as usual (for as
+    many iterations as rounds so far, with the length of all the  <shards> )
+    any sequence included in the PSSM of a search of the whole database is
+    there, so the PSSM is the same
+    the checkpoint is the PSSM to search with in the next round, the last
+    round writes the output of run_psiblast instead
+
+    If the search ended early (nothing found, or nothing to include in the
+    PSSM) the output of run_psiblast is written right away, the checkpoint is
+    left empty and the remaining rounds do nothing
+    """
+    root_filename = os.path.abspath( sequence_filename ).rstrip( '.fa' )
+    round_root_filename = get_psiblast_round_root_filename( root_filename , search_round )
+    last_round = search_round == int( PSIBLAST_OPTIONS['num_iterations'] )
+    if search_round > 1 and not os.path.getsize( PSIBLAST_OPTIONS['out_pssm']( get_psiblast_round_root_filename( root_filename , search_round - 1 ) ) ):
+        # already done
+        if not last_round:
+            open( PSIBLAST_OPTIONS['out_pssm']( round_root_filename ) , 'w' ).close()
+        return 0
+
+    # which shard has each hit
+    hits = {}
+    for k in xrange( 1 , search_round + 1 ):
+        for i in xrange( len( shards ) ):
+            for j in extract_hits_from_psiblast_output( get_psiblast_shard_filename( root_filename , k , i ) ):
+                if not j in hits.keys():
+                    hits[j] = i
+
+    if not hits:
+        # nothing found, just like searching the whole database
+        shutil.copy( get_psiblast_shard_filename( root_filename , search_round , 0 ) , PSIBLAST_OPTIONS['out']( root_filename ) )
+        open( PSIBLAST_OPTIONS['out_ascii_pssm']( root_filename ) , 'w' ).close()
+        if not last_round:
+            open( PSIBLAST_OPTIONS['out_pssm']( round_root_filename ) , 'w' ).close()
+        print 'no hits for ' + sequence_filename + ' in any shard'
+        return 0
+
+    # collect their sequences
+    hits_filename = round_root_filename + '.hits.fa'
+    f = open( hits_filename , 'w' )
+    for i in xrange( len( shards ) ):
+        entries = [j for j in hits.keys() if hits[j] == i]
+        if not entries:
+            continue
+        entries_filename = round_root_filename + '.hits.entries'
+        g = open( entries_filename , 'w' )
+        g.write( '\n'.join( entries ) +'\n' )
+        g.close()
+
+        status = run_local_commandline( create_executable_str( PATH_TO_BLASTDBCMD , options = {'db' : shards[i] , 'entry_batch' : entries_filename , 'target_only' : '' , 'out' : entries_filename + '.fa'} ) )
+        if status:
+            f.close()
+            return status
+        g = open( entries_filename + '.fa' , 'r' )
+        f.write( g.read().rstrip( '\n' ) +'\n' )
+        g.close()
+        os.remove( entries_filename )
+        os.remove( entries_filename + '.fa' )
+    f.close()
+
+    database = round_root_filename + '.hits'
+    status = run_local_commandline( create_executable_str( PATH_TO_MAKEBLASTDB , options = {'in' : hits_filename , 'dbtype' : 'prot' , 'parse_seqids' : '' , 'out' : database} ) )
+    if status:
+        return status
+
+    # search them, scored as the whole database
+    psiblast_options = {
+        'db' : database ,
+        'dbsize' : database_length ,
+        'num_threads' : threads
+        }
+    if not last_round:
+        # PSIBLAST would have searched this many iterations so far
+        psiblast_options['num_iterations'] = search_round
+        for i in PSIBLAST_OPTIONS.keys():
+            if '__call__' in dir( PSIBLAST_OPTIONS[i] ):
+                psiblast_options[i] = PSIBLAST_OPTIONS[i]( round_root_filename )
+    status = run_local_commandline( run_psiblast( sequence_filename , run = False , options = psiblast_options )[0] )
+
+    if not status and not last_round and not ( os.path.isfile( psiblast_options['out_pssm'] ) and os.path.getsize( psiblast_options['out_pssm'] ) ):
+        # nothing to include in a PSSM, the search ends here
+        print 'the search for ' + sequence_filename + ' ended in round ' + str( search_round )
+        del psiblast_options['num_iterations']
+        for i in PSIBLAST_OPTIONS.keys():
+            if '__call__' in dir( PSIBLAST_OPTIONS[i] ):
+                del psiblast_options[i]
+        status = run_local_commandline( run_psiblast( sequence_filename , run = False , options = psiblast_options )[0] )
+        open( PSIBLAST_OPTIONS['out_pssm']( round_root_filename ) , 'w' ).close()
+
+    # the sequences are fetched again next round
+    for i in [hits_filename] + glob.glob( database + '.p*' ):
+        os.remove( i )
+
+    return status
+
+################################################################################
+# PSSM PARSING
+
 # modified by njc, hybrid method
 # now robust to versions, based on separator rather than anticipated structure
 def extract_pssm_from_psiblast_pssm( pssm_filename , aa_line_shift = -4 , columns = len( PROTEIN_LETTERS ) ):
@@ -243,4 +602,192 @@ def extract_pssm_from_psiblast_pssm( pssm_filename , aa_line_shift = -4 , column
     #DEBUG pssm_dict['XTRA_AALINE'] = aaline
     return pssm_dict
 
+# the amino acids (column order) if  <line>  is the header of an ASCII PSSM
+# they are listed twice, for the scores then the frequencies
+def extract_amino_acids_from_psiblast_pssm_header( line , columns = len( PROTEIN_LETTERS ) ):
+    amino_acids = line.split()
+    if len( amino_acids ) == 2*columns and amino_acids[:columns] == amino_acids[columns:] and not [i for i in amino_acids if not len( i ) == 1 or not i.isalpha()]:
+        return ''.join( amino_acids[:columns] )
+    return ''
+
+# the (position , query amino acid , numbers) of  <line>  if it is a row of an
+# ASCII PSSM, otherwise None
+# the numbers are matched rather than split, they can run together e.g. "3-10"
+def parse_psiblast_pssm_row( line ):
+    row = re.match( ' *(\d+) (\S) ' , line )
+    if not row:
+        return None
+    return int( row.group( 1 ) ) , row.group( 2 ) , re.findall( '-?\d+(?:\.\d+)?' , line[row.end():] )
+
+# the same PSSM as arrays, much smaller than the dicts above for long proteins
+# { 'amino acids' : the column order (str) ,
+#   'sequence' : the query (str) ,
+#   'log-likelihood' : L x 20 int16 ,
+#   'approximate frequencies' : L x 20 float32 ,
+#   'information content' : L float ,
+#   '?' : L float }
+# position  <i>  (as extract_pssm_from_psiblast_pssm) is row  <i> - 1
+def extract_pssm_arrays_from_psiblast_pssm( pssm_filename , columns = len( PROTEIN_LETTERS ) ):
+    f = open( pssm_filename , 'r' )
+    lines = f.read().split( '\n' )
+    f.close()
+
+    amino_acids = [i for i in [extract_amino_acids_from_psiblast_pssm_header( j , columns ) for j in lines] if i]
+    if not len( amino_acids ) == 1:
+        raise IOError( 'cannot find the amino acids of ' + pssm_filename + ', is it a PSSM?' )
+
+    sequence = ''
+    values = []
+    for row in [parse_psiblast_pssm_row( i ) for i in lines]:
+        if not row:
+            continue
+        if not row[0] == len( sequence ) + 1:
+            raise IOError( 'position ' + str( row[0] ) + ' of ' + pssm_filename + ' is out of order!!?' )
+        sequence += row[1]
+        values.append( row[2] )
+
+    if [i for i in values if not len( i ) == 2*columns + 2]:
+        raise IOError( 'not every position of ' + pssm_filename + ' has ' + str( 2*columns + 2 ) + ' values!!?' )
+    values = numpy.array( values , dtype = float ).reshape( ( len( sequence ) , 2*columns + 2 ) )
+    return {
+        'amino acids' : amino_acids[0] ,
+        'sequence' : sequence ,
+        'log-likelihood' : values[: , :columns].astype( numpy.int16 ) ,
+        'approximate frequencies' : ( values[: , columns:2*columns]/100 ).astype( numpy.float32 ) ,
+        'information content' : values[: , -2] ,
+        '?' : values[: , -1]
+        }
+
+def get_pssm_array_filename( pssm_filename , extension = PSSM_ARRAY_EXTENSION ):
+    return pssm_filename + extension
+
+# the arrays of  <pssm_filename>  (see extract_pssm_arrays_from_psiblast_pssm)
+# from the file next to it, parsed and written there first if it is missing or
+# older than the PSSM (PSIBLAST was run again), None without NumPy (or if
+# <extension>  is empty) to use extract_pssm_from_psiblast_pssm instead
+def load_pssm_arrays( pssm_filename , extension = PSSM_ARRAY_EXTENSION ):
+    if not numpy or not extension:
+        return None
+    array_filename = get_pssm_array_filename( pssm_filename , extension )
+    if os.path.isfile( array_filename ) and os.path.getmtime( array_filename ) >= os.path.getmtime( pssm_filename ):
+        f = numpy.load( array_filename )
+        pssm_arrays = dict( [(i , f[i]) for i in f.files] )
+        f.close()
+        for i in ['amino acids' , 'sequence']:
+            pssm_arrays[i] = str( pssm_arrays[i] )
+        return pssm_arrays
+
+    pssm_arrays = extract_pssm_arrays_from_psiblast_pssm( pssm_filename )
+    f = StringIO.StringIO()
+    numpy.savez( f , **pssm_arrays )
+    write_file_atomically( array_filename , f.getvalue() , 'wb' )
+    print 'wrote the arrays of ' + pssm_filename + ' to ' + array_filename
+    return pssm_arrays
+
+# position  <position>  of  <pssm_arrays>  like an entry of
+# extract_pssm_from_psiblast_pssm
+def get_pssm_array_position( pssm_arrays , position ):
+    i = position - 1
+    if i < 0 or i >= len( pssm_arrays['sequence'] ):
+        raise KeyError( position )
+    return {
+        'position' : position ,
+        'query identity' : pssm_arrays['sequence'][i] ,
+        'log-likelihood' : dict( zip( pssm_arrays['amino acids'] , [int( j ) for j in pssm_arrays['log-likelihood'][i]] ) ) ,
+        'approximate frequencies' : dict( zip( pssm_arrays['amino acids'] , [round( float( j ) , 2 ) for j in pssm_arrays['approximate frequencies'][i]] ) ) ,
+        'information content' : float( pssm_arrays['information content'][i] ) ,
+        '?' : float( pssm_arrays['?'][i] )
+        }
+
+def get_pssm_index_filename( pssm_filename , extension = PSSM_INDEX_EXTENSION ):
+    return pssm_filename + extension
+
+# the amino acids (column order) of  <pssm_filename>  and where the row of each
+# position starts (bytes), the rest of the file is not parsed
+def index_psiblast_pssm( pssm_filename , columns = len( PROTEIN_LETTERS ) ):
+    amino_acids = ''
+    offsets = []
+    offset = 0
+    f = open( pssm_filename , 'rb' )
+    for line in f:
+        if not amino_acids:
+            amino_acids = extract_amino_acids_from_psiblast_pssm_header( line , columns )
+        elif re.match( ' *\d+ \S ' , line ):
+            offsets.append( offset )
+        offset += len( line )
+    f.close()
+
+    if not amino_acids:
+        raise IOError( 'cannot find the amino acids of ' + pssm_filename + ', is it a PSSM?' )
+    return amino_acids , offsets
+
+# the index of  <pssm_filename>  (see index_psiblast_pssm) from the file next
+# to it, the amino acids then one offset per line, indexed and written there
+# first if it is missing or older than the PSSM, None if  <extension>  is empty
+# to parse the whole PSSM instead
+def load_pssm_index( pssm_filename , extension = PSSM_INDEX_EXTENSION ):
+    if not extension:
+        return None
+    index_filename = get_pssm_index_filename( pssm_filename , extension )
+    if os.path.isfile( index_filename ) and os.path.getmtime( index_filename ) >= os.path.getmtime( pssm_filename ):
+        f = open( index_filename , 'r' )
+        lines = f.read().split( '\n' )
+        f.close()
+        return lines[0] , [int( i ) for i in lines[1:] if i]
+
+    amino_acids , offsets = index_psiblast_pssm( pssm_filename )
+    write_file_atomically( index_filename , amino_acids +'\n'+ ''.join( [str( i ) +'\n' for i in offsets] ) )
+    print 'wrote the index of ' + pssm_filename + ' to ' + index_filename
+    return amino_acids , offsets
+
+# only  <positions>  of  <pssm_filename> , in the same format as
+# extract_pssm_from_psiblast_pssm, each row is read from where  <pssm_index>
+# (see load_pssm_index) says it starts
+def extract_pssm_positions_from_psiblast_pssm( pssm_filename , positions , pssm_index = None ):
+    if not pssm_index:
+        pssm_index = load_pssm_index( pssm_filename ) or index_psiblast_pssm( pssm_filename )
+    amino_acids , offsets = pssm_index
+    columns = len( amino_acids )
+
+    pssm_dict = {}
+    f = open( pssm_filename , 'rb' )
+    for i in sorted( set( positions ) ):
+        if i < 1 or i > len( offsets ):
+            f.close()
+            raise KeyError( i )
+        f.seek( offsets[i - 1] )
+        row = parse_psiblast_pssm_row( f.readline() )
+        if not row or not row[0] == i or not len( row[2] ) == 2*columns + 2:
+            f.close()
+            raise IOError( 'the index of ' + pssm_filename + ' does not match it (position ' + str( i ) + '), remove ' + get_pssm_index_filename( pssm_filename ) + '!!?' )
+        pssm_dict[i] = {
+            'position' : i ,
+            'query identity' : row[1] ,
+            'log-likelihood' : dict( zip( amino_acids , [int( j ) for j in row[2][:columns]] ) ) ,
+            'approximate frequencies' : dict( zip( amino_acids , [float( j )/100 for j in row[2][columns:2*columns]] ) ) ,
+            'information content' : float( row[2][-2] ) ,
+            '?' : float( row[2][-1] )
+            }
+    f.close()
+    return pssm_dict
+
+################################################################################
+# MAIN
+
+if __name__ == '__main__':
+    args = sys.argv[2:]
+    threads = PSIBLAST_SHARD_THREADS
+    if len( args ) > 1 and args[-2] == '-num_threads':
+        threads = int( args[-1] )
+        args = args[:-2]
+
+    if len( sys.argv ) > 2 and sys.argv[1] == 'split':
+        split_psiblast_batch( args[0] )
+        sys.exit( bool( [i for i in args[1:] if not load_batched_pssm( args[0] , i )] ) )
+    elif len( args ) == 5 and sys.argv[1] == 'search':
+        sys.exit( search_psiblast_shard( args[0] , int( args[1] ) , int( args[2] ) , int( args[3] ) , args[4] , threads ) )
+    elif len( args ) > 3 and sys.argv[1] == 'merge':
+        sys.exit( merge_psiblast_shards( args[0] , int( args[1] ) , int( args[2] ) , args[3:] , threads ) )
 
+    print __doc__
+    sys.exit( 1 )
@@ -179,22 +179,25 @@ def run_rosetta_ddg_monomer( pdb_filename , mut_filename , out_filename = '' , o
         # optionally cleanup
         if cleanup:
             print 'ddg_monomer writes useless output files, deleting these now...'
-            remove_intermediate_ddg_monomer_files()
+            remove_intermediate_ddg_monomer_files( out_path or '.' )
         
         # the only output we need
         return out_filename
     else:
         return command , out_filename
 
-# simple helper
-def remove_intermediate_ddg_monomer_files():
-    for i in os.listdir( '.' ):
+# simple helper, the files ddg_monomer leaves in  <path>  (its working directory)
+def remove_intermediate_ddg_monomer_files( path = '.' ):
+    for i in os.listdir( path ):
         if i == 'wt_traj' or 'mutant_traj' == i[:11]:
-            os.remove( i )
+            os.remove( os.path.join( path , i ) )
 
 # simple, for now just check if empty or not
 def check_ddg_monomer_output( ddg_monomer_output_filename ):
     # simple enough, for now just check if empty
+    # (or missing, if it failed before writing anything)
+    if not os.path.isfile( ddg_monomer_output_filename ):
+        return False
     f = open( ddg_monomer_output_filename , 'r' )
     success = bool( f.read().strip() )    # load all of this!?
     f.close()
@@ -343,6 +346,9 @@ def run_rosetta_relax_local( pdb_filename , extra_options = {} , run = True ):
 # simple, for now just check if empty or not
 def check_relax_output( relax_score_filename , target_number_of_trajectories = ROSETTA_RELAX_OPTIONS['nstruct'] , header_lines = 1 , single_relax = True ):
     # simple enough, for now just check if empty
+    # (or missing, if it failed before writing anything)
+    if not os.path.isfile( relax_score_filename ):
+        return False , 0
     f = open( relax_score_filename , 'r' )
     trajectories = len( f.readlines() ) - header_lines
     f.close()
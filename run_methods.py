@@ -11,11 +11,14 @@ arguably place in VIPUR.py but its getting cluttered...
 # IMPORT
 
 # common modules
+import glob
 import os
 import sys
+import multiprocessing
+import multiprocessing.pool
 import shutil
 import subprocess
-import time    # for debugging only
+import time
 
 # bigger modules
 
@@ -31,11 +34,21 @@ from rosetta_feature_generation import *
 
 from classification import *
 
+from scheduling_methods import determine_local_capacity , pack_tasks , determine_occupied_resources , prioritize_tasks , select_straggling_tasks
+from process_methods import start_process , check_process_finished , wait_for_processes , kill_processes
+from adaptive_relax_methods import determine_relax_wave_dependencies , skip_converged_relax_trajectories
+
 ################################################################################
 # SERIAL RUN METHODS
 
 # different options/approaches for setting up job processing
 
+# where a local command writes its stdout + stderr, '' to print it
+def get_command_log_filename( command_dict , extension = LOCAL_COMMAND_LOG_EXTENSION ):
+    if not extension:
+        return ''
+    return command_dict['output_filename'] + extension
+
 def run_serially_until_complete( command_dict , run_command , check_successful , max_tries ):
     tries = 0
     complete = False
@@ -46,8 +59,8 @@ def run_serially_until_complete( command_dict , run_command , check_successful ,
             complete = True
             break
     
-        # run it
-        run_command( command_dict['command'] )
+        # run it, in its own scratch directory
+        run_command( isolate_command( command_dict ) )
         
         # check successful
         success = check_successful( command_dict )
@@ -64,7 +77,7 @@ def run_serially_until_complete( command_dict , run_command , check_successful ,
 # simple task manager, just fire off sequentially + locally
 def run_task_commands_serially( task_summary_filename ,
         ddg_monomer_cleanup = True , max_tries = 2 ,
-        single_relax = False , delete_intermediate_relax_files = False ):
+        single_relax = False , delete_intermediate_relax_files = False , other_task_summaries = [] ):
     # alternate input type
     if isinstance( task_summary_filename , str ):
         task_summary = load_task_summary( task_summary_filename )
@@ -77,98 +90,49 @@ def run_task_commands_serially( task_summary_filename ,
         else:
             raise NotImplementedError( 'should input the task summary filename (not the summary itself)...' )
     
-    # move into the target directory before continuing, for ddg_monomer local
-    current_dir = os.getcwd()
-    os.chdir( task_summary['out_path'] )    # for PBS etc. instead add "cd " to run script
-        
-    # skip rescore, must wait until corresponding relax job is finished
-    print 'launching jobs locally...\n'
+    # skip those that have alreay run
     for i in task_summary['commands']:
-        # these MUST occur AFTER the relax jobs have been run and combined
-        if 'rescore' in i['feature']:    # check for now...
-            continue
-        
-        # skip those that have alreay run
         if 'run' in i.keys() and i['run'] == 'success' and os.path.isfile( i['output_filename'] ):
             print i['output_filename'] + ' appears to have been successfully generated, do not run it again'
-            continue
+        elif 'run' in i.keys():
+            # try again from scratch
+            del i['run']
 
-        # run the command
-        # replace with a while loop checking success...
-#        check_successful = lambda x : True    # assume successful
-#        if i['feature'] == 'psiblast':
-            # just the pssm
-            # assumes blast output structure...
-#            check_successful = lambda x : check_psiblast_output( x['output_filename'] , PSIBLAST_OPTIONS['out']( x['output_filename'].replace( '.pssm' , '' ) ) )
+    # rescore MUST occur AFTER the matching relax jobs have been run and combined
+    # but need not wait for any other variant
+    task_list = [(0 , j) for j in xrange( len( task_summary['commands'] ) )]
+    dependencies = determine_task_dependencies( [task_summary] , task_list )
 
-#        elif i['feature'] == 'probe':
-#            check_successful = lambda x : check_probe_output( x['output_filename'] )
+    # the PSIBLAST batch search of this protein can be in  <other_task_summaries>
+    # (already run), only this task summary is run
+    task_summaries = [task_summary] + [i for i in other_task_summaries if not i is task_summary]
 
-#        elif i['feature'] == 'ddg_monomer':
-#            check_successful = lambda x : check_ddg_monomer_output( x['output_filename'] )
+    print 'launching jobs locally...\n'
+    ready = select_ready_tasks( task_summaries , task_list , dependencies )
+    while ready:
+        # favor commands that were waiting on others e.g. rescore as soon as its relax is done
+        ready.sort( key = lambda x : not dependencies[x] )
+        i = task_summary['commands'][ready[0][1]]
 
-#        elif i['feature'].replace( '_native' , '' ) == 'relax' and not 'rescore' in i['feature']:
-#            check_successful = lambda x : check_relax_output( ROSETTA_RELAX_OPTIONS['out:file:scorefile']( x['output_filename'].replace( '.silent' , '' ) ) , single_relax = single_relax )
+        # combine the individual relax runs
+        # should already point to the proper combined_silent_filename
+        if 'rescore' in i['feature']:
+            merge_relax_output_for_rescore( task_summary , i , single_relax = single_relax , delete_intermediate_relax_files = delete_intermediate_relax_files )
 
         check_successful = determine_check_successful_function( i , single_relax = single_relax )
 
         # alternate method, run until complete
-        completed , tries , failure_summary = run_serially_until_complete( i , run_command = run_local_commandline , check_successful = check_successful , max_tries = max_tries )
+        completed , tries , failure_summary = run_serially_until_complete( i , run_command = lambda x : run_local_commandline( x , log_filename = get_command_log_filename( i ) ) , check_successful = check_successful , max_tries = max_tries )
     
         # optionally cleanup
         if ddg_monomer_cleanup and i['feature'] == 'ddg_monomer':#'ddg' in i['output_filename']:
             print 'ddg_monomer writes useless output files, deleting these now...'
-            remove_intermediate_ddg_monomer_files()
+            remove_intermediate_ddg_monomer_files( task_summary['out_path'] )
         
         # check for complete? failed? how many tries?
         i['run'] = 'success'*completed + (str( tries ) +' tries;failure ' + failure_summary)*(not completed)
 
-    # not do rescore, "but only if complete" (not currently checking)
-    relax_commands = [i for i in task_summary['commands'] if i['feature'].replace( '_native' , '' ) == 'relax']
-    for i in task_summary['commands']:
-        if 'run' in i.keys() and i['run'] == 'success':
-            if 'rescore' in i['feature'] and os.path.isfile( i['output_filename'] ):
-                print i['output_filename'] + ' appears to have been successfully generated, do not run it again'
-            # skip, either its not a rescore, or its a rescore that ran successfully
-            continue
-        
-        # combine the individual relax runs
-        silent_filenames = [j['output_filename'] for j in relax_commands if j['variant'] == i['variant'] and 'run' in j.keys() and j['run'] == 'success']
-        # actually need to identify the combined_silent_filename, be sure the relax files have not already been merged
-        # which variant
-        target_variant = [j for j in task_summary['variants'].keys() if j.split( '_' )[-1] == i['variant'] and j.split( '_' )[0] in i['command']]
-        if not target_variant:
-            # its native
-            combined_silent_filename = task_summary['other']['combined_native_silent_filename']
-            combined_score_filename = task_summary['other']['combined_native_score_filename']
-        elif len( target_variant ) > 1:
-            raise Exception( '??? found more than on matching variant ???\n' + ', '.join( target_variant ) )
-        else:
-            # found it
-            combined_silent_filename = task_summary['variants'][target_variant[0]]['combined_silent_filename']
-            combined_score_filename = task_summary['variants'][target_variant[0]]['combined_score_filename']
-
-        #if not single_relax:    # AND post processing has not already be run...scan for the combined silent file
-        if not single_relax and not os.path.isfile( combined_silent_filename ):
-            if not len( silent_filenames ) == ROSETTA_RELAX_OPTIONS['nstruct']:
-                raise Exception( '??? somehow the matching relax run(s) has failed ???\n' + str( i ) )
-            score_filenames = [j.replace( '.silent' , '.sc' ) for j in silent_filenames]
-
-            merge_rosetta_relax_output( silent_filenames , combined_silent_filename , score_filenames , combined_score_filename , delete_old_files = delete_intermediate_relax_files )
-            # rescore already knows the proper filename
-        else:
-            # just a single match for each
-            # output filename should be correct as is :)
-            None
-        
-        # else, its a rescore, check the corresponding relax
-        # should already point to the proper combined_silent_filename
-        if not 'rescore' in i['feature'] or not 'variant' in i.keys():
-            raise Exception( '??? incomplete or erroneous command that is not a rescore ???\n' + str( i ) )
-        else:
-            # is a rescore AND its relax job it complete, run it
-            run_local_commandline( i['command'] )    # not 'run_until_complete'?
-            i['run'] = 'success'
+        ready = select_ready_tasks( task_summaries , task_list , dependencies )
 
     # return anything?
     # summary? updated with "run" status
@@ -181,15 +145,14 @@ def run_task_commands_serially( task_summary_filename ,
     write_task_summary( task_summary , task_summary_filename )
     task_summary = load_task_summary( task_summary_filename )
 
-    os.chdir( current_dir )
-    
     return task_summary
 
 
 def run_VIPUR_task_summaries_serially( task_summaries , single_relax = False , delete_intermediate_relax_files = True ):
     for i in xrange( len( task_summaries ) ):
         # tasks will check if the task summaries indicates they have already be run
-        task_summaries[i] = run_task_commands_serially( task_summaries[i] , single_relax = single_relax , delete_intermediate_relax_files = delete_intermediate_relax_files )
+        task_summaries[i] = run_task_commands_serially( task_summaries[i] , single_relax = single_relax , delete_intermediate_relax_files = delete_intermediate_relax_files ,
+            other_task_summaries = task_summaries[:i] )
 
 
 #####################
@@ -197,10 +160,15 @@ def run_VIPUR_task_summaries_serially( task_summaries , single_relax = False , d
 
 # identify the targets and do pre-processing and post-processing together
 
-def run_VIPUR_serially( pdb_filename = '' , variants_filename = '' ,
-        out_path = '' , write_numbering_map = True ,
-        single_relax = False , delete_intermediate_relax_files = True ,
-        demo = False , rerun_preprocessing = False ):
+# find all the (structure, variants) pairs to run on
+def determine_target_proteins( pdb_filename = '' , variants_filename = '' , out_path = '' , demo = False ):
+    """
+    Returns a list of the targets VIPUR should run on as
+        [pdb_filename , variants_filename , sequence_only , out_path]
+    
+    <pdb_filename>  can be a single PDB (or FASTA) file or a directory
+    containing (.pdb,  <variants_filename>) file pairs
+    """
     # for the example input
     if demo:
         pdb_filename = PATH_TO_VIPUR + '/example_input/2C35.pdb'
@@ -275,33 +243,303 @@ def run_VIPUR_serially( pdb_filename = '' , variants_filename = '' ,
         this_out_path = get_root_filename( i[0] ) +'_VIPUR'    # directory to create
         target_proteins.append( i + [True , this_out_path] )
 
+    return target_proteins
 
-    # pre processing
-    task_summaries = []
-    for i in target_proteins:
-        # check paths...er, done properly in preprocessing...
-#        if not os.path.isfile( i[0] ):
-#            raise IOError( 'cannot find ' + i[0] + '!!!' )
-#        if not os.path.isfile( i[1] ):
-#            raise IOError( 'cannot find ' + i[1] + '!!!' )
-
-        # guess what the task summary filename 'would' be, if it exists, keep going...
-        task_summary_filename = i[3]*bool( i[3] ) +'/'+ get_root_filename( i[0] ).split( '/' )[-1] + '.task_summary'
-#        print task_summary_filename
-#        raw_input( 'poo' )
-        if os.path.isfile( task_summary_filename ) and not rerun_preprocessing:
-            print 'hmmm, ' + i[0] + ' seems to have run preprocessing already, skipping now'
-            #continue    # skip this one, do not add to list of tasks...?
-            # actually, skip running pre-processing BUT DO add it to the list of tasks
+
+#####################
+# PARALLEL PREPROCESSING
+
+# preprocessing (PyMOL, parsing, writing files) is independent per target, run
+# several at once and hand each task summary to the run methods as soon as
+# it is ready
+
+# guess what the task summary filename of  <target>  'would' be
+def get_target_task_summary_filename( target ):
+    return target[3]*bool( target[3] ) +'/'+ get_root_filename( target[0] ).split( '/' )[-1] + '.task_summary'
+
+# preprocess one target, the  <arguments>  are (target index , target ,
+# write_numbering_map , single_relax , rerun_preprocessing , pymol_environment_setup ,
+# psiblast_batch) with the target from determine_target_proteins and its
+# batch from plan_psiblast_batches (None if it has none)
+# returns (target index , task summary filename)
+def preprocess_target_protein( arguments ):
+    target_index , target , write_numbering_map , single_relax , rerun_preprocessing , pymol_environment_setup , psiblast_batch = arguments
+
+    # if it exists, keep going...
+    task_summary_filename = get_target_task_summary_filename( target )
+    if os.path.isfile( task_summary_filename ) and not rerun_preprocessing:
+        print 'hmmm, ' + target[0] + ' seems to have run preprocessing already, skipping now'
+    else:
+        task_summary_filename = run_preprocessing( target[0] , target[1] ,
+            sequence_only = target[2] , out_path = target[3] ,
+            task_summary_filename = task_summary_filename ,
+            write_numbering_map = write_numbering_map , single_relax = single_relax ,
+            pymol_environment_setup = pymol_environment_setup , psiblast_batch = psiblast_batch )
+
+    return target_index , task_summary_filename
+
+# the protein sequence of  <target> , the same way run_preprocessing finds it
+def load_target_sequence( target ):
+    if target[2] and not get_file_extension( target[0] ) == 'pdb':
+        return load_fasta( target[0] )[0][1]
+    return extract_protein_sequence_from_pdb( target[0] , target_chain = extract_chains_from_pdb( target[0] )[0] , write_numbering_map = False , write_sequence = False )[0]
+
+# group the sequences of the  <target_proteins>  that still need preprocessing
+# into batches of up to  <batch_size>  different sequences, each searched with
+# a single PSIBLAST command (see PSIBLAST_BATCH_SIZE), sequences with a cached
+# PSSM are left out
+# returns { target index : (batch filename , True if it runs the search) } for
+# the targets of each batch with more than one target
+def plan_psiblast_batches( target_proteins , batch_size = PSIBLAST_BATCH_SIZE , rerun_preprocessing = False ):
+    sequences = {}
+    for i in xrange( len( target_proteins ) ):
+        if os.path.isfile( get_target_task_summary_filename( target_proteins[i] ) ) and not rerun_preprocessing:
+            continue
+        sequence = load_target_sequence( target_proteins[i] )
+        if PSSM_CACHE_PATH and os.path.isfile( get_pssm_cache_filename( get_pssm_cache_key( sequence ) ) ):
+            continue
+        sequences.setdefault( sequence , [] ).append( i )
+
+    # in the order of the targets, so the first target of each batch comes
+    # before the others
+    unique_sequences = sorted( sequences.keys() , key = lambda x : sequences[x][0] )
+    psiblast_batches = {}
+    for i in xrange( 0 , len( unique_sequences ) , batch_size ):
+        batch = unique_sequences[i:i + batch_size]
+        targets = sorted( sum( [sequences[j] for j in batch] , [] ) )
+        if len( targets ) < 2:
+            continue
+
+        # with the first target, it runs the search
+        target = target_proteins[targets[0]]
+        if not os.path.isdir( target[3] ):
+            create_directory( target[3] )
+        batch_filename = os.path.abspath( target[3] +'/'+ get_root_filename( target[0] ).split( '/' )[-1] + '.psiblast_batch.fa' )
+        write_psiblast_batch( batch , batch_filename )
+        print 'searching ' + str( len( batch ) ) + ' sequences for ' + str( len( targets ) ) + ' targets at once in ' + batch_filename
+        for j in targets:
+            psiblast_batches[j] = (batch_filename , j == targets[0])
+
+    return psiblast_batches
+
+# start preprocessing all the  <target_proteins>  in  <processes>  processes
+# (0 uses every core, 1 does them one at a time in this process)
+# returns an iterator of (target index , task summary filename) in the order they finish
+def start_preprocessing( target_proteins , processes = PREPROCESSING_PROCESSES ,
+        write_numbering_map = True , single_relax = False , rerun_preprocessing = False , pymol_environment_setup = '' ,
+        psiblast_batch_size = PSIBLAST_BATCH_SIZE ):
+    # the batches need every sequence before anything is preprocessed
+    psiblast_batches = {}
+    if psiblast_batch_size:
+        psiblast_batches = plan_psiblast_batches( target_proteins , psiblast_batch_size , rerun_preprocessing = rerun_preprocessing )
+
+    arguments = [(i , target_proteins[i] , write_numbering_map , single_relax , rerun_preprocessing , pymol_environment_setup , psiblast_batches.get( i )) for i in xrange( len( target_proteins ) )]
+    if not processes:
+        processes = multiprocessing.cpu_count()
+    processes = min( processes , len( target_proteins ) )
+
+    if processes < 2:
+        # lazy, each is run when it is asked for
+        return ( preprocess_target_protein( i ) for i in arguments )
+
+    print 'preprocessing ' + str( len( target_proteins ) ) + ' targets, ' + str( processes ) + ' at a time'
+    pool = multiprocessing.Pool( processes )
+    preprocessed = pool.imap_unordered( preprocess_target_protein , arguments )
+    pool.close()
+    return preprocessed
+
+# the (target index , task summary filename) results that are ready, and if
+# these are the last ones
+# optionally  <block>  until there is at least one
+def collect_preprocessed_targets( preprocessed , block = False ):
+    collected = []
+    while True:
+        try:
+            if isinstance( preprocessed , multiprocessing.pool.IMapIterator ):
+                if block and not collected:
+                    collected.append( preprocessed.next() )
+                else:
+                    collected.append( preprocessed.next( timeout = 0 ) )
+            elif not collected:
+                # one at a time, this blocks anyway
+                collected.append( preprocessed.next() )
+            else:
+                return collected , False
+        except multiprocessing.TimeoutError:
+            return collected , False
+        except StopIteration:
+            return collected , True
+
+# a function the run methods can call for the newly preprocessed task
+# summaries (loaded, optionally modified by  <prepare_task_summary>  for the
+# queue), returns None once all of them are done
+# the target index of each is added to  <target_order>
+def stream_preprocessed_task_summaries( preprocessed , target_order , prepare_task_summary = None ):
+    finished = [False]
+    def more_task_summaries( block = False ):
+        if finished[0]:
+            return None
+        collected , finished[0] = collect_preprocessed_targets( preprocessed , block )
+
+        task_summaries = []
+        for target_index , task_summary_filename in collected:
+            task_summary = load_task_summary( task_summary_filename )
+            if prepare_task_summary:
+                task_summary = prepare_task_summary( task_summary , target_index )
+            target_order.append( target_index )
+            task_summaries.append( task_summary )
+        if finished[0] and not task_summaries:
+            return None
+        return task_summaries
+
+    return more_task_summaries
+
+# add the newly preprocessed task summaries to  <task_summaries>
+# returns their (task index , command index) pairs, None once there are no more
+def add_preprocessed_tasks( task_summaries , more_task_summaries , block = False ):
+    new_task_summaries = more_task_summaries( block )
+    if new_task_summaries is None:
+        return None
+
+    task_list = []
+    for i in new_task_summaries:
+        task_summaries.append( i )
+        task_list += [(len( task_summaries ) - 1 , j) for j in xrange( len( i['commands'] ) )]
+    if new_task_summaries:
+        print 'preprocessing finished for ' + ', '.join( [i['root_filename'].split( '/' )[-1] for i in new_task_summaries] ) + ', adding ' + str( len( task_list ) ) + ' commands'
+    return task_list
+
+# put the results (in the order they finished) back in the order of the targets
+def restore_target_order( task_summaries , target_order ):
+    ordered = [None]*len( task_summaries )
+    for i in xrange( len( target_order ) ):
+        ordered[target_order[i]] = task_summaries[i]
+    return ordered
+
+#####################
+# STREAMING POST PROCESSING
+
+# post processing only needs the output of a single protein, run it for each
+# as soon as its commands are done instead of waiting for every protein
+# <postprocessed>  maps each task summary filename to its post processed summary
+
+def get_task_summary_filename( task_summary ):
+    if isinstance( task_summary , str ):
+        return task_summary
+    return task_summary['filenames']['task_summary_filename']
+
+# post process the  <task_summaries>  whose commands are all successful and
+# have not been yet, then report the progress
+# returns the task summary filenames post processed now
+def stream_postprocessing( task_summaries , postprocessed , progress_filename = PROGRESS_FILENAME ):
+    finished = []
+    for task_summary in task_summaries:
+        task_summary_filename = get_task_summary_filename( task_summary )
+        if isinstance( task_summary , str ) or task_summary_filename in postprocessed.keys():
+            continue
+        elif [i for i in task_summary['commands'] if not 'run' in i.keys() or not ( i['run'] == 'success' or check_command_skipped( i ) )]:
+            continue
+
+        # post process a fresh copy, the run methods keep writing this one
+        write_task_summary( task_summary , task_summary_filename )
+        print '\n\n\nExtracting and Analyzing the Results for ' + task_summary['root_filename'].split( '/' )[-1] + ':\n\n'
+        try:
+            postprocessed[task_summary_filename] = run_postprocessing( task_summary_filename , sequence_only = task_summary['other'].get( 'sequence_only' , False ) )
+        except Exception as e:
+            # try again at the end, with everything else
+            print 'post processing ' + task_summary_filename + ' failed (' + str( e ) + '), will try again once all proteins are done'
+            postprocessed[task_summary_filename] = None
+        finished.append( task_summary_filename )
+
+    write_progress_report( task_summaries , postprocessed , progress_filename )
+    return finished
+
+# post process anything not done during the run e.g. proteins with failed commands
+# <sequence_only>  is the mode of each of the  <task_summaries>
+def finish_postprocessing( task_summaries , sequence_only , postprocessed = None , progress_filename = PROGRESS_FILENAME ):
+    if postprocessed is None:
+        postprocessed = {}
+    # any PSSM that succeeded since the run methods last checked
+    cache_successful_pssms( task_summaries )
+    for i in xrange( len( task_summaries ) ):
+        task_summary_filename = get_task_summary_filename( task_summaries[i] )
+        if postprocessed.get( task_summary_filename ):
+            task_summaries[i] = postprocessed[task_summary_filename]
+            continue
+
+        # always okay to rerun post processing...should not make any difference
+        print '\n\n\nExtracting and Analyzing the Results:\n\n'
+        task_summaries[i] = run_postprocessing( task_summaries[i] , sequence_only = sequence_only[i] )
+        postprocessed[task_summary_filename] = task_summaries[i]
+
+    write_progress_report( task_summaries , postprocessed , progress_filename )
+    return task_summaries
+
+# where the progress report of the run of  <task_summaries>  goes, relative
+# filenames are in the out_path of the run, the directory holding the out_path
+# of each protein (none until one is loaded)
+def get_progress_filename( task_summaries , progress_filename = PROGRESS_FILENAME ):
+    if not progress_filename or os.path.isabs( progress_filename ):
+        return progress_filename
+    task_summaries = [i for i in task_summaries if not isinstance( i , str )]
+    if not task_summaries:
+        return ''
+    return os.path.dirname( os.path.abspath( task_summaries[0]['out_path'] ) ) +'/'+ progress_filename
+
+# a table of the commands that are successful, failed, and remaining for each
+# protein, if it was post processed yet (and where its predictions are), and the totals
+def write_progress_report( task_summaries , postprocessed , progress_filename = PROGRESS_FILENAME ):
+    header = ['protein' , 'success' , 'skipped' , 'failed' , 'remaining' , 'total' , 'predictions']
+    lines = []
+    totals = [0]*5
+    for task_summary in task_summaries:
+        if isinstance( task_summary , str ):
+            continue
+        runs = [i.get( 'run' , '' ) for i in task_summary['commands']]
+        counts = [len( [i for i in runs if i == 'success'] ) , len( [i for i in runs if i == 'skipped'] ) , len( [i for i in runs if 'failure' in i] )]
+        counts += [len( runs ) - sum( counts ) , len( runs )]
+        totals = [totals[i] + counts[i] for i in xrange( 5 )]
+
+        predictions = postprocessed.get( get_task_summary_filename( task_summary ) )
+        if predictions:
+            predictions = predictions['filenames']['prediction_filename']
         else:
-#            print i
-        
-            task_summary_filename = run_preprocessing( i[0] , i[1] ,
-                sequence_only = i[2] , out_path = i[3] ,
-                task_summary_filename = task_summary_filename ,
-                write_numbering_map = write_numbering_map , single_relax = single_relax )
+            predictions = 'failed'*( get_task_summary_filename( task_summary ) in postprocessed.keys() ) or 'waiting'
+        lines.append( [task_summary['root_filename'].split( '/' )[-1]] + counts + [predictions] )
+    lines.append( ['all'] + totals + [str( len( [i for i in postprocessed.values() if i] ) ) +' of '+ str( len( lines ) ) +' done'] )
+
+    report = '\n'.join( ['\t'.join( [str( j ) for j in i] ) for i in [header] + lines] )
+    print '\nPROGRESS\n' + report +'\n'
+    progress_filename = get_progress_filename( task_summaries , progress_filename )
+    if progress_filename:
+        f = open( progress_filename , 'w' )
+        f.write( report +'\n' )
+        f.close()
+
 
-        task_summaries.append( task_summary_filename )
+def run_VIPUR_serially( pdb_filename = '' , variants_filename = '' ,
+        out_path = '' , write_numbering_map = True ,
+        single_relax = False , delete_intermediate_relax_files = True ,
+        demo = False , rerun_preprocessing = False ):
+    target_proteins = determine_target_proteins( pdb_filename , variants_filename , out_path = out_path , demo = demo )
+
+
+    # pre processing
+    # in parallel, run each as soon as it is ready
+    # check paths...er, done properly in preprocessing...
+    task_summaries = [None]*len( target_proteins )
+    postprocessed = {}
+    preprocessed = start_preprocessing( target_proteins , write_numbering_map = write_numbering_map ,
+        single_relax = single_relax , rerun_preprocessing = rerun_preprocessing )
+    # the first target of each PSIBLAST batch runs its search, the others need it
+    if PSIBLAST_BATCH_SIZE:
+        preprocessed = sorted( preprocessed )
+    for i , task_summary_filename in preprocessed:
+        # tasks will check if the task summaries indicates they have already be run
+        task_summaries[i] = run_task_commands_serially( task_summary_filename , single_relax = single_relax , delete_intermediate_relax_files = delete_intermediate_relax_files ,
+            other_task_summaries = [j for j in task_summaries if j] )
+        # and its results, without waiting for the rest
+        stream_postprocessing( [j for j in task_summaries if j] , postprocessed )
 
     # "sequence_only"
 #    sequence_task_summaries = []
@@ -314,7 +552,8 @@ def run_VIPUR_serially( pdb_filename = '' , variants_filename = '' ,
 #    raw_input( 'preprocessing' )
 
     # run them all
-    run_VIPUR_task_summaries_serially( task_summaries , single_relax = single_relax , delete_intermediate_relax_files = delete_intermediate_relax_files )
+    # already done above
+#    run_VIPUR_task_summaries_serially( task_summaries , single_relax = single_relax , delete_intermediate_relax_files = delete_intermediate_relax_files )
 #    for i in xrange( len( task_summaries ) ):
         # tasks will check if the task summaries indicates they have already be run
 #        task_summaries[i] = run_task_commands_serially( task_summaries[i] , single_relax = single_relax , delete_intermediate_relax_files = delete_intermediate_relax_files )
@@ -342,10 +581,8 @@ def run_VIPUR_serially( pdb_filename = '' , variants_filename = '' ,
 
 
     # post processing
-    for i in xrange( len( task_summaries ) ):
-        # always okay to rerun post processing...should not make any difference
-        sequence_only = target_proteins[i][2]
-        task_summaries[i] = run_postprocessing( task_summaries[i] , sequence_only = sequence_only )
+    # most were done as soon as their commands finished
+    task_summaries = finish_postprocessing( task_summaries , [i[2] for i in target_proteins] , postprocessed )
 #    for i in xrange( len( sequence_task_summaries ) ):
 #        sequence_task_summaries[i] = run_postprocessing( sequence_task_summaries[i] , sequence_only = True )
 
@@ -373,6 +610,14 @@ def determine_check_successful_function( command_dict , single_relax = False ):
         # assumes blast output structure...
         check_successful = lambda x : check_psiblast_output( x['output_filename'] , PSIBLAST_OPTIONS['out']( x['output_filename'].replace( '.pssm' , '' ) ) )
 
+    elif command_dict['feature'] == 'psiblast_shard':
+        # its output exists even if the search failed
+        check_successful = lambda x : os.path.isfile( get_psiblast_shard_done_filename( x['output_filename'] ) )
+
+    elif command_dict['feature'] == 'psiblast_merge':
+        # the checkpoint can be empty (see merge_psiblast_shards)
+        check_successful = lambda x : os.path.isfile( x['output_filename'] )
+
     elif command_dict['feature'] == 'probe':
         check_successful = lambda x : check_probe_output( x['output_filename'] )
 
@@ -384,6 +629,537 @@ def determine_check_successful_function( command_dict , single_relax = False ):
 
     return check_successful
 
+# the check_successful functions return a bool OR a tuple (bool , details...)
+def interpret_check_successful( success ):
+    complete = False
+    failure_summary = ''
+    if isinstance( success , bool ):
+        complete = success
+    elif len( success ) > 1 and isinstance( success[0] , bool ):
+        complete = success[0]
+        failure_summary += ' '+ ';'.join( [str( j ) for j in success[1:]] ) +' '
+
+    return complete , failure_summary
+
+# rescore needs the relax trajectories (if run separately) combined first
+def merge_relax_output_for_rescore( task_summary , command_dict , single_relax = False , delete_intermediate_relax_files = False ):
+    # combine the individual relax runs
+    silent_filenames = [j['output_filename'] for j in task_summary['commands'] if
+        j['feature'].replace( '_native' , '' ) == 'relax' and
+        j['variant'] == command_dict['variant'] and
+        'run' in j.keys() and
+        'success' in j['run']
+        ]
+    # actually need to identify the combined_silent_filename, be sure the relax files have not already been merged
+    # which variant
+    target_variant = [j for j in task_summary['variants'].keys() if j.split( '_' )[-1] == command_dict['variant'] and j.split( '_' )[0] in command_dict['command']]
+    if not target_variant:
+        # its native
+        combined_silent_filename = task_summary['other']['combined_native_silent_filename']
+        combined_score_filename = task_summary['other']['combined_native_score_filename']
+    elif len( target_variant ) > 1:
+        raise Exception( '??? found more than on matching variant ???\n' + ', '.join( target_variant ) )
+    else:
+        # found it
+        combined_silent_filename = task_summary['variants'][target_variant[0]]['combined_silent_filename']
+        combined_score_filename = task_summary['variants'][target_variant[0]]['combined_score_filename']
+
+    #if not single_relax:    # AND post processing has not already be run...scan for the combined silent file
+    if not single_relax and not os.path.isfile( combined_silent_filename ):
+        # fewer if adaptive relax skipped some
+        if not len( silent_filenames ) == len( [j for j in task_summary['commands'] if j['feature'].replace( '_native' , '' ) == 'relax' and j['variant'] == command_dict['variant'] and not check_command_skipped( j )] ):
+            raise Exception( '??? somehow the matching relax run(s) has failed ???\n' + str( command_dict ) )
+        score_filenames = [j.replace( '.silent' , '.sc' ) for j in silent_filenames]
+
+        merge_rosetta_relax_output( silent_filenames , combined_silent_filename , score_filenames , combined_score_filename , delete_old_files = delete_intermediate_relax_files )
+        # rescore already knows the proper filename
+    # else, just a single match for each
+    # output filename should be correct as is :)
+
+    return combined_silent_filename
+
+
+# the commands in  <task_list>  that still need to run, clears the "run"
+# entry of the others so they start from scratch
+def determine_tasks_to_run( task_summaries , task_list ):
+    # skip those that have alreay run
+    queued = []
+    for i in task_list:
+        command_dict = task_summaries[i[0]]['commands'][i[1]]
+        if 'run' in command_dict.keys() and command_dict['run'] == 'success' and os.path.isfile( command_dict['output_filename'] ):
+            print command_dict['output_filename'] + ' appears to have been successfully generated, do not run it again'
+            continue
+        elif check_command_skipped( command_dict ):
+            continue
+        elif 'run' in command_dict.keys():
+            # try again from scratch
+            del command_dict['run']
+        queued.append( i )
+    return queued
+
+################################################################################
+# QUEUE JOB RECORDS
+
+# the queue run methods only track their jobs in memory ("running_or_queued",
+# queue job id : job pair), so each command also records its queue job id
+# ("job_id") in its task summary as soon as it is submitted, a restart picks
+# those jobs back up instead of submitting the commands again
+
+# record the job ids in  <running_or_queued>  with their commands, written
+# to the task summary journals right away
+def record_submitted_jobs( task_summaries , running_or_queued ):
+    changed = []
+    for job_id in running_or_queued.keys():
+        command_dict = task_summaries[running_or_queued[job_id][0]]['commands'][running_or_queued[job_id][1]]
+        if not command_dict.get( 'job_id' ) == job_id:
+            command_dict['job_id'] = job_id
+            if not running_or_queued[job_id][0] in changed:
+                changed.append( running_or_queued[job_id][0] )
+
+    for i in changed:
+        journal_task_summary( task_summaries[i] )
+
+# once a job is done, its command no longer belongs to it
+def forget_submitted_job( command_dict ):
+    if 'job_id' in command_dict.keys():
+        del command_dict['job_id']
+
+# the jobs already submitted for the unfinished commands in  <task_list>
+# (queue job id : job pair), e.g. by a run that was interrupted
+def reattach_submitted_jobs( task_summaries , task_list ):
+    running_or_queued = {}
+    for i in task_list:
+        command_dict = task_summaries[i[0]]['commands'][i[1]]
+        if command_dict.get( 'job_id' ) and not check_command_finished( command_dict ):
+            running_or_queued[command_dict['job_id']] = i
+    if running_or_queued:
+        print 're-attaching to ' + str( len( running_or_queued ) ) + ' jobs that were already submitted'
+    return running_or_queued
+
+################################################################################
+# SPECULATIVE EXECUTION
+
+# stragglers (see select_straggling_tasks) get a duplicate that runs the same
+# command, same seed, into its own output files, each runner tracks them in
+# "speculative" as
+#    key : (command dict , original job , duplicate job , duplicate command dict)
+# where the jobs are whatever the runner checks and stops (processes, queue
+# job ids), the first to finish successfully wins and the other is stopped
+# if the original fails first, the duplicate keeps running as its next try,
+# the runners leave the original alone while it is still in "speculative"
+
+# a copy of  <command_dict>  that writes to its own output files
+def get_speculative_command_dict( command_dict , suffix = SPECULATIVE_SUFFIX ):
+    root = os.path.splitext( command_dict['output_filename'] )[0]
+    speculative_dict = dict( [(i , command_dict[i]) for i in ['feature' , 'variant' , 'output_filename' , 'command'] if i in command_dict.keys()] )
+    speculative_dict['output_filename'] = command_dict['output_filename'].replace( root , root + suffix , 1 )
+    speculative_dict['command'] = command_dict['command'].replace( root + '.' , root + suffix + '.' )
+    return speculative_dict
+
+# did the duplicate produce complete output?
+def check_speculative_output( speculative_dict , single_relax = False ):
+    check_successful = determine_check_successful_function( speculative_dict , single_relax = single_relax )
+    try:
+        return interpret_check_successful( check_successful( speculative_dict ) )[0]
+    except IOError:
+        # it did not write anything
+        return False
+
+# move the duplicate's output (the files its command names) into place if it
+# won, remove anything else it left behind (scripts, logs)
+def finish_speculative_command( command_dict , speculative_dict , keep_speculative = False ):
+    root = os.path.splitext( command_dict['output_filename'] )[0]
+    speculative_root = os.path.splitext( speculative_dict['output_filename'] )[0]
+    for i in glob.glob( speculative_root + '.*' ):
+        if keep_speculative and os.path.basename( i ) in speculative_dict['command']:
+            os.rename( i , root + i[len( speculative_root ):] )
+        elif os.path.isdir( i ):
+            # the scratch directory of a stopped duplicate
+            shutil.rmtree( i )
+        else:
+            os.remove( i )
+    # and of the stopped original
+    if keep_speculative and COMMAND_SCRATCH_EXTENSION and os.path.isdir( command_dict['output_filename'] + COMMAND_SCRATCH_EXTENSION ):
+        shutil.rmtree( command_dict['output_filename'] + COMMAND_SCRATCH_EXTENSION )
+
+# settle any of the  <speculative>  commands where either copy finished
+# <check_finished>  and  <stop>  take a job, returns the keys whose duplicate
+# won (the original was stopped, its output is now in place)
+# the keys whose duplicate ran on after the original failed are added to
+# <retried>  once it is settled, that is one more try
+def resolve_speculative_commands( speculative , check_finished , stop , single_relax = False , retried = None ):
+    won = []
+    for key in speculative.keys():
+        command_dict , job , speculative_job , speculative_dict = speculative[key]
+        if check_finished( speculative_job ) and check_speculative_output( speculative_dict , single_relax = single_relax ):
+            print command_dict['output_filename'] + ' was finished first by its duplicate'
+            if not check_finished( job ):
+                stop( job )
+            finish_speculative_command( command_dict , speculative_dict , keep_speculative = True )
+            won.append( key )
+        elif check_finished( job ) and not check_finished( speculative_job ) and ( 'retry' in speculative_dict.keys() or not check_speculative_output( command_dict , single_relax = single_relax ) ):
+            # the original failed, the duplicate is the best bet to finish it
+            if not 'retry' in speculative_dict.keys():
+                print command_dict['output_filename'] + ' was not generated properly, its duplicate keeps running as the next try'
+                speculative_dict['retry'] = True
+            continue
+        elif check_finished( job ) or check_finished( speculative_job ):
+            # the original finished first, or the duplicate failed
+            if not check_finished( speculative_job ):
+                stop( speculative_job )
+            finish_speculative_command( command_dict , speculative_dict )
+        else:
+            continue
+        if 'retry' in speculative_dict.keys() and not retried is None:
+            retried.append( key )
+        del speculative[key]
+
+    return won
+
+# the  <speculative>  duplicates still running as the next try of a failed original
+def list_retrying_speculative_commands( speculative ):
+    return [i for i in speculative.keys() if 'retry' in speculative[i][3].keys()]
+
+# the duplicate of  <command_dict>  ran as another try (see
+# resolve_speculative_commands), for the runners that count tries in "run"
+def count_speculative_retry( command_dict ):
+    command_dict['run'] = str( int( command_dict.get( 'run' ) or 0 ) + 1 )
+
+# stop all the duplicates still in  <speculative> , e.g. once the run is done
+def stop_speculative_commands( speculative , stop ):
+    for key in speculative.keys():
+        command_dict , job , speculative_job , speculative_dict = speculative[key]
+        stop( speculative_job )
+        finish_speculative_command( command_dict , speculative_dict )
+        del speculative[key]
+
+# the duplicates as more entries for  <running_or_queued> , to count the
+# resources they hold
+def list_speculative_jobs( speculative , running_or_queued ):
+    return dict( [(j[2] , running_or_queued[i]) for i , j in speculative.items() if i in running_or_queued.keys()] )
+
+################################################################################
+# TASK DEPENDENCY METHODS
+
+# the commands in the task summaries form a simple DAG, only the rescore
+# commands depend on anything:
+#    relax trajectories -> merge -> rescore
+# with one chain per variant (and one for the native)
+# the merge is done right before launching the rescore, so each rescore can
+# start as soon as its own relax trajectories have finished
+
+# map each (task index , command index) pair onto the pairs it needs first
+def determine_task_dependencies( task_summaries , task_list = [] , adaptive_relax = ADAPTIVE_RELAX ):
+    if not task_list:
+        task_list = sum( [[(i , j) for j in xrange( len( task_summaries[i]['commands'] ) )] for i in xrange( len( task_summaries ) )] , [] )
+
+    dependencies = {}
+    for i in task_list:
+        command_dict = task_summaries[i[0]]['commands'][i[1]]
+        dependencies[i] = []
+        if 'rescore' in command_dict['feature']:
+            # sanity check
+            if not 'variant' in command_dict.keys():
+                raise Exception( '??? rescore command without the variant information ???\n' + str( command_dict ) )
+
+            dependencies[i] = [(i[0] , j) for j in xrange( len( task_summaries[i[0]]['commands'] ) ) if
+                task_summaries[i[0]]['commands'][j]['feature'].replace( '_native' , '' ) == 'relax' and
+                task_summaries[i[0]]['commands'][j]['variant'] == command_dict['variant']
+                ]
+        elif 'psiblast_round' in command_dict.keys():
+            # sharded PSIBLAST (see run_psiblast_shards), the shards of each
+            # round search the merge of the last, each merge needs its shards
+            search_round = int( command_dict['psiblast_round'] )
+            if command_dict['feature'] == 'psiblast_shard':
+                dependencies[i] = [(i[0] , j) for j , k in enumerate( task_summaries[i[0]]['commands'] ) if
+                    'psiblast_round' in k.keys() and not k['feature'] == 'psiblast_shard' and int( k['psiblast_round'] ) == search_round - 1]
+            else:
+                dependencies[i] = [(i[0] , j) for j , k in enumerate( task_summaries[i[0]]['commands'] ) if
+                    'psiblast_round' in k.keys() and k['feature'] == 'psiblast_shard' and int( k['psiblast_round'] ) == search_round]
+        elif adaptive_relax:
+            # trajectories run in waves
+            dependencies[i] = determine_relax_wave_dependencies( task_summaries , i )
+
+    return dependencies
+
+# has this command finished? either way
+def check_command_finished( command_dict ):
+    return 'run' in command_dict.keys() and ('success' in command_dict['run'] or 'failure' in command_dict['run'] or check_command_skipped( command_dict ))
+
+# not needed after all e.g. relax trajectories once the features converged
+def check_command_skipped( command_dict ):
+    return command_dict.get( 'run' ) == 'skipped'
+
+# "ready" if everything it needs was successful, "blocked" if any failed
+def determine_task_status( task_summaries , job_pair , dependencies ):
+    required = [task_summaries[i[0]]['commands'][i[1]] for i in dependencies.get( job_pair , [] )]
+    if [i for i in required if check_command_finished( i ) and not 'success' in i['run'] and not check_command_skipped( i )]:
+        return 'blocked'
+    elif [i for i in required if not check_command_finished( i )]:
+        return 'waiting'
+    return 'ready'
+
+# the PSIBLAST commands of a batch that do not run its search (see
+# plan_psiblast_batches) are never launched, their PSSM is copied once the
+# search is done, if it failed so do they
+def resolve_batched_psiblast_commands( task_summaries , task_list ):
+    searches = dict( [(j['psiblast_batch_search'] , j) for i in task_summaries for j in i['commands'] if 'psiblast_batch_search' in j.keys()] )
+    for i in task_list:
+        command_dict = task_summaries[i[0]]['commands'][i[1]]
+        if not 'psiblast_batch' in command_dict.keys() or check_command_finished( command_dict ):
+            continue
+
+        if load_batched_pssm( command_dict['psiblast_batch'] , task_summaries[i[0]]['filenames']['sequence_filename'] ):
+            command_dict['run'] = 'success'
+        elif command_dict['psiblast_batch'] in searches.keys() and check_command_finished( searches[command_dict['psiblast_batch']] ):
+            print command_dict['output_filename'] + ' cannot be generated, its batch search did not produce it'
+            command_dict['run'] = '0 tries;failure batch search failed'
+
+# the PSSMs already added to the cache (see cache_successful_pssms)
+CACHED_PSSM_FILENAMES = set()
+
+# add the PSSM of each of the  <task_summaries>  to the cache (see
+# PSSM_CACHE_PATH) as soon as its psiblast command is successful, without
+# waiting for the rest of the protein
+def cache_successful_pssms( task_summaries , cache_path = PSSM_CACHE_PATH ):
+    if not cache_path:
+        return
+    for task_summary in task_summaries:
+        if isinstance( task_summary , str ):
+            continue
+        for i in task_summary['commands']:
+            if i['feature'] == 'psiblast' and i.get( 'run' ) == 'success' and not i['output_filename'] in CACHED_PSSM_FILENAMES:
+                store_cached_pssm( load_fasta( task_summary['filenames']['sequence_filename'] )[0][1] , i['output_filename'] ,
+                    PSIBLAST_OPTIONS['out']( i['output_filename'].replace( '.pssm' , '' ) ) , cache_path )
+                CACHED_PSSM_FILENAMES.add( i['output_filename'] )
+
+# the tasks that can be launched right now
+# tasks that can never run are recorded as failures, relax trajectories that
+# are no longer needed as skipped (see skip_converged_relax_trajectories),
+# batched PSIBLAST commands as their search finishes, and successful PSSMs
+# are cached
+def select_ready_tasks( task_summaries , task_list , dependencies , adaptive_relax = ADAPTIVE_RELAX , psiblast_batch_size = PSIBLAST_BATCH_SIZE ):
+    if adaptive_relax:
+        skip_converged_relax_trajectories( task_summaries , task_list )
+    if psiblast_batch_size:
+        resolve_batched_psiblast_commands( task_summaries , task_list )
+    cache_successful_pssms( [task_summaries[i] for i in sorted( set( [j[0] for j in task_list] ) )] )
+
+    ready = []
+    for i in task_list:
+        command_dict = task_summaries[i[0]]['commands'][i[1]]
+        if check_command_finished( command_dict ):
+            continue
+        elif psiblast_batch_size and 'psiblast_batch' in command_dict.keys():
+            # still waiting on its search
+            continue
+
+        status = determine_task_status( task_summaries , i , dependencies )
+        if status == 'ready':
+            ready.append( i )
+        elif status == 'blocked':
+            print command_dict['output_filename'] + ' cannot be generated, the commands it depends on failed'
+            command_dict['run'] = '0 tries;failure dependencies failed'
+
+    return ready
+
+
+################################################################################
+# LOCAL PARALLEL RUN METHODS
+
+# same framework as the serial methods, but keep several commands running at
+# once on the local machine
+# every command is already its own process, so the "pool" is just the list of
+# subprocesses currently running, packed by the cores + memory each needs
+
+# run until complete or too many attempts
+def run_VIPUR_tasks_locally_in_parallel( task_summaries , task_list , workers = LOCAL_PARALLEL_WORKERS ,
+        max_tries = 2 , single_relax = False , delete_intermediate_relax_files = False ,
+        monitor_delay = LOCAL_PARALLEL_MONITOR_DELAY , memory = LOCAL_PARALLEL_MEMORY , more_task_summaries = None , postprocessed = None ,
+        speculate = SPECULATIVE_EXECUTION ):
+    """
+    Runs the commands in  <task_list>  ((task index , command index) pairs
+    into  <task_summaries>) as separate local processes, keeping as many
+    running at once as fit into  <workers>  cores and  <memory>  GB, and
+    records the outcome of each command in its "run" entry
+
+    Commands only start once the commands they depend on are successful,
+    commands that do not pass their success check are rerun, up to
+    <max_tries>  attempts
+
+    Optionally add the commands of new task summaries as they are
+    preprocessed, from  <more_task_summaries>  (see
+    stream_preprocessed_task_summaries)
+
+    Optionally post process each protein as soon as its commands are
+    successful, into  <postprocessed>  (see stream_postprocessing)
+
+    Optionally  <speculate> , run a duplicate of any command that takes much
+    longer than its siblings and keep whichever finishes first (see
+    select_straggling_tasks)
+    """
+    workers , memory = determine_local_capacity( workers , memory )
+    dependencies = determine_task_dependencies( task_summaries , task_list )
+
+    # skip those that have alreay run
+    queued = determine_tasks_to_run( task_summaries , task_list )
+    tries = dict( [(i , 0) for i in queued] )
+    failure_summaries = dict( [(i , '') for i in queued] )
+
+    print 'launching ' + str( len( queued ) ) + ' jobs locally, using up to ' + str( workers ) + ' cores and ' + str( memory ) + 'GB...\n'
+    running = {}
+    speculative = {}
+    speculated = []
+    while queued or running or speculative or more_task_summaries:
+        # commands for any proteins that finished preprocessing
+        if more_task_summaries:
+            new_task_list = add_preprocessed_tasks( task_summaries , more_task_summaries , block = not queued and not running )
+            if new_task_list is None:
+                more_task_summaries = None
+            elif new_task_list:
+                task_list += new_task_list
+                dependencies.update( determine_task_dependencies( task_summaries , new_task_list ) )
+                new_task_list = determine_tasks_to_run( task_summaries , new_task_list )
+                queued += new_task_list
+                tries.update( dict( [(i , 0) for i in new_task_list] ) )
+                failure_summaries.update( dict( [(i , '') for i in new_task_list] ) )
+
+        # fill any open slots, only with commands whose dependencies are done
+        # the longest critical path first
+        ready = prioritize_tasks( task_summaries , select_ready_tasks( task_summaries , queued , dependencies ) , dependencies )
+        queued = [i for i in queued if not check_command_finished( task_summaries[i[0]]['commands'][i[1]] )]
+        if queued and not ready and not running and not more_task_summaries:
+            raise Exception( '??? none of the remaining commands can run, their dependencies are not in this set of tasks ???' )
+
+        occupied_cores , occupied_memory = determine_occupied_resources( task_summaries , running.keys() + speculative.keys() , workers , memory )
+        for i in pack_tasks( task_summaries , ready , workers - occupied_cores , memory - occupied_memory , workers , memory ):
+            command_dict = task_summaries[i[0]]['commands'][i[1]]
+            queued.remove( i )
+
+            # if its a rescore and relax jobs were separated, need to recombine them!
+            if 'rescore' in command_dict['feature']:
+                merge_relax_output_for_rescore( task_summaries[i[0]] , command_dict , single_relax = single_relax , delete_intermediate_relax_files = delete_intermediate_relax_files )
+
+            print '\n'+ '='*80 + '\nLaunching local process:\n' + command_dict['command'] + '\n' + '='*80 +'\n'
+            running[i] = start_process( isolate_command( command_dict ) , get_command_log_filename( command_dict ) )
+            tries[i] += 1
+
+        # duplicate any stragglers, into whatever room is left
+        if speculate:
+            now = time.time()
+            stragglers = select_straggling_tasks( task_summaries , dict( [(i , now - running[i]['start_time']) for i in running.keys()] ) , speculated )
+            occupied_cores , occupied_memory = determine_occupied_resources( task_summaries , running.keys() + speculative.keys() , workers , memory )
+            for i in pack_tasks( task_summaries , stragglers , workers - occupied_cores , memory - occupied_memory , workers , memory ):
+                command_dict = task_summaries[i[0]]['commands'][i[1]]
+                speculative_dict = get_speculative_command_dict( command_dict )
+                print command_dict['output_filename'] + ' is taking longer than its siblings, launching a duplicate'
+                speculative[i] = (command_dict , running[i] , start_process( isolate_command( speculative_dict ) , get_command_log_filename( speculative_dict ) ) , speculative_dict)
+                speculated.append( i )
+
+        # whichever copy finishes first counts, stop the other
+        if speculative:
+            retried = []
+            resolve_speculative_commands( speculative , check_process_finished , lambda x : kill_processes( [x] ) , single_relax = single_relax , retried = retried )
+            for i in retried:
+                tries[i] += 1
+
+        # assess outcome of completed commands, unless a duplicate still runs as the next try
+        finished = [i for i in running.keys() if not i in speculative.keys() and check_process_finished( running[i] )]
+        for i in finished:
+            command_dict = task_summaries[i[0]]['commands'][i[1]]
+            command_dict['runtime'] = str( int( round( running[i]['runtime'] ) ) )
+            del running[i]
+            check_successful = determine_check_successful_function( command_dict , single_relax = single_relax )
+            complete , failure_summary = interpret_check_successful( check_successful( command_dict ) )
+            failure_summaries[i] += failure_summary
+
+            if complete:
+                command_dict['run'] = 'success'
+            elif tries[i] < max_tries:
+                # try again
+                print command_dict['output_filename'] + ' was not generated properly, trying again'
+                command_dict['run'] = str( tries[i] )
+                queued.append( i )
+            else:
+                print command_dict['output_filename'] + ' failed with ' + str( tries[i] ) + ' attempts'
+                command_dict['run'] = str( tries[i] ) +' tries;failure ' + failure_summaries[i]
+        if finished and not postprocessed is None:
+            stream_postprocessing( task_summaries , postprocessed )
+
+        # pause...
+        # until any command finishes
+        if running and not finished:
+            wait_for_processes( running.values() + [i[2] for i in speculative.values()] , monitor_delay )
+        elif more_task_summaries and not finished:
+            time.sleep( monitor_delay )
+
+# collect up all commands across the task summaries and run them together
+def run_VIPUR_task_summaries_parallel( task_summaries , workers = LOCAL_PARALLEL_WORKERS ,
+        ddg_monomer_cleanup = True , max_tries = 2 ,
+        single_relax = False , delete_intermediate_relax_files = True , more_task_summaries = None , postprocessed = None ):
+    # reload? really how this should be done...
+    for i in xrange( len( task_summaries ) ):
+        if isinstance( task_summaries[i] , str ):
+            task_summaries[i] = load_task_summary( task_summaries[i] )
+        if not 'task_summary_filename' in task_summaries[i]['filenames'].keys():
+            raise NotImplementedError( 'should input the task summary filename (not the summary itself)...' )
+
+    # make a list of ALL jobs instead of per protein tasks
+    # rescore commands wait for their own relax commands, nothing else
+    task_list = sum( [[(i , j) for j in xrange( len( task_summaries[i]['commands'] ) )] for i in xrange( len( task_summaries ) )] , [] )
+    run_VIPUR_tasks_locally_in_parallel( task_summaries , task_list , workers = workers , max_tries = max_tries ,
+        single_relax = single_relax , delete_intermediate_relax_files = delete_intermediate_relax_files ,
+        more_task_summaries = more_task_summaries , postprocessed = postprocessed )
+
+    # optionally cleanup, ddg_monomer commands "cd" into their out_path
+    # (unless they run in scratch directories)
+    if ddg_monomer_cleanup:
+        for i in task_summaries:
+            if [j for j in i['commands'] if j['feature'] == 'ddg_monomer']:
+                print 'ddg_monomer writes useless output files, deleting these now...'
+                remove_intermediate_ddg_monomer_files( i['out_path'] )
+
+    # rewrite the task summaries
+    for i in xrange( len( task_summaries ) ):
+        write_task_summary( task_summaries[i] , task_summaries[i]['filenames']['task_summary_filename'] )
+        task_summaries[i] = load_task_summary( task_summaries[i]['filenames']['task_summary_filename'] )
+
+    return task_summaries
+
+# single task summary version, analogous to run_task_commands_serially
+def run_task_commands_parallel( task_summary_filename , workers = LOCAL_PARALLEL_WORKERS ,
+        ddg_monomer_cleanup = True , max_tries = 2 ,
+        single_relax = False , delete_intermediate_relax_files = False ):
+    return run_VIPUR_task_summaries_parallel( [task_summary_filename] , workers = workers ,
+        ddg_monomer_cleanup = ddg_monomer_cleanup , max_tries = max_tries ,
+        single_relax = single_relax , delete_intermediate_relax_files = delete_intermediate_relax_files )[0]
+
+# identical to run_VIPUR_serially, except for running the commands
+def run_VIPUR_locally_in_parallel( pdb_filename = '' , variants_filename = '' ,
+        out_path = '' , write_numbering_map = True ,
+        single_relax = False , delete_intermediate_relax_files = True ,
+        demo = False , rerun_preprocessing = False , workers = LOCAL_PARALLEL_WORKERS ):
+    target_proteins = determine_target_proteins( pdb_filename , variants_filename , out_path = out_path , demo = demo )
+
+    # pre processing
+    # in parallel, their commands start as soon as each is ready
+    target_order = []
+    more_task_summaries = stream_preprocessed_task_summaries( start_preprocessing( target_proteins , write_numbering_map = write_numbering_map ,
+        single_relax = single_relax , rerun_preprocessing = rerun_preprocessing ) , target_order )
+
+    # run them all
+    # each is post processed as soon as its commands finish
+    postprocessed = {}
+    task_summaries = run_VIPUR_task_summaries_parallel( [] , workers = workers , single_relax = single_relax , delete_intermediate_relax_files = delete_intermediate_relax_files ,
+        more_task_summaries = more_task_summaries , postprocessed = postprocessed )
+    task_summaries = restore_target_order( task_summaries , target_order )
+
+    # post processing
+    # anything left over
+    task_summaries = finish_postprocessing( task_summaries , [i[2] for i in target_proteins] , postprocessed )
+
+    return task_summaries
+
 
 ################################################################################
 # SINGLE INPUT METHODS
@@ -0,0 +1,429 @@
+#!/usr/bin/env python
+# :noTabs=true:
+
+"""
+methods for deciding which commands to run next, shared by the local
+parallel and queue run methods
+
+commands are sized by the FEATURE_RESOURCE_PROFILES in vipur_settings.py
+and packed against the cores + memory that are available
+"""
+
+################################################################################
+# IMPORT
+
+# common modules
+import os
+import re
+import math
+import multiprocessing
+import time
+
+# bigger modules
+
+# custom modules
+from vipur_settings import FEATURE_RESOURCE_PROFILES , DEFAULT_RESOURCE_PROFILE , SCHEDULING_POLICY , LOCAL_PARALLEL_WORKERS , LOCAL_PARALLEL_MEMORY , PACKED_JOB_FEATURES , PACKED_JOB_MAX_RUNTIME , PACKED_JOB_WALLTIME , PACKED_JOB_CORES , PACKED_JOB_DRIVER
+from vipur_settings import SPECULATIVE_FEATURES , SPECULATIVE_PERCENTILE , SPECULATIVE_MIN_SIBLINGS
+from helper_methods import isolate_command
+from psiblast_feature_generation import load_fasta
+
+################################################################################
+# RESOURCE METHODS
+
+# length of the protein this task summary is for
+def get_protein_length( task_summary ):
+    if 'sequence_length' in task_summary['other'].keys():
+        return int( task_summary['other']['sequence_length'] )
+
+    # older task summaries, look at the sequence directly
+    sequence_filename = ''
+    if 'sequence_filename' in task_summary['filenames'].keys():
+        sequence_filename = task_summary['filenames']['sequence_filename']
+        if not os.path.isfile( sequence_filename ) and task_summary['out_path']:
+            sequence_filename = task_summary['out_path'] +'/'+ sequence_filename
+    if not sequence_filename or not os.path.isfile( sequence_filename ):
+        return 0
+
+    length = len( load_fasta( sequence_filename )[0][1] )
+    task_summary['other']['sequence_length'] = str( length )
+    return length
+
+# the resource profile value for this command, e.g. "cores"
+def get_resource_profile_value( task_summary , command_dict , key , resource_profiles = FEATURE_RESOURCE_PROFILES ):
+    profile = DEFAULT_RESOURCE_PROFILE
+    if command_dict['feature'] in resource_profiles.keys() and key in resource_profiles[command_dict['feature']].keys():
+        profile = resource_profiles[command_dict['feature']]
+
+    # allow scaling by protein length
+    value = profile[key]
+    if '__call__' in dir( value ):
+        value = value( get_protein_length( task_summary ) )
+    return value
+
+# how many cores and how much memory (GB) a command will occupy
+def determine_command_resources( task_summary , command_dict , resource_profiles = FEATURE_RESOURCE_PROFILES ):
+    cores = get_resource_profile_value( task_summary , command_dict , 'cores' , resource_profiles )
+    memory = get_resource_profile_value( task_summary , command_dict , 'memory' , resource_profiles )
+
+    # the command itself knows best
+    threads = re.findall( '-num_threads (\d+)' , command_dict['command'] ) + re.findall( 'mpiexec -n (\d+)' , command_dict['command'] )
+    if threads:
+        cores = max( [int( i ) for i in threads] )
+
+    return int( cores ) , float( memory )
+
+# total cores + memory (GB) the local commands can use
+def determine_local_capacity( workers = LOCAL_PARALLEL_WORKERS , memory = LOCAL_PARALLEL_MEMORY ):
+    if not workers:
+        workers = multiprocessing.cpu_count()
+    if not memory:
+        try:
+            memory = os.sysconf( 'SC_PAGE_SIZE' )*os.sysconf( 'SC_PHYS_PAGES' )/1024.**3
+        except ( ValueError , OSError , AttributeError ):
+            # cannot tell, do not limit by memory
+            memory = float( 'inf' )
+    return max( int( workers ) , 1 ) , float( memory )
+
+# choose which of the  <job_pairs>  to launch now
+def pack_tasks( task_summaries , job_pairs , available_cores , available_memory , total_cores , total_memory , resource_function = determine_command_resources ):
+    """
+    Returns the (task index , command index) pairs from  <job_pairs>  that
+    fit into  <available_cores>  and  <available_memory>  (GB), considered in
+    order
+
+    A command that needs more than the  <total_cores>  or  <total_memory>
+    is treated as needing all of it (it runs alone), and the first command
+    that does not fit reserves its share so it is not starved by smaller ones
+
+    Optionally size the commands with a different  <resource_function>
+    """
+    selected = []
+    waiting = False
+    for i in job_pairs:
+        cores , memory = resource_function( task_summaries[i[0]] , task_summaries[i[0]]['commands'][i[1]] )
+        cores = min( cores , total_cores )
+        memory = min( memory , total_memory )
+
+        if cores <= available_cores and memory <= available_memory:
+            selected.append( i )
+        elif waiting:
+            # something earlier is already waiting
+            continue
+        else:
+            # first one to wait, hold its place
+            waiting = True
+
+        available_cores -= cores
+        available_memory -= memory
+
+    return selected
+
+# cores + memory currently occupied by these jobs, capped the same as above
+def determine_occupied_resources( task_summaries , job_pairs , total_cores = float( 'inf' ) , total_memory = float( 'inf' ) , resource_function = determine_command_resources ):
+    cores = 0
+    memory = 0
+    for i in job_pairs:
+        resources = resource_function( task_summaries[i[0]] , task_summaries[i[0]]['commands'][i[1]] )
+        cores += min( resources[0] , total_cores )
+        memory += min( resources[1] , total_memory )
+    return cores , memory
+
+# the queue job id for an entry in "running_or_queued"
+# e.g. "123" for array elements "123_5" or "123[5]" and packed commands "123+5"
+def get_queue_job_id( job_id ):
+    return re.split( '[_\[+]' , job_id )[0]
+
+# same as above for the jobs in  <running_or_queued>  (queue job id : job pair)
+# commands that share a queue job (array elements, packed commands) with an
+# "element_limit" only count up to that many at once
+def determine_occupied_job_resources( task_summaries , running_or_queued , total_cores = float( 'inf' ) , total_memory = float( 'inf' ) , resource_function = determine_command_resources ):
+    job_pairs = []
+    elements = {}
+    for job_id in running_or_queued.keys():
+        i = running_or_queued[job_id]
+        command_dict = task_summaries[i[0]]['commands'][i[1]]
+        if get_queue_job_id( job_id ) == job_id or not 'element_limit' in command_dict.keys():
+            job_pairs.append( i )
+            continue
+
+        base_id = get_queue_job_id( job_id )
+        if not base_id in elements.keys():
+            elements[base_id] = []
+        if len( elements[base_id] ) < int( command_dict['element_limit'] ):
+            elements[base_id].append( i )
+            job_pairs.append( i )
+
+    return determine_occupied_resources( task_summaries , job_pairs , total_cores , total_memory , resource_function )
+
+################################################################################
+# RUNTIME METHODS
+
+# how long (s) a command should take, what it took last time if it recorded it
+# optionally scale the profile estimate by the  <history>  of its feature
+# (see collect_runtime_history)
+def estimate_command_runtime( task_summary , command_dict , resource_profiles = FEATURE_RESOURCE_PROFILES , history = {} ):
+    if 'runtime' in command_dict.keys() and command_dict['runtime']:
+        return float( command_dict['runtime'] )
+    return history.get( command_dict['feature'] , 1. )*float( get_resource_profile_value( task_summary , command_dict , 'runtime' , resource_profiles ) )
+
+# how much longer (or shorter) than the profile estimate each feature has
+# actually taken, averaged over the successful commands that recorded a runtime
+def collect_runtime_history( task_summaries , resource_profiles = FEATURE_RESOURCE_PROFILES ):
+    ratios = {}
+    for task_summary in task_summaries:
+        for command_dict in task_summary['commands']:
+            if not command_dict.get( 'runtime' ) or not command_dict.get( 'run' ) == 'success':
+                continue
+            estimate = float( get_resource_profile_value( task_summary , command_dict , 'runtime' , resource_profiles ) )
+            if estimate > 0:
+                ratios.setdefault( command_dict['feature'] , [] ).append( float( command_dict['runtime'] )/estimate )
+
+    return dict( [(i , sum( ratios[i] )/len( ratios[i] )) for i in ratios.keys()] )
+
+################################################################################
+# CRITICAL PATH METHODS
+
+# how long (s) until everything waiting on each of the  <job_pairs>  could be
+# done, its own runtime plus the longest chain of commands that depend on it
+# <dependencies>  maps each job pair to the job pairs it needs
+def determine_critical_path_lengths( task_summaries , job_pairs , dependencies , history = {} ):
+    dependents = {}
+    for i in dependencies.keys():
+        for j in dependencies[i]:
+            dependents.setdefault( j , [] ).append( i )
+
+    lengths = {}
+    def critical_path_length( job_pair ):
+        if not job_pair in lengths.keys():
+            # no cycles, each only waits on commands of its own protein
+            lengths[job_pair] = estimate_command_runtime( task_summaries[job_pair[0]] , task_summaries[job_pair[0]]['commands'][job_pair[1]] , history = history ) + max( [0] + [critical_path_length( i ) for i in dependents.get( job_pair , [] )] )
+        return lengths[job_pair]
+
+    return dict( [(i , critical_path_length( i )) for i in job_pairs] )
+
+# how urgent each of the  <job_pairs>  is according to the  <policy> , higher first
+def determine_task_priorities( task_summaries , job_pairs , dependencies , policy = SCHEDULING_POLICY ):
+    if policy == 'in_order':
+        return dict( [(i , 0.) for i in job_pairs] )
+    elif not policy == 'critical_path':
+        raise NotImplementedError( 'unknown scheduling policy \"' + policy + '\", use critical_path or in_order' )
+
+    return determine_critical_path_lengths( task_summaries , job_pairs , dependencies , collect_runtime_history( task_summaries ) )
+
+# reorder the  <job_pairs>  that are ready to launch according to the  <policy>
+# the longest critical path first, ties (and "in_order") keep the listed order
+def prioritize_tasks( task_summaries , job_pairs , dependencies , policy = SCHEDULING_POLICY ):
+    if len( job_pairs ) < 2:
+        return job_pairs
+    priorities = determine_task_priorities( task_summaries , job_pairs , dependencies , policy )
+    return sorted( job_pairs , key = lambda x : -priorities[x] )
+
+# the runtime (s) written by batch_driver.py, '' if there is none
+def read_sentinel_runtime( sentinel_filename ):
+    if not sentinel_filename or not os.path.isfile( sentinel_filename ):
+        return ''
+    f = open( sentinel_filename , 'r' )
+    sentinel = f.read().strip().split( ' ' )
+    f.close()
+    if len( sentinel ) > 1 and sentinel[1].isdigit():
+        return sentinel[1]
+    return ''
+
+################################################################################
+# SPECULATIVE EXECUTION METHODS
+
+# siblings are interchangeable commands e.g. the relax trajectories of one
+# variant, they share a task, feature and variant
+def determine_sibling_tasks( task_summaries , job_pair ):
+    command_dict = task_summaries[job_pair[0]]['commands'][job_pair[1]]
+    return [(job_pair[0] , i) for i , j in enumerate( task_summaries[job_pair[0]]['commands'] )
+        if not i == job_pair[1] and j['feature'] == command_dict['feature'] and j.get( 'variant' ) == command_dict.get( 'variant' )]
+
+# the  <percentile>  of  <values>  (nearest rank)
+def determine_percentile( values , percentile ):
+    values = sorted( values )
+    return values[max( int( math.ceil( percentile/100.*len( values ) ) ) , 1 ) - 1]
+
+# how long (s) the command  <job_pair>  may run before it is straggling,
+# None until enough of its siblings finished successfully
+def determine_straggler_threshold( task_summaries , job_pair , percentile = SPECULATIVE_PERCENTILE , min_siblings = SPECULATIVE_MIN_SIBLINGS ):
+    runtimes = [float( task_summaries[i[0]]['commands'][i[1]]['runtime'] ) for i in determine_sibling_tasks( task_summaries , job_pair )
+        if task_summaries[i[0]]['commands'][i[1]].get( 'runtime' ) and task_summaries[i[0]]['commands'][i[1]].get( 'run' ) == 'success']
+    if not runtimes or len( runtimes ) < min_siblings:
+        return None
+    return determine_percentile( runtimes , percentile )
+
+# the running commands worth duplicating, <elapsed>  maps each running job
+# pair to how long (s) it has been running, skips the  <speculated>  ones
+def select_straggling_tasks( task_summaries , elapsed , speculated = [] , features = SPECULATIVE_FEATURES ,
+        percentile = SPECULATIVE_PERCENTILE , min_siblings = SPECULATIVE_MIN_SIBLINGS ):
+    stragglers = []
+    for i in elapsed.keys():
+        if i in speculated or not task_summaries[i[0]]['commands'][i[1]]['feature'] in features:
+            continue
+        threshold = determine_straggler_threshold( task_summaries , i , percentile , min_siblings )
+        if not threshold is None and elapsed[i] > threshold:
+            stragglers.append( i )
+    return stragglers
+
+# queue jobs do not report how long they ran, note when each of our
+# <job_ids>  is first seen running in the  <queue_status>
+def track_job_start_times( start_times , queue_status , job_ids , running_states = ['R'] ):
+    now = time.time()
+    for i in job_ids:
+        if not i in start_times.keys() and queue_status.get( i ) in running_states:
+            start_times[i] = now
+
+# how long (s) each job pair in  <running_or_queued>  has been running
+def determine_job_elapsed_times( start_times , running_or_queued ):
+    now = time.time()
+    return dict( [(running_or_queued[i] , now - start_times[i]) for i in running_or_queued.keys() if i in start_times.keys()] )
+
+# record how long the queue job  <job_id>  ran, as seen from its start time
+def record_job_runtime( command_dict , start_times , job_id ):
+    if job_id in start_times.keys():
+        command_dict['runtime'] = str( int( round( time.time() - start_times.pop( job_id ) ) ) )
+
+################################################################################
+# JOB ARRAY METHODS
+
+# write a script that runs one of the  <commands>  chosen by the array index
+# in the environment variable  <index_variable>
+def write_array_script( script_filename , commands , index_variable , sentinel_filename = '' , header = '#!/bin/bash\n\n' ):
+    script_text = header + 'case $' + index_variable + ' in\n'
+    for i in xrange( len( commands ) ):
+        script_text += '    ' + str( i ) +') '+ commands[i] +' ;;\n'
+    script_text += 'esac\n\n'
+    # record the exit status
+    if sentinel_filename:
+        script_text += 'echo $? > '+ sentinel_filename +'\n\n'
+
+    f = open( script_filename , 'w' )
+    f.write( script_text )
+    f.close()
+
+# script filenames of these jobs, in order e.g. one per job array
+def unique_script_filenames( task_summaries , job_pairs ):
+    script_filenames = []
+    for i in job_pairs:
+        script_filename = task_summaries[i[0]]['commands'][i[1]]['script_filename']
+        if not script_filename in script_filenames:
+            script_filenames.append( script_filename )
+    return script_filenames
+
+# 0,1,2,5,7,8 into [(0 , 2) , (5 , 5) , (7 , 8)]
+def group_array_indices( array_indices ):
+    ranges = []
+    for i in sorted( set( array_indices ) ):
+        if ranges and ranges[-1][1] == i - 1:
+            ranges[-1][1] = i
+        else:
+            ranges.append( [i , i] )
+    return [tuple( i ) for i in ranges]
+
+# 0,1,2,5,7,8 into "0-2,5,7-8"
+def compress_array_indices( array_indices ):
+    return ','.join( [str( i[0] ) + ('-' + str( i[1] ))*( i[1] > i[0] ) for i in group_array_indices( array_indices )] )
+
+################################################################################
+# JOB PACKING METHODS
+
+# short commands that should share a queue job
+def select_packable_tasks( task_summaries , job_pairs , features = PACKED_JOB_FEATURES , max_runtime = PACKED_JOB_MAX_RUNTIME ):
+    return [i for i in job_pairs if
+        task_summaries[i[0]]['commands'][i[1]]['feature'] in features and
+        not 'array_index' in task_summaries[i[0]]['commands'][i[1]].keys() and
+        estimate_command_runtime( task_summaries[i[0]] , task_summaries[i[0]]['commands'][i[1]] ) <= max_runtime]
+
+# group short commands into packed jobs
+def pack_short_tasks( task_summaries , job_pairs , cores = PACKED_JOB_CORES , walltime = PACKED_JOB_WALLTIME , resource_function = determine_command_resources ):
+    """
+    Returns lists of (task index , command index) pairs from  <job_pairs> ,
+    each list should finish in about  <walltime>  seconds using  <cores>
+
+    The longest commands are placed first, each into the least loaded pack
+    with room for it
+    """
+    work = {}
+    for i in job_pairs:
+        work[i] = estimate_command_runtime( task_summaries[i[0]] , task_summaries[i[0]]['commands'][i[1]] )*min( resource_function( task_summaries[i[0]] , task_summaries[i[0]]['commands'][i[1]] )[0] , cores )
+
+    packs = []
+    loads = []
+    for i in sorted( job_pairs , key = lambda x : -work[x] ):
+        fits = [j for j in xrange( len( packs ) ) if loads[j] + work[i] <= walltime*cores]
+        if fits:
+            j = min( fits , key = lambda x : loads[x] )
+            packs[j].append( i )
+            loads[j] += work[i]
+        else:
+            packs.append( [i] )
+            loads.append( work[i] )
+
+    # keep the original order within each pack
+    return [sorted( i , key = lambda x : job_pairs.index( x ) ) for i in packs]
+
+# how many of these commands to run at once, and the cores + memory (GB)
+# the packed job needs to do so
+def determine_packed_job_resources( task_summaries , job_pairs , cores = PACKED_JOB_CORES , total_cores = float( 'inf' ) , total_memory = float( 'inf' ) , resource_function = determine_command_resources ):
+    resources = [resource_function( task_summaries[i[0]] , task_summaries[i[0]]['commands'][i[1]] ) for i in job_pairs]
+    command_cores = max( [i[0] for i in resources] )
+    command_memory = max( [i[1] for i in resources] )
+
+    workers = max( min( len( job_pairs ) , cores/max( command_cores , 1 ) ) , 1 )
+    return workers , min( workers*command_cores , total_cores ) , min( workers*command_memory , total_memory )
+
+# where each packed command writes its exit status and runtime
+def get_packed_sentinel_filename( command_dict ):
+    return command_dict['packed_script_filename'].replace( '.sh' , '_'+ command_dict['pack_index'] +'.done' )
+
+# a new, unique script filename for a packed job
+PACKED_JOB_COUNT = [0]
+def get_packed_script_filename( task_summaries , job_pairs ):
+    PACKED_JOB_COUNT[0] += 1
+    command_dict = task_summaries[job_pairs[0][0]]['commands'][job_pairs[0][1]]
+    script_path = task_summaries[job_pairs[0][0]]['out_path']
+    if 'script_filename' in command_dict.keys():
+        script_path = os.path.dirname( command_dict['script_filename'] )
+    return script_path + '/'*bool( script_path ) + task_summaries[job_pairs[0][0]]['root_filename'].split( '/' )[-1] +'.packed_job_'+ str( os.getpid() ) +'_'+ str( PACKED_JOB_COUNT[0] ) +'.sh'
+
+# write the manifest and the script for a packed job, the commands are run
+# <workers>  at a time by batch_driver.py
+def write_packed_job( task_summaries , job_pairs , script_filename , workers , header = '#!/bin/bash\n\n' , driver = PACKED_JOB_DRIVER ):
+    manifest_filename = script_filename.replace( '.sh' , '.manifest' )
+    manifest = []
+    for k in xrange( len( job_pairs ) ):
+        command_dict = task_summaries[job_pairs[k][0]]['commands'][job_pairs[k][1]]
+        command_dict['pack_index'] = str( k )
+        command_dict['packed_script_filename'] = script_filename
+
+        # clear any evidence of an earlier attempt
+        sentinel_filename = get_packed_sentinel_filename( command_dict )
+        if os.path.isfile( sentinel_filename ):
+            os.remove( sentinel_filename )
+        manifest.append( sentinel_filename +'\t'+ isolate_command( command_dict ) )
+
+    f = open( manifest_filename , 'w' )
+    f.write( '\n'.join( manifest ) +'\n' )
+    f.close()
+
+    f = open( script_filename , 'w' )
+    f.write( header + driver +' '+ manifest_filename +' '+ str( workers ) +'\n\n' )
+    f.close()
+
+# once a packed command is done, keep its runtime for next time and forget the pack
+def finish_packed_command( command_dict ):
+    if not 'pack_index' in command_dict.keys():
+        return
+    runtime = read_sentinel_runtime( get_packed_sentinel_filename( command_dict ) )
+    if runtime:
+        command_dict['runtime'] = runtime
+    del command_dict['pack_index']
+    del command_dict['packed_script_filename']
+
+# report the queue status of a packed job for each of its commands "<job id>+<index>"
+def expand_packed_job_status( queue_status , job_ids ):
+    for i in job_ids:
+        if '+' in i and get_queue_job_id( i ) in queue_status.keys():
+            queue_status[i] = queue_status[get_queue_job_id( i )]
+    return queue_status
@@ -20,11 +20,16 @@ import time
 # bigger modules
 
 # custom modules
-from vipur_settings import SLURM_USER , SLURM_QUEUE_QUOTA , SLURM_QUEUE_MONITOR_DELAY , SLURM_BASH_SCRIPT , SLURM_JOB_OPTIONS
-from helper_methods import run_local_commandline , create_executable_str
+from vipur_settings import SLURM_USER , SLURM_ALLOCATION_CORES , SLURM_ALLOCATION_MEMORY , SLURM_QUEUE_MONITOR_DELAY , SLURM_QUEUE_MONITOR_MIN_DELAY , SLURM_SENTINEL_CHECK_INTERVAL , SLURM_BASH_SCRIPT , SLURM_JOB_OPTIONS , SLURM_USE_JOB_ARRAYS , SLURM_ARRAY_FEATURES , SLURM_ARRAY_MAX_SIMULTANEOUS , SPECULATIVE_EXECUTION
+from helper_methods import run_local_commandline , create_executable_str , isolate_command
 
 from pre_processing import *
-from run_methods import determine_check_successful_function
+from scheduling_methods import determine_command_resources , pack_tasks , determine_occupied_job_resources , compress_array_indices , write_array_script , unique_script_filenames , get_queue_job_id , prioritize_tasks
+from scheduling_methods import select_packable_tasks , pack_short_tasks , determine_packed_job_resources , get_packed_script_filename , write_packed_job , get_packed_sentinel_filename , finish_packed_command , expand_packed_job_status
+from scheduling_methods import select_straggling_tasks , track_job_start_times , determine_job_elapsed_times , record_job_runtime
+from run_methods import determine_check_successful_function , interpret_check_successful , merge_relax_output_for_rescore , determine_task_dependencies , check_command_finished , select_ready_tasks , start_preprocessing , stream_postprocessing , finish_postprocessing
+from run_methods import record_submitted_jobs , forget_submitted_job , reattach_submitted_jobs
+from run_methods import get_speculative_command_dict , resolve_speculative_commands , stop_speculative_commands , list_speculative_jobs , list_retrying_speculative_commands , count_speculative_retry
 from rosetta_feature_generation import remove_intermediate_ddg_monomer_files
 from post_processing import *
 
@@ -34,7 +39,7 @@ from post_processing import *
 def run_VIPUR_SLURM( pdb_filename = '' , variants_filename = '' ,
         out_path = '' , write_numbering_map = True ,
         single_relax = False , delete_intermediate_relax_files = True ,
-        demo = False , rerun_preprocessing = False ):
+        demo = False , rerun_preprocessing = False , use_job_arrays = SLURM_USE_JOB_ARRAYS ):
     # the following should probably be a separate method...
 
     # for the example input
@@ -111,21 +116,13 @@ def run_VIPUR_SLURM( pdb_filename = '' , variants_filename = '' ,
     # not needed with current SLURM setup...
 
     # pre processing
+    # in parallel, but the batch needs every command, so wait for all of them
+    preprocessed = dict( start_preprocessing( target_proteins , write_numbering_map = write_numbering_map ,
+        single_relax = single_relax , rerun_preprocessing = rerun_preprocessing ) )
     task_summaries = []
-    for i in target_proteins:
-        # guess what the task summary filename 'would' be, if it exists, keep going...
-        task_summary_filename = i[3]*bool( i[3] ) +'/'+ get_root_filename( i[0] ).split( '/' )[-1] + '.task_summary'
-        if os.path.isfile( task_summary_filename ) and not rerun_preprocessing:
-            print 'hmmm, ' + i[0] + ' seems to have run preprocessing already, skipping now'
-            #continue    # skip this one, do not add to list of tasks...?
-            # actually, skip running pre-processing BUT DO add it to the list of tasks
-            
-            # is this actually working?
-        else:
-            task_summary_filename = run_preprocessing( i[0] , i[1] ,
-                sequence_only = i[2] , out_path = i[3] ,
-                task_summary_filename = task_summary_filename ,
-                write_numbering_map = write_numbering_map , single_relax = single_relax )
+    for t in xrange( len( target_proteins ) ):
+        i = target_proteins[t]
+        task_summary_filename = preprocessed[t]
 
 
         # modify for SLURM script
@@ -143,10 +140,11 @@ def run_VIPUR_SLURM( pdb_filename = '' , variants_filename = '' ,
             command = task_summary['commands'][j]['command']
 
             # add for relax
-            if task_summary['commands'][j]['feature'].replace( '_native' , '' ) == 'relax' and not 'rescore' in task_summary['commands'][j]['feature']:
+            # not for separate trajectories in job arrays, each is a single process
+            if task_summary['commands'][j]['feature'].replace( '_native' , '' ) == 'relax' and not 'rescore' in task_summary['commands'][j]['feature'] and (single_relax or not use_job_arrays):
                 command = command.replace( '.linuxgccrelease' , '.mpi.linuxgccrelease' )
 #                command = 'module load mvapich2/gnu/1.8.1;/share/apps/mvapich2/1.8.1/gnu/bin/mpiexec -n 36 ' + command
-                command = 'mpiexec -n 40 ' + command
+                command = 'mpiexec -n ' + str( SLURM_ALLOCATION_CORES ) +' '+ command
                 command += ' -jd2:mpi_file_buf_job_distributor false'
                 command += ' -run:multiple_processes_writing_to_one_directory'
                 
@@ -162,7 +160,7 @@ def run_VIPUR_SLURM( pdb_filename = '' , variants_filename = '' ,
 
             # special...
             if task_summary['commands'][j]['feature'] == 'psiblast' and not 'num_threads' in task_summary['commands'][j]['command']:
-                task_summary['commands'][j]['command'] += ' -num_threads 40'
+                task_summary['commands'][j]['command'] += ' -num_threads ' + str( SLURM_ALLOCATION_CORES )
             
             # modify the task summary
             task_summary['commands'][j]['command'] = command
@@ -182,8 +180,9 @@ def run_VIPUR_SLURM( pdb_filename = '' , variants_filename = '' ,
                 task_summary['commands'][j]['script_filename'] = script_filename
 
                 # only write ONE submission script per batch = run of VIPUR           
+                # the job writes a file when it is done, no need to wait for squeue
                 f = open( script_filename , 'w' )
-                f.write( SLURM_BASH_SCRIPT( command ) )
+                f.write( SLURM_BASH_SCRIPT( add_sentinel_to_command( isolate_command( task_summary['commands'][j] ) , get_sentinel_filename( script_filename ) ) ) )
                 f.close()
             
                 # use the script filename as the source for any log files
@@ -194,6 +193,10 @@ def run_VIPUR_SLURM( pdb_filename = '' , variants_filename = '' ,
 
                 slurm_options['N'] = '1'
                 slurm_options['n'] = '1'
+                # request what it needs
+                cores , memory = determine_command_resources( task_summary , task_summary['commands'][j] )
+                slurm_options['c'] = str( min( cores , SLURM_ALLOCATION_CORES ) )
+                slurm_options['-mem'] = str( int( 1024*memory ) )    # MB
 
                 # also generate the pbs call? might as well, keep it simple...
                 # srun or sbatch?
@@ -220,6 +223,10 @@ def run_VIPUR_SLURM( pdb_filename = '' , variants_filename = '' ,
             # srun or sbatch?
 #            task_summary['commands'][j]['srun_command'] = create_executable_str( 'srun' , [script_filename] , slurm_options )
 
+        # one job array per protein + feature for the relax trajectories
+        if use_job_arrays and not single_relax:
+            write_slurm_array_scripts( task_summary , i[3] + '/'*bool( i[3] ) + get_root_filename( i[0] ).split( '/' )[-1] )
+
         # rewrite the task summary
         write_task_summary( task_summary , task_summary_filename )
 
@@ -228,15 +235,16 @@ def run_VIPUR_SLURM( pdb_filename = '' , variants_filename = '' ,
 
     # run them all
 #    run_VIPUR_task_summaries_serially( task_summaries , single_relax = single_relax , delete_intermediate_relax_files = delete_intermediate_relax_files )
-    run_VIPUR_task_summaries_SLURM( task_summaries , single_relax = single_relax , delete_intermediate_relax_files = delete_intermediate_relax_files )
+    # each is post processed as soon as its jobs finish
+    postprocessed = {}
+    run_VIPUR_task_summaries_SLURM( task_summaries , single_relax = single_relax , delete_intermediate_relax_files = delete_intermediate_relax_files ,
+        use_job_arrays = use_job_arrays , postprocessed = postprocessed )
 
 
     # post processing
     # this look identical!!! :)
-    for i in xrange( len( task_summaries ) ):
-        # always okay to rerun post processing...should not make any difference
-        sequence_only = target_proteins[i][2]
-        task_summaries[i] = run_postprocessing( task_summaries[i] , sequence_only = sequence_only )
+    # anything left over
+    task_summaries = finish_postprocessing( task_summaries , [j[2] for j in target_proteins] , postprocessed )
 
     return task_summaries
 
@@ -244,7 +252,8 @@ def run_VIPUR_SLURM( pdb_filename = '' , variants_filename = '' ,
 # collect up all jobs at once, fire off serially (lol) to queue
 # NOPE collect up all jobs at once - WRITE ONE SUBMISSION SCRIPT, and fire off this single job...I guess give progressive updates on status...?
 # need to be cognizant of queue status, rescore must occur later
-def run_VIPUR_task_summaries_SLURM( task_summaries , single_relax = False , delete_intermediate_relax_files = True , unsupported_many_jobs_version = False ):
+def run_VIPUR_task_summaries_SLURM( task_summaries , single_relax = False , delete_intermediate_relax_files = True , unsupported_many_jobs_version = False ,
+        use_job_arrays = SLURM_USE_JOB_ARRAYS , postprocessed = None ):
     # queue command can be derived from task itself
     # this method will run...until all jobs are complete
     
@@ -264,12 +273,8 @@ def run_VIPUR_task_summaries_SLURM( task_summaries , single_relax = False , dele
     # actually...just give a whole different setup here
     
     if unsupported_many_jobs_version:
-        run_VIPUR_tasks_SLURM( task_summaries , non_rescore_tasks )
-    
-        # should just be give dependency on the matching relax jobs
-        # --dependency=afterok:<relax_script_filename.sh>
-        # run the rescore tasks
-        run_VIPUR_tasks_SLURM( task_summaries , rescore_tasks )
+        # rescore waits on its own relax jobs, no need to wait for ALL relax jobs
+        run_VIPUR_tasks_SLURM( task_summaries , non_rescore_tasks + rescore_tasks , single_relax = single_relax , delete_intermediate_relax_files = delete_intermediate_relax_files )
     else:
         # the only supported usage
         # gather up all the jobs, create a single batch script
@@ -292,14 +297,29 @@ def run_VIPUR_task_summaries_SLURM( task_summaries , single_relax = False , dele
         # as the many-job batch variant
 #        raw_input( 'do just ddg_monomer?' )
         run_VIPUR_tasks_SLURM( task_summaries , ddg_monomer_tasks )
+
+        # separate relax trajectories are submitted as job arrays instead
+        # alongside the batch, just like the rescore jobs
+        array_tasks = [i for i in non_rescore_tasks if 'array_index' in task_summaries[i[0]]['commands'][i[1]].keys()]
+        non_rescore_tasks = [i for i in non_rescore_tasks if not i in array_tasks]
+        # batched PSIBLAST commands only wait on their search, alongside the batch too
+        # as do the rounds of sharded searches
+        batched_tasks = [i for i in non_rescore_tasks if 'psiblast_batch' in task_summaries[i[0]]['commands'][i[1]].keys() or
+            'psiblast_round' in task_summaries[i[0]]['commands'][i[1]].keys()]
+        non_rescore_tasks = [i for i in non_rescore_tasks if not i in batched_tasks]
         
 #        raw_input( 'the main runs?' )
-        run_VIPUR_tasks_in_batch_SLURM( task_summaries , non_rescore_tasks )       
+        # each rescore is submitted as soon as its own relax is done, even while the batch is running
+        rescore_jobs = run_VIPUR_tasks_in_batch_SLURM( task_summaries , non_rescore_tasks ,
+            dependent_task_list = array_tasks + batched_tasks + rescore_tasks , single_relax = single_relax , delete_intermediate_relax_files = delete_intermediate_relax_files ,
+            postprocessed = postprocessed )
 
         # actually, do this with the ddg_monomer stuff
 #        raw_input( 'rescore now?' )
 #        run_VIPUR_tasks_in_batch_SLURM( task_summaries , rescore_tasks )
-        run_VIPUR_tasks_SLURM( task_summaries , rescore_tasks )
+        # finish any remaining rescore (and job array) jobs
+        run_VIPUR_tasks_SLURM( task_summaries , array_tasks + batched_tasks + rescore_tasks , running_or_queued = rescore_jobs ,
+            single_relax = single_relax , delete_intermediate_relax_files = delete_intermediate_relax_files , postprocessed = postprocessed )
     
     # return anything?
     # task summaries should be updated with all the necessary files...
@@ -322,10 +342,19 @@ def run_VIPUR_task_summaries_SLURM( task_summaries , single_relax = False , dele
 ################################################################################
 # ONE BIG SBATCH SCRIPT
 
-def run_VIPUR_tasks_in_batch_SLURM( task_summaries , task_list , max_slurm_tries = 2 , ddg_monomer_cleanup = True , single_relax = True ):
+def run_VIPUR_tasks_in_batch_SLURM( task_summaries , task_list , max_slurm_tries = 2 , ddg_monomer_cleanup = True , single_relax = True ,
+        dependent_task_list = [] , delete_intermediate_relax_files = False , postprocessed = None ):
     # also setup to do start-stop
     completed = [i for i in task_list if 'run' in task_summaries[i[0]]['commands'][i[1]] and 'success' in task_summaries[i[0]]['commands'][i[1]]['run']]
 
+    # tasks (rescore) that depend on the batch, submit them as separate jobs
+    # as soon as they are ready, return their job ids
+    dependencies = determine_task_dependencies( task_summaries , dependent_task_list )
+    # including any an earlier, interrupted run submitted
+    dependent_jobs = reattach_submitted_jobs( task_summaries , dependent_task_list )
+    # when each of them started running
+    start_times = {}
+
     attempt = 1
     while not len( completed ) == len( task_list ):
         # do not worry about the queue in this mode
@@ -341,57 +370,42 @@ def run_VIPUR_tasks_in_batch_SLURM( task_summaries , task_list , max_slurm_tries
                 'failure' in task_summaries[i[0]]['commands'][i[1]]['run']) )
             ]
         print str( len( jobs_to_run ) ) + ' processes still need to finish'
-    
-        # write the script
-        master_script_text = '\n\n'.join( [task_summaries[i[0]]['commands'][i[1]]['command'] for i in jobs_to_run] )
-        # test without relax processes
-#        master_script_text = '\n\n'.join( [task_summaries[i[0]]['commands'][i[1]]['command'] for i in jobs_to_run if not 'relax' in task_summaries[i[0]]['commands'][i[1]]['command']] )
-        master_script_text = SLURM_BASH_SCRIPT( master_script_text )
-        
-        # check if they have different names!?...wait...they will...
-        slurm_script_filename = task_summaries[0]['filenames']['slurm_script_filename']
-        slurm_output_filename = task_summaries[0]['filenames']['slurm_output_filename']
-        slurm_error_filename = task_summaries[0]['filenames']['slurm_error_filename']
-        
-        slurm_script_filename = slurm_script_filename.replace( '.sh' , '_'+ str( attempt ) + '.sh' )
-        slurm_output_filename = slurm_output_filename.replace( '.out' , '_'+ str( attempt ) + '.out' )
-        slurm_error_filename = slurm_error_filename.replace( '.err' , '_'+ str( attempt ) + '.err' )
-        # can just use the first one now...
-
-        f = open( slurm_script_filename , 'w' )
-        f.write( master_script_text )
-        f.close()
-        
-        # save a copy of this script for reference?
-        # successive runs with overwrite the file...
-        
-        # debug
-#        raw_input( 'everything okay?' )
-    
-        # submit sbatch
-        # simple for now...
-        command = 'sbatch -n 40'
-        if slurm_output_filename:
-            command += ' -o ' + slurm_output_filename
-        if slurm_error_filename:
-            command += ' -e ' + slurm_error_filename
-        command += ' ' + slurm_script_filename
-        batch_job_id = run_local_commandline( command , collect_stdout = True )
-#        batch_job_id = run_local_commandline( 'sbatch -n 40 ' + slurm_script_filename , collect_stdout = True )
-        # srun or sbatch?
-        batch_job_id = batch_job_id.strip().split( ' ' )[-1]
-        print 'submitted ' + batch_job_id
+        # start the commands others wait on (relax before its rescore) first
+        jobs_to_run = prioritize_tasks( task_summaries , jobs_to_run , dependencies )
+
+        # a batch an earlier, interrupted run submitted may still be running
+        # its commands, wait for it instead of running them again
+        batch_jobs = reattach_submitted_jobs( task_summaries , jobs_to_run )
+        if batch_jobs:
+            batch_job_id = batch_jobs.keys()[0]
+            jobs_to_run = [i for i in jobs_to_run if task_summaries[i[0]]['commands'][i[1]]['job_id'] == batch_job_id]
+            print 're-attaching to the batch ' + batch_job_id
+            # only the queue can say when it is done
+            sentinel_filename = ''
+        else:
+            batch_job_id , sentinel_filename = submit_batch_SLURM( task_summaries , jobs_to_run , attempt )
+            # so a restart waits for this batch instead of submitting it again
+            for i in jobs_to_run:
+                record_submitted_jobs( task_summaries , {batch_job_id : i} )
 
-        
         # monitor the job until it is complete
 
         # pause...
         batch_complete = False
+        delay = SLURM_QUEUE_MONITOR_MIN_DELAY
         while not batch_complete:
-            queue_status = get_slurm_queue_status( only_job_status = True )
+            queue_status = get_slurm_queue_status( only_job_status = True , job_ids = [batch_job_id] + dependent_jobs.keys() )
+            if queue_status is None:
+                # try again next round
+                print 'waiting ' + str( delay ) +'s...'
+                time.sleep( delay )
+                continue
+            queue_status = expand_packed_job_status( queue_status , dependent_jobs.keys() )
+            track_job_start_times( start_times , queue_status , dependent_jobs.keys() )
 #            batch_complete = bool( [i for i in queue_status if i[0] == batch_job_id] )
-            batch_complete = not batch_job_id in queue_status.keys()
+            batch_complete = check_slurm_job_finished( batch_job_id , queue_status , sentinel_filename )
             # could be an immediate failure...but don't want to linger here anyway in that case
+            changed = False
 
             # debug
 #            print queue_status
@@ -400,10 +414,33 @@ def run_VIPUR_tasks_in_batch_SLURM( task_summaries , task_list , max_slurm_tries
             for i in queue_status.keys():
                 print i + '\t' + queue_status[i]
 
-            # can be sure it doesn't need to wait if empty
-            if queue_status:
-                print 'waiting ' + str( SLURM_QUEUE_MONITOR_DELAY ) +'s...'
-                time.sleep( SLURM_QUEUE_MONITOR_DELAY )
+            # relax output that is already complete? their dependents can start
+            if dependent_task_list:
+                # and the dependents that finished, their own dependents too
+                if reap_finished_jobs_SLURM( task_summaries , dependent_jobs , queue_status , start_times ,
+                        max_tries = max_slurm_tries , ddg_monomer_cleanup = ddg_monomer_cleanup , single_relax = single_relax ):
+                    changed = True
+
+                for job_pair in jobs_to_run:
+                    command_dict = task_summaries[job_pair[0]]['commands'][job_pair[1]]
+                    if command_dict['feature'].replace( '_native' , '' ) == 'relax' and not check_command_finished( command_dict ) and check_slurm_output_complete( command_dict , single_relax = single_relax ):
+                        command_dict['run'] = 'success'
+                        changed = True
+
+                submit_ready_tasks_SLURM( task_summaries , dependent_task_list , dependencies , dependent_jobs ,
+                    single_relax = single_relax , delete_intermediate_relax_files = delete_intermediate_relax_files )
+                record_submitted_jobs( task_summaries , dependent_jobs )
+                if changed:
+                    for i in task_summaries:
+                        journal_task_summary( i , i['filenames']['task_summary_filename'] )
+                    if not postprocessed is None:
+                        stream_postprocessing( task_summaries , postprocessed )
+
+            # can be sure it doesn't need to wait if done
+            if not batch_complete:
+                delay = determine_monitor_delay( delay , changed )
+                print 'waiting up to ' + str( delay ) +'s...'
+                wait_for_sentinel_files( [sentinel_filename] + [get_command_sentinel_filename( task_summaries[i[0]]['commands'][i[1]] ) for i in dependent_jobs.values()] , delay )
 
 
         # evaluate if it ran successfully
@@ -445,13 +482,13 @@ def run_VIPUR_tasks_in_batch_SLURM( task_summaries , task_list , max_slurm_tries
                 failure_summary = 'success' #+ str( tries ) + ' tries'
                 completed.append( job_pair )
             else:
-                # record the number of tries
-                print this_job_description + ' completed' + ' successfully'*complete
+                # record the number of tries, run it again in the next batch
+                print this_job_description + ' failed, will try again'
                 failure_summary = str( tries )
-                completed.append( job_pair )
                 
             # update the record
             task_summaries[job_pair[0]]['commands'][job_pair[1]]['run'] = failure_summary
+            forget_submitted_job( command_dict )
             
             # no need to be here anymore
             # optionally cleanup
@@ -461,13 +498,16 @@ def run_VIPUR_tasks_in_batch_SLURM( task_summaries , task_list , max_slurm_tries
 
         # update task_summaries e.g. write them!
         # modified: so the task summary records its own name...bah!
+        # only what changed, appended to their journals
         for i in task_summaries:
             if not 'task_summary_filename' in i['filenames'].keys():
                 raise NotImplementedError( 'should input the task summary filename (not the summary itself)...' )
             else:
                 # write it out
-                print 'updating: ' + i['filenames']['task_summary_filename']
-                write_task_summary( i , i['filenames']['task_summary_filename'] )
+                journal_task_summary( i , i['filenames']['task_summary_filename'] )
+        # proteins without separate rescore jobs can be done already
+        if not postprocessed is None:
+            stream_postprocessing( task_summaries , postprocessed )
 
         # debug
 #        print attempt
@@ -482,6 +522,8 @@ def run_VIPUR_tasks_in_batch_SLURM( task_summaries , task_list , max_slurm_tries
     
     # cleanup at the end
     # need to merge relax output...?
+    # no, done right before each rescore is submitted
+    return dependent_jobs
 
 
     # should be outside the outermost loop...which is unclear right now...        
@@ -494,18 +536,81 @@ def run_VIPUR_tasks_in_batch_SLURM( task_summaries , task_list , max_slurm_tries
 #            write_task_summary( i , i['filenames']['task_summary_filename'] )
 
 
+# write all the commands in  <job_pairs>  into a single script and submit it,
+# returns the job id and the sentinel file it writes when done
+def submit_batch_SLURM( task_summaries , job_pairs , attempt ):
+    # check if they have different names!?...wait...they will...
+    slurm_script_filename = task_summaries[0]['filenames']['slurm_script_filename']
+    slurm_output_filename = task_summaries[0]['filenames']['slurm_output_filename']
+    slurm_error_filename = task_summaries[0]['filenames']['slurm_error_filename']
+    
+    slurm_script_filename = slurm_script_filename.replace( '.sh' , '_'+ str( attempt ) + '.sh' )
+    slurm_output_filename = slurm_output_filename.replace( '.out' , '_'+ str( attempt ) + '.out' )
+    slurm_error_filename = slurm_error_filename.replace( '.err' , '_'+ str( attempt ) + '.err' )
+    # can just use the first one now...
+    sentinel_filename = get_sentinel_filename( slurm_script_filename )
+    if os.path.isfile( sentinel_filename ):
+        os.remove( sentinel_filename )
+
+    # write the script
+    master_script_text = '\n\n'.join( [isolate_command( task_summaries[i[0]]['commands'][i[1]] ) for i in job_pairs] )
+    # test without relax processes
+#        master_script_text = '\n\n'.join( [task_summaries[i[0]]['commands'][i[1]]['command'] for i in job_pairs if not 'relax' in task_summaries[i[0]]['commands'][i[1]]['command']] )
+    master_script_text = SLURM_BASH_SCRIPT( add_sentinel_to_command( master_script_text , sentinel_filename ) )
+
+    f = open( slurm_script_filename , 'w' )
+    f.write( master_script_text )
+    f.close()
+    
+    # save a copy of this script for reference?
+    # successive runs with overwrite the file...
+    
+    # debug
+#        raw_input( 'everything okay?' )
+
+    # submit sbatch
+    # simple for now...
+    command = 'sbatch -n ' + str( SLURM_ALLOCATION_CORES )
+    if slurm_output_filename:
+        command += ' -o ' + slurm_output_filename
+    if slurm_error_filename:
+        command += ' -e ' + slurm_error_filename
+    command += ' ' + slurm_script_filename
+    batch_job_id = run_local_commandline( command , collect_stdout = True )
+#        batch_job_id = run_local_commandline( 'sbatch -n 40 ' + slurm_script_filename , collect_stdout = True )
+    # srun or sbatch?
+    batch_job_id = batch_job_id.strip().split( ' ' )[-1]
+    print 'submitted ' + batch_job_id
+
+    return batch_job_id , sentinel_filename
+
+
 ################################################################################
 # SUBMIT MANY INDIVIDUAL JOBS
 
 # ex. need to distinguish serial vs parallel queues etc.
 
 # submit jobs until complete or too many attempts
-def run_VIPUR_tasks_SLURM( task_summaries , task_list , max_pbs_tries = 2 , ddg_monomer_cleanup = True , single_relax = False , delete_intermediate_relax_files = False ):
-    # run the non_rescore tasks
+def run_VIPUR_tasks_SLURM( task_summaries , task_list , max_pbs_tries = 2 , ddg_monomer_cleanup = True , single_relax = False , delete_intermediate_relax_files = False ,
+        running_or_queued = None , postprocessed = None , speculate = SPECULATIVE_EXECUTION ):
+    # run the tasks, each only once the tasks it depends on are done
     completed = [i for i in task_list if 'run' in task_summaries[i[0]]['commands'][i[1]] and 'success' in task_summaries[i[0]]['commands'][i[1]]['run']]
+    dependencies = determine_task_dependencies( task_summaries , task_list )
     # should running_or_queued be saved? written to file?
-    running_or_queued = {}
+    # can also pick up jobs that were already submitted
+    if running_or_queued is None:
+        running_or_queued = {}
+    # and any an earlier, interrupted run submitted (gone from the queue means done)
+    for job_id , job_pair in reattach_submitted_jobs( task_summaries , task_list ).items():
+        if not job_pair in running_or_queued.values():
+            running_or_queued[job_id] = job_pair
+    # when each job started running, and duplicates of any stragglers
+    start_times = {}
+    speculative = {}
+    speculated = []
+    jobs_to_run = []
     rounds = 0
+    delay = SLURM_QUEUE_MONITOR_MIN_DELAY
     while not len( completed ) == len( task_list ):
         rounds += 1
         print '\n\nQUEUE MONITOR ROUND ' + str( rounds )
@@ -513,8 +618,26 @@ def run_VIPUR_tasks_SLURM( task_summaries , task_list , max_pbs_tries = 2 , ddg_
         # debug
 #        print running_or_queued
     
-        # check queue status
-        queue_status = get_slurm_queue_status( only_job_status = True )
+        # check queue status, only for our jobs
+        queue_status = {}
+        if running_or_queued:
+            queue_status = get_slurm_queue_status( only_job_status = True , job_ids = running_or_queued.keys() + [i[2] for i in speculative.values()] )
+            if queue_status is None:
+                # try again next round
+                print 'waiting ' + str( delay ) +'s...'
+                time.sleep( delay )
+                continue
+            queue_status = expand_packed_job_status( queue_status , running_or_queued.keys() )
+        track_job_start_times( start_times , queue_status , running_or_queued.keys() )
+
+        # whichever copy of a duplicated job finishes first counts, cancel the other
+        if speculative:
+            retried = []
+            for job_id in resolve_speculative_commands( speculative , lambda x : check_slurm_job_finished( x , queue_status ) ,
+                    lambda x : run_local_commandline( 'scancel ' + x ) , single_relax = single_relax , retried = retried ):
+                queue_status[job_id] = 'CA'
+            for job_id in retried:
+                count_speculative_retry( task_summaries[running_or_queued[job_id][0]]['commands'][running_or_queued[job_id][1]] )
 
         # update "running_or_queued" list (?)
         # err, no, does not have information on which job it is...:(
@@ -533,62 +656,12 @@ def run_VIPUR_tasks_SLURM( task_summaries , task_list , max_pbs_tries = 2 , ddg_
 #        still_running = 0
         # need to add the jobs that completed, removed themselves from the queue in SLURM
 #        print queue_status.keys() + [j for j in running_or_queued.keys() if not j in queue_status.keys()]
-        for job_id in queue_status.keys() + [j for j in running_or_queued.keys() if not j in queue_status.keys()]:
-            # debug
-#            if job_id in queue_status.keys():
-#                print '\t'+ job_id , queue_status[job_id] , job_id in running_or_queued.keys()
-#            else:
-##                print '\t'+ job_id , None , job_id in running_or_queued.keys()
-#                print '\t'+ job_id , job_id in running_or_queued.keys()
-        
-            if (not job_id in queue_status.keys()) or (queue_status[job_id] == 'C' and job_id in running_or_queued.keys()):
-                task_id = running_or_queued[job_id][0]
-                command_index = running_or_queued[job_id][1]
-                command_dict = task_summaries[task_id]['commands'][command_index]
-
-                check_successful = determine_check_successful_function( command_dict , single_relax = single_relax )
-
-                success = check_successful( command_dict )
-
-                failure_summary = ''
-                if isinstance( success , bool ):
-                    complete = success
-                elif len( success ) > 1 and isinstance( success[0] , bool ):
-                    complete = success[0]
-                    failure_summary += ' '+ ';'.join( [str( j ) for j in success[1:]] ) +' '
- 
-                # track the number of attempts?
-                # try until failure - how many times?
-                tries = 0
-                if 'run' in command_dict.keys() and command_dict['run'] and not 'success' in command_dict['run'] and not 'failure' in command_dict['run']:
-                    tries = int( command_dict['run'] )
-                tries += 1
-                
-                if tries >= max_pbs_tries:
-                    # its a failure
-                    print job_id + ' completed successfully'*complete + (' failed with ' + str( tries ) + ' attempts')*(not complete)
-                    failure_summary = 'success'*complete + (str( tries ) +' tries;failure ' + failure_summary)*(not complete)
-                elif complete:
-                    print job_id + ' simply completed successfully'
-                    failure_summary = 'success' #+ str( tries ) + ' tries'
-                else:
-                    # record the number of tries
-                    print job_id + ' completed' + ' successfully'*complete
-                    failure_summary = str( tries )
-                
-                # update the record
-                task_summaries[task_id]['commands'][command_index]['run'] = failure_summary
-            
-                # optionally cleanup
-                if ddg_monomer_cleanup and command_dict['feature'] == 'ddg_monomer':#'ddg' in i['output_filename']:
-                    print 'ddg_monomer writes useless output files, deleting these now...'
-                    remove_intermediate_ddg_monomer_files()
-
-                # jobs that have since been completed - consider them complete?
-                completed.append( running_or_queued[job_id] )
-                del running_or_queued[job_id]
-                
-                # write out "completed"? or "running_or_queued"?
+        finished = reap_finished_jobs_SLURM( task_summaries , running_or_queued , queue_status , start_times ,
+            max_tries = max_pbs_tries , ddg_monomer_cleanup = ddg_monomer_cleanup , single_relax = single_relax , waiting = speculative.keys() )
+        finished_jobs = len( finished )
+        # jobs that have since been completed - consider them complete?
+        # not until they succeed or run out of tries, then they are submitted again
+        completed += [i for i in finished if check_command_finished( task_summaries[i[0]]['commands'][i[1]] )]
 
 #            else:
 #                still_running += 1
@@ -596,111 +669,36 @@ def run_VIPUR_tasks_SLURM( task_summaries , task_list , max_pbs_tries = 2 , ddg_
 
         # update task_summaries e.g. write them!
         # modified: so the task summary records its own name...bah!
+        # only what changed, appended to their journals
         for i in task_summaries:
             if not 'task_summary_filename' in i['filenames'].keys():
                 raise NotImplementedError( 'should input the task summary filename (not the summary itself)...' )
             else:
                 # write it out
-                print 'updating: ' + i['filenames']['task_summary_filename']
-                write_task_summary( i , i['filenames']['task_summary_filename'] )
+                journal_task_summary( i , i['filenames']['task_summary_filename'] )
+        # post process proteins that just finished
+        if finished_jobs and not postprocessed is None:
+            stream_postprocessing( task_summaries , postprocessed )
 
 
         # used to be first, submit jobs them check complete
         # but slurm removes jobs from the list
 
-        queue_space_occupied = len( [i for i in queue_status.values() if not i in ['C' , 'PD']] )    # ignore "C"ompleted jobs, "R"unning job quota are not set by us...
-        # if your queue system does not have a separate "R"un quota, remove 'R' from the above!
-        available_space = SLURM_QUEUE_QUOTA - queue_space_occupied
-
-        
-        # launch next jobs in available slots
-        if available_space:
-            print str( queue_space_occupied ) + ' jobs queued or running, could submit up to ' + str( available_space ) + ' more'
-            # choose the next job
-            jobs_to_run = [i for i in task_list if
-                not i in completed and
-                not i in running_or_queued.values() and
-                not ( 'run' in task_summaries[i[0]]['commands'][i[1]] and
-                    ('success' in task_summaries[i[0]]['commands'][i[1]]['run'] or
-                    'failure' in task_summaries[i[0]]['commands'][i[1]]['run']) )
-                ]
-            print str( len( jobs_to_run ) ) + ' jobs still need to finish (after the currently running jobs complete)'
-            
-            # only the next few
-            for i in jobs_to_run[:available_space]:
-                command_dict = task_summaries[i[0]]['commands'][i[1]]
-            
-                # write scripts as part of pre processing?...yeah...
-                # write the command to a script
-                #script_filename = command_dict['out_path'] +'/'*bool( command_dict['out_path'] )+
-                #script_filename = command_dict['script_filename']
-            
-                # submission is specific to the job
-                slurm_command = ''
-            
-                # if its a rescore and relax jobs were separated, need to recombine them!
-                if 'rescore' in command_dict['feature']:
-                    # combine the individual relax runs
-                    #relax_commands = [i for i in task_summary['commands'] if i['feature'].replace( '_native' , '' ) == 'relax']
-                    #silent_filenames = [j['output_filename'] for j in relax_commands if j['variant'] == i['variant'] and 'run' in j.keys() and j['run'] == 'success']
-                    silent_filenames = [j['output_filename'] for j in task_summaries[i[0]]['commands'] if
-                        j['feature'].replace( '_native' , '' ) == 'relax' and
-                        j['variant'] == command_dict['variant'] and
-                        'run' in j.keys() and
-                        'success' in j['run']
-                        ]
-                    # actually need to identify the combined_silent_filename, be sure the relax files have not already been merged
-                    # which variant
-                    target_variant = [j for j in task_summaries[i[0]]['variants'].keys() if j.split( '_' )[-1] == command_dict['variant'] and j.split( '_' )[0] in command_dict['command']]
-                    if not target_variant:
-                        # its native
-                        combined_silent_filename = task_summaries[i[0]]['other']['combined_native_silent_filename']
-                        combined_score_filename = task_summaries[i[0]]['other']['combined_native_score_filename']
-                    elif len( target_variant ) > 1:
-                        raise Exception( '??? found more than on matching variant ???\n' + ', '.join( target_variant ) )
-                    else:
-                        # found it
-                        combined_silent_filename = task_summaries[i[0]]['variants'][target_variant[0]]['combined_silent_filename']
-                        combined_score_filename = task_summaries[i[0]]['variants'][target_variant[0]]['combined_score_filename']
-
-                    #if not single_relax:    # AND post processing has not already be run...scan for the combined silent file
-                    if not single_relax and not os.path.isfile( combined_silent_filename ):
-                        if not len( silent_filenames ) == ROSETTA_RELAX_OPTIONS['nstruct']:
-                            raise Exception( '??? somehow the matching relax run(s) has failed ???\n' + str( i ) )
-                        score_filenames = [j.replace( '.silent' , '.sc' ) for j in silent_filenames]
-
-                        merge_rosetta_relax_output( silent_filenames , combined_silent_filename , score_filenames , combined_score_filename , delete_old_files = delete_intermediate_relax_files )
-                        # rescore already knows the proper filename
-                    else:
-                        # just a single match for each
-                        # output filename should be correct as is :)
-                        None
-
-                # do this above, in initial processing
-#                elif 'ddg_monomer' in command_dict['feature']:
-                    # must do it this way for now
-                    # write the run script
-#                    ddg_monomer_script_filename = task_summary['filenames']['slurm_script_filename'].replace( 'slurm_script_this_batch.sh' , 'run_ddg_momomer_script.sh' )
-#                    f = open( ddg_monomer_script_filename , 'w' )
-#                    f.write( command_dict['command'] )
-#                    f.close()
-
-            
-                # submit this script using a queue command
-                # srun or sbatch?
-                slurm_command = command_dict['sbatch_command']    # SHOULD already have an abspath to the script
-                new_job_id = run_local_commandline( slurm_command , collect_stdout = True )
-#                new_job_id = new_job_id[:new_job_id.find( ' ' )]
-                new_job_id = new_job_id.strip().split( ' ' )[-1]
-                print 'submitted ' + new_job_id
-                
-                # save the job id
-                # assume its queue
-                running_or_queued[new_job_id] = i
-#                print 'added ' + new_job_id
-
-        else:
-            print 'no new \"positions\" are available'
+        # launch next jobs into the space left in our allocation
+        # choose the next job, only those whose dependencies are done
+        running_before = len( running_or_queued )
+        jobs_to_run = submit_ready_tasks_SLURM( task_summaries , [i for i in task_list if not i in completed] , dependencies , running_or_queued ,
+            single_relax = single_relax , delete_intermediate_relax_files = delete_intermediate_relax_files ,
+            other_jobs = list_speculative_jobs( speculative , running_or_queued ) )
+        # remember them, in case this run is interrupted
+        record_submitted_jobs( task_summaries , running_or_queued )
+        # duplicate any stragglers, into whatever room is left
+        if speculate:
+            submit_speculative_jobs_SLURM( task_summaries , running_or_queued , speculative , speculated , start_times )
+        # jobs that can never run are done too
+        completed += [i for i in task_list if not i in completed and not i in running_or_queued.values() and check_command_finished( task_summaries[i[0]]['commands'][i[1]] )]
+        if not jobs_to_run and not running_or_queued and not len( completed ) == len( task_list ):
+            raise Exception( '??? none of the remaining jobs can run, the jobs they depend on are not finished ???' )
 
         # OKAY, move the "updating" to just after the status check
         # problem with ddg_monomer, runs so fast...
@@ -714,12 +712,21 @@ def run_VIPUR_tasks_SLURM( task_summaries , task_list , max_pbs_tries = 2 , ddg_
 
         
         # pause...
-        if queue_space_occupied or jobs_to_run:
-            print 'waiting ' + str( SLURM_QUEUE_MONITOR_DELAY ) +'s...'
-            time.sleep( SLURM_QUEUE_MONITOR_DELAY )
+        # briefly while jobs are finishing or being submitted, longer while the queue is static
+        # but wake up as soon as any job says it is done
+        if running_or_queued:
+            delay = determine_monitor_delay( delay , finished_jobs or len( running_or_queued ) > running_before )
+            print 'waiting up to ' + str( delay ) +'s...'
+            # not the finished originals whose duplicate runs on
+            retrying = list_retrying_speculative_commands( speculative )
+            wait_for_sentinel_files( [get_command_sentinel_filename( task_summaries[j[0]]['commands'][j[1]] ) for i , j in running_or_queued.items() if not i in retrying] , delay )
+
+    # any duplicates left lost the race
+    stop_speculative_commands( speculative , lambda x : run_local_commandline( 'scancel ' + x ) )
 
     # return anything?
     # write one last time?
+    # also compacts the journals
     for i in task_summaries:
         if not 'task_summary_filename' in i['filenames'].keys():
             raise NotImplementedError( 'should input the task summary filename (not the summary itself)...' )
@@ -727,13 +734,326 @@ def run_VIPUR_tasks_SLURM( task_summaries , task_list , max_pbs_tries = 2 , ddg_
             # write it out
             write_task_summary( i , i['filenames']['task_summary_filename'] )
 
+# record the outcome of the jobs in  <running_or_queued>  that finished (gone
+# from  <queue_status> , wrote their sentinel or complete output), as
+# "success", the number of tries so far (to submit it again) or a failure
+# once  <max_tries>  are used up, returns their job pairs
+# jobs in  <waiting>  (e.g. a duplicate is still running as the next try) are left alone
+def reap_finished_jobs_SLURM( task_summaries , running_or_queued , queue_status , start_times , max_tries = 2 , ddg_monomer_cleanup = True , single_relax = False ,
+        waiting = [] ):
+    finished = []
+    for job_id in running_or_queued.keys():
+        if job_id in waiting:
+            continue
+        # debug
+#        if job_id in queue_status.keys():
+#            print '\t'+ job_id , queue_status[job_id] , job_id in running_or_queued.keys()
+#        else:
+##                print '\t'+ job_id , None , job_id in running_or_queued.keys()
+#            print '\t'+ job_id , job_id in running_or_queued.keys()
+        task_id = running_or_queued[job_id][0]
+        command_index = running_or_queued[job_id][1]
+        command_dict = task_summaries[task_id]['commands'][command_index]
+
+        # gone from the queue, or it told us it is done, or its output is complete
+        if check_slurm_job_finished( job_id , queue_status , get_command_sentinel_filename( command_dict ) ) or check_slurm_output_complete( command_dict , single_relax = single_relax ):
+            check_successful = determine_check_successful_function( command_dict , single_relax = single_relax )
+
+            success = check_successful( command_dict )
+
+            failure_summary = ''
+            if isinstance( success , bool ):
+                complete = success
+            elif len( success ) > 1 and isinstance( success[0] , bool ):
+                complete = success[0]
+                failure_summary += ' '+ ';'.join( [str( j ) for j in success[1:]] ) +' '
+ 
+            # track the number of attempts?
+            # try until failure - how many times?
+            tries = 0
+            if 'run' in command_dict.keys() and command_dict['run'] and not 'success' in command_dict['run'] and not 'failure' in command_dict['run']:
+                tries = int( command_dict['run'] )
+            tries += 1
+            
+            if tries >= max_tries:
+                # its a failure
+                print job_id + ' completed successfully'*complete + (' failed with ' + str( tries ) + ' attempts')*(not complete)
+                failure_summary = 'success'*complete + (str( tries ) +' tries;failure ' + failure_summary)*(not complete)
+            elif complete:
+                print job_id + ' simply completed successfully'
+                failure_summary = 'success' #+ str( tries ) + ' tries'
+            else:
+                # record the number of tries, submit it again
+                print job_id + ' failed, will try again'
+                failure_summary = str( tries )
+            
+            # update the record
+            task_summaries[task_id]['commands'][command_index]['run'] = failure_summary
+            record_job_runtime( command_dict , start_times , job_id )
+            finish_packed_command( command_dict )
+            forget_submitted_job( command_dict )
+        
+            # optionally cleanup
+            if ddg_monomer_cleanup and command_dict['feature'] == 'ddg_monomer':#'ddg' in i['output_filename']:
+                print 'ddg_monomer writes useless output files, deleting these now...'
+                remove_intermediate_ddg_monomer_files( task_summaries[task_id]['out_path'] )
+
+            finished.append( running_or_queued.pop( job_id ) )
+            
+            # write out "completed"? or "running_or_queued"?
+
+    return finished
+
+# submit the next jobs whose dependencies are done, as many as fit in the
+# cores + memory our jobs in  <running_or_queued>  are not already using
+# records the new job ids in  <running_or_queued>
+def submit_ready_tasks_SLURM( task_summaries , task_list , dependencies , running_or_queued , single_relax = False , delete_intermediate_relax_files = False ,
+        total_cores = SLURM_ALLOCATION_CORES , total_memory = SLURM_ALLOCATION_MEMORY , other_jobs = {} ):
+    jobs_to_run = select_ready_tasks( task_summaries , [i for i in task_list if not i in running_or_queued.values()] , dependencies )
+    # the longest critical path first, the rest backfill
+    jobs_to_run = prioritize_tasks( task_summaries , jobs_to_run , dependencies )
+    # <other_jobs>  e.g. duplicates hold resources too
+    occupied_cores , occupied_memory = determine_occupied_job_resources( task_summaries , dict( running_or_queued.items() + other_jobs.items() ) , total_cores , total_memory )
+    print str( occupied_cores ) + ' cores and ' + str( occupied_memory ) + 'GB requested by jobs queued or running, ' + str( len( jobs_to_run ) ) + ' jobs are ready to run'
+
+    # job array elements go in together, one sbatch per script
+    array_jobs = [i for i in jobs_to_run if 'array_index' in task_summaries[i[0]]['commands'][i[1]].keys()]
+    for script_filename in unique_script_filenames( task_summaries , array_jobs ):
+        job_pairs = [i for i in array_jobs if task_summaries[i[0]]['commands'][i[1]]['script_filename'] == script_filename]
+
+        # throttle the array to the space that is left
+        cores , memory = determine_command_resources( task_summaries[job_pairs[0][0]] , task_summaries[job_pairs[0][0]]['commands'][job_pairs[0][1]] )
+        cores = min( cores , total_cores )
+        memory = min( memory , total_memory )
+        limit = int( min( ( total_cores - occupied_cores )/cores , ( total_memory - occupied_memory )/memory if memory else float( 'inf' ) , len( job_pairs ) ) )
+        if SLURM_ARRAY_MAX_SIMULTANEOUS:
+            limit = min( limit , SLURM_ARRAY_MAX_SIMULTANEOUS )
+        if limit < 1:
+            # no room for even one, wait
+            continue
+
+        submit_slurm_array( task_summaries , job_pairs , running_or_queued , limit )
+        occupied_cores += limit*cores
+        occupied_memory += limit*memory
+    jobs_to_run = [i for i in jobs_to_run if not i in array_jobs]
+
+    # short commands share a job, only worth it for more than one
+    for job_pairs in pack_short_tasks( task_summaries , select_packable_tasks( task_summaries , jobs_to_run ) ):
+        if len( job_pairs ) < 2:
+            continue
+        workers , cores , memory = determine_packed_job_resources( task_summaries , job_pairs , total_cores = total_cores , total_memory = total_memory )
+        if cores > total_cores - occupied_cores or memory > total_memory - occupied_memory:
+            continue
+
+        submit_packed_job_SLURM( task_summaries , job_pairs , running_or_queued , workers , cores , memory ,
+            single_relax = single_relax , delete_intermediate_relax_files = delete_intermediate_relax_files )
+        occupied_cores += cores
+        occupied_memory += memory
+        jobs_to_run = [i for i in jobs_to_run if not i in job_pairs]
+
+    # only the next few
+    for i in pack_tasks( task_summaries , jobs_to_run , total_cores - occupied_cores , total_memory - occupied_memory , total_cores , total_memory ):
+        command_dict = task_summaries[i[0]]['commands'][i[1]]
+
+        # if its a rescore and relax jobs were separated, need to recombine them!
+        if 'rescore' in command_dict['feature']:
+            merge_relax_output_for_rescore( task_summaries[i[0]] , command_dict , single_relax = single_relax , delete_intermediate_relax_files = delete_intermediate_relax_files )
+
+        # clear any evidence of an earlier attempt
+        sentinel_filename = get_command_sentinel_filename( command_dict )
+        if sentinel_filename and os.path.isfile( sentinel_filename ):
+            os.remove( sentinel_filename )
+
+        # submit this script using a queue command
+        # srun or sbatch?
+        slurm_command = command_dict['sbatch_command']    # SHOULD already have an abspath to the script
+        new_job_id = run_local_commandline( slurm_command , collect_stdout = True )
+        new_job_id = new_job_id.strip().split( ' ' )[-1]
+        print 'submitted ' + new_job_id
+
+        # save the job id
+        # assume its queue
+        running_or_queued[new_job_id] = i
+
+    return jobs_to_run
+
+# submit a duplicate of each job taking much longer than its siblings (see
+# select_straggling_tasks), as many as fit in the allocation
+# records each in  <speculative>  by the job id of the original
+def submit_speculative_jobs_SLURM( task_summaries , running_or_queued , speculative , speculated , start_times ,
+        total_cores = SLURM_ALLOCATION_CORES , total_memory = SLURM_ALLOCATION_MEMORY ):
+    job_ids = dict( [(j , i) for i , j in running_or_queued.items()] )
+    stragglers = select_straggling_tasks( task_summaries , determine_job_elapsed_times( start_times , running_or_queued ) , speculated )
+    occupied_cores , occupied_memory = determine_occupied_job_resources( task_summaries , dict( running_or_queued.items() + list_speculative_jobs( speculative , running_or_queued ).items() ) , total_cores , total_memory )
+    for i in pack_tasks( task_summaries , stragglers , total_cores - occupied_cores , total_memory - occupied_memory , total_cores , total_memory ):
+        command_dict = task_summaries[i[0]]['commands'][i[1]]
+        speculative_dict = get_speculative_command_dict( command_dict )
+
+        # its own script, same command into its own output files
+        script_filename = os.path.splitext( speculative_dict['output_filename'] )[0] +'.'+ command_dict['feature'] + '.slurm_script.sh'
+        f = open( script_filename , 'w' )
+        f.write( SLURM_BASH_SCRIPT( isolate_command( speculative_dict ) ) )
+        f.close()
+
+        cores , memory = determine_command_resources( task_summaries[i[0]] , command_dict )
+        slurm_options = {}
+        slurm_options.update( SLURM_JOB_OPTIONS )
+        for k in slurm_options.keys():
+            if '__call__' in dir( slurm_options[k] ):
+                slurm_options[k] = slurm_options[k]( script_filename )
+        slurm_options['N'] = '1'
+        slurm_options['n'] = '1'
+        slurm_options['c'] = str( min( cores , total_cores ) )
+        slurm_options['-mem'] = str( int( 1024*min( memory , total_memory ) ) )    # MB
+
+        new_job_id = run_local_commandline( create_executable_str( 'sbatch' , [script_filename] , slurm_options ) , collect_stdout = True )
+        new_job_id = new_job_id.strip().split( ' ' )[-1]
+        print 'submitted ' + new_job_id + ', a duplicate of the straggling job ' + job_ids[i]
+
+        speculative[job_ids[i]] = (command_dict , job_ids[i] , new_job_id , speculative_dict)
+        speculated.append( i )
+
+# submit several short commands as one job, batch_driver.py runs them
+# <workers>  at a time, records each as "<job id>+<index>" in  <running_or_queued>
+def submit_packed_job_SLURM( task_summaries , job_pairs , running_or_queued , workers , cores , memory , single_relax = False , delete_intermediate_relax_files = False ):
+    for i in job_pairs:
+        command_dict = task_summaries[i[0]]['commands'][i[1]]
+        if 'rescore' in command_dict['feature']:
+            merge_relax_output_for_rescore( task_summaries[i[0]] , command_dict , single_relax = single_relax , delete_intermediate_relax_files = delete_intermediate_relax_files )
+
+    script_filename = get_packed_script_filename( task_summaries , job_pairs )
+    write_packed_job( task_summaries , job_pairs , script_filename , workers )
+
+    slurm_options = {}
+    slurm_options.update( SLURM_JOB_OPTIONS )
+    for k in slurm_options.keys():
+        if '__call__' in dir( slurm_options[k] ):
+            slurm_options[k] = slurm_options[k]( script_filename )
+    slurm_options['N'] = '1'
+    slurm_options['n'] = '1'
+    slurm_options['c'] = str( cores )
+    slurm_options['-mem'] = str( int( 1024*memory ) )    # MB
+
+    new_job_id = run_local_commandline( create_executable_str( 'sbatch' , [script_filename] , slurm_options ) , collect_stdout = True )
+    new_job_id = new_job_id.strip().split( ' ' )[-1]
+    print 'submitted ' + new_job_id + ' running ' + str( len( job_pairs ) ) + ' commands, ' + str( workers ) + ' at a time'
+
+    for i in job_pairs:
+        command_dict = task_summaries[i[0]]['commands'][i[1]]
+        command_dict['element_limit'] = str( workers )
+        running_or_queued[new_job_id +'+'+ command_dict['pack_index']] = i
+
+################################################################################
+# SLURM JOB ARRAYS
+
+# write one script per feature for the commands in  <features>  (relax
+# trajectories), the commands are run by their SLURM_ARRAY_TASK_ID
+def write_slurm_array_scripts( task_summary , script_root , features = SLURM_ARRAY_FEATURES ):
+    for feature in features:
+        command_indices = [j for j in xrange( len( task_summary['commands'] ) ) if task_summary['commands'][j]['feature'] == feature]
+        if not command_indices:
+            continue
+
+        script_filename = script_root +'.'+ feature + '.slurm_array_script.sh'
+        for k in xrange( len( command_indices ) ):
+            task_summary['commands'][command_indices[k]]['array_index'] = str( k )
+            task_summary['commands'][command_indices[k]]['script_filename'] = script_filename
+        # one sentinel per array element
+        write_array_script( script_filename , [isolate_command( task_summary['commands'][j] ) for j in command_indices] , 'SLURM_ARRAY_TASK_ID' ,
+            get_sentinel_filename( script_filename.replace( '.sh' , '_${SLURM_ARRAY_TASK_ID}.sh' ) ) )
+
+        # one log per array element
+        slurm_options = {}
+        slurm_options.update( SLURM_JOB_OPTIONS )
+        for k in slurm_options.keys():
+            if '__call__' in dir( slurm_options[k] ):
+                slurm_options[k] = slurm_options[k]( script_filename.replace( '.sh' , '_%a.sh' ) )
+
+        # each element requests what one command needs
+        slurm_options['N'] = '1'
+        slurm_options['n'] = '1'
+        cores , memory = determine_command_resources( task_summary , task_summary['commands'][command_indices[0]] )
+        slurm_options['c'] = str( min( cores , SLURM_ALLOCATION_CORES ) )
+        slurm_options['-mem'] = str( int( 1024*memory ) )    # MB
+
+        # the same for all elements, the indices are added when submitting
+        sbatch_command = create_executable_str( 'sbatch' , [script_filename] , slurm_options )
+        for j in command_indices:
+            task_summary['commands'][j]['sbatch_command'] = sbatch_command
+
+# submit these elements of a job array, at most  <limit>  at once
+# records each element as "<job id>_<array index>" in  <running_or_queued>
+def submit_slurm_array( task_summaries , job_pairs , running_or_queued , limit = 0 ):
+    array_indices = []
+    for i in job_pairs:
+        command_dict = task_summaries[i[0]]['commands'][i[1]]
+        array_indices.append( int( command_dict['array_index'] ) )
+
+        # clear any evidence of an earlier attempt
+        sentinel_filename = get_command_sentinel_filename( command_dict )
+        if os.path.isfile( sentinel_filename ):
+            os.remove( sentinel_filename )
+
+    # only the elements that still need to run (retries)
+    array_option = '--array=' + compress_array_indices( array_indices ) + ('%' + str( limit ))*bool( limit )
+    slurm_command = task_summaries[job_pairs[0][0]]['commands'][job_pairs[0][1]]['sbatch_command'].replace( 'sbatch ' , 'sbatch ' + array_option +' ' , 1 )
+    new_job_id = run_local_commandline( slurm_command , collect_stdout = True )
+    new_job_id = new_job_id.strip().split( ' ' )[-1]
+    print 'submitted ' + new_job_id + ' ' + array_option
+
+    for i in job_pairs:
+        running_or_queued[new_job_id +'_'+ task_summaries[i[0]]['commands'][i[1]]['array_index']] = i
+        task_summaries[i[0]]['commands'][i[1]]['element_limit'] = str( limit )
+
+# squeue shows pending array elements together e.g. "123_[5-9,12%4]"
+# report each element separately e.g. "123_5"
+def expand_slurm_array_status( queue_status ):
+    expanded = {}
+    for job_id in queue_status.keys():
+        if not '_[' in job_id:
+            expanded[job_id] = queue_status[job_id]
+            continue
+
+        base_id , array_indices = job_id.rstrip( ']' ).split( '_[' )
+        for i in array_indices.split( '%' )[0].split( ',' ):
+            i = i.split( '-' )
+            for j in xrange( int( i[0] ) , int( i[-1] ) + 1 ):
+                expanded[base_id +'_'+ str( j )] = queue_status[job_id]
+    return expanded
+
 ################################################################################
 # PBS INTERACTION METHODS
 
 # ASSUMES it is the ONLY application submitting jobs as this user...
 # simple parse/scan the queue, use qstat -u 
-def get_slurm_queue_status( user = SLURM_USER , header_lines = 1 , trailer_lines = 0 , only_job_status = True ):
+# what squeue says when it was asked about jobs that all left the queue
+SLURM_INVALID_JOB_ID_MESSAGE = 'Invalid job id specified'
+
+# None if squeue failed for any other reason (the job_ids query only), so the
+# monitors do not mistake every job for finished
+def get_slurm_queue_status( user = SLURM_USER , header_lines = 1 , trailer_lines = 0 , only_job_status = True , job_ids = [] ):
     # header_lines = 2 for FULL queue, = 5 for USER queue ("-u")
+    if job_ids:
+        # only ask about our own jobs, all in one call
+        # job array elements "<job id>_<index>" and packed commands are found by their job id
+        base_ids = []
+        for i in job_ids:
+            if not get_queue_job_id( i ) in base_ids:
+                base_ids.append( get_queue_job_id( i ) )
+        command = 'squeue -h -o \"%i %t\" -j ' + ','.join( base_ids )
+        print '\n'+ '='*80 + '\nPerforming system call:\n' + command + '\n' + '='*80 +'\n'
+        process = subprocess.Popen( command , shell = True , stdout = subprocess.PIPE , stdin = subprocess.PIPE , stderr = subprocess.STDOUT )
+        queue_info = process.communicate()[0]
+        # none of the jobs are left, anything else (e.g. a timeout) says nothing about them
+        if process.returncode and not SLURM_INVALID_JOB_ID_MESSAGE in queue_info:
+            print 'squeue failed (' + str( process.returncode ) + '), cannot tell which jobs are done:\n' + queue_info.strip()
+            return None
+        queue_info = [i.split( ' ' ) for i in queue_info.split( '\n' ) if i.strip()]
+        queue_info = [i for i in queue_info if len( i ) == 2 and i[0].split( '_' )[0].isdigit()]
+        if only_job_status:
+            queue_info = expand_slurm_array_status( dict( queue_info ) )
+        return queue_info
+
     command = 'squeue'
     if user:
         command += ' -u ' + user
@@ -770,6 +1090,65 @@ def get_slurm_queue_status( user = SLURM_USER , header_lines = 1 , trailer_lines
 # primarily concerned with job status only
 # need 1st and 2nd to last columns
 
+# job states that will not change anymore
+SLURM_FINISHED_STATES = ['C' , 'CD' , 'CA' , 'F' , 'TO' , 'NF' , 'PR' , 'BF' , 'DL' , 'OOM']
+
+# the job is done if it left the queue, is in a final state, or wrote its sentinel file
+def check_slurm_job_finished( job_id , queue_status , sentinel_filename = '' ):
+    if sentinel_filename and os.path.isfile( sentinel_filename ):
+        return True
+    return not job_id in queue_status.keys() or queue_status[job_id] in SLURM_FINISHED_STATES
+
+# commands whose output is only complete once the command is done
+# (others e.g. probe write their output as they go)
+SLURM_OUTPUT_COMPLETE_FEATURES = ['psiblast' , 'relax' , 'relax_native']
+
+def check_slurm_output_complete( command_dict , single_relax = False , features = SLURM_OUTPUT_COMPLETE_FEATURES ):
+    if not command_dict['feature'] in features or not os.path.isfile( command_dict['output_filename'] ):
+        return False
+    check_successful = determine_check_successful_function( command_dict , single_relax = single_relax )
+    try:
+        return interpret_check_successful( check_successful( command_dict ) )[0]
+    except IOError:
+        # other files it needs are not there yet
+        return False
+
+# jobs write this file when they finish, much faster than waiting for squeue
+def get_sentinel_filename( script_filename ):
+    return script_filename.replace( '.sh' , '.done' )
+
+def get_command_sentinel_filename( command_dict ):
+    if 'pack_index' in command_dict.keys():
+        # written by batch_driver.py
+        return get_packed_sentinel_filename( command_dict )
+    elif 'array_index' in command_dict.keys():
+        # one per job array element
+        return get_sentinel_filename( command_dict['script_filename'].replace( '.sh' , '_'+ command_dict['array_index'] +'.sh' ) )
+    elif 'script_filename' in command_dict.keys():
+        return get_sentinel_filename( command_dict['script_filename'] )
+    return ''
+
+# record the exit status, use ";" to match SLURM_BASH_SCRIPT
+def add_sentinel_to_command( command , sentinel_filename ):
+    return command +';echo $? > '+ sentinel_filename
+
+# short delays while things are changing, back off when the queue is static
+def determine_monitor_delay( delay , changed , min_delay = SLURM_QUEUE_MONITOR_MIN_DELAY , max_delay = SLURM_QUEUE_MONITOR_DELAY ):
+    if changed:
+        return min_delay
+    return min( 2*delay , max_delay )
+
+# wait up to  <delay>  seconds, stop early if any of the  <sentinel_filenames>  appear
+def wait_for_sentinel_files( sentinel_filenames , delay , check_interval = SLURM_SENTINEL_CHECK_INTERVAL ):
+    sentinel_filenames = [i for i in sentinel_filenames if i]
+    waited = 0
+    while waited < delay:
+        if [i for i in sentinel_filenames if os.path.isfile( i )]:
+            return True
+        time.sleep( min( check_interval , delay - waited ) )
+        waited += check_interval
+    return False
+
 # simple wrapper for running
 # grab the output job ID
 def run_slurm_job( script_filename , slurm_run_command = 'sbatch' , output_filename = 'temp_slurm.sh' ):    
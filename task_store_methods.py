@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# :noTabs=true:
+
+"""
+a shared, on-disk store of commands for the "pilot" run mode
+(see pilot_run_methods.py)
+
+the store is a SQLite database, the run methods add commands as they become
+ready and long-lived workers claim them one at a time, run them, and record
+the exit status and runtime, until the store is closed and drained
+claims happen inside a transaction, so each command is only run once
+(the store must be on a filesystem with working file locks)
+a claim is a lease, the worker renews it while the command runs, commands
+whose lease expires (the worker died) can be released back to the store
+
+only uses standard modules (and process_methods.py), so workers can start
+anywhere VIPUR is visible
+
+usage (for a worker): python task_store_methods.py <task store filename> <worker name> [idle timeout (s)] [heartbeat (s)]
+"""
+
+################################################################################
+# IMPORT
+
+# common modules
+import os
+import sqlite3
+import sys
+import time
+
+# custom modules
+from process_methods import start_process , wait_for_processes , kill_processes , stop_processes_on_signals
+
+################################################################################
+# TASK STORE METHODS
+
+# commands move through the store as:
+# pending -> running -> finished (by a worker) -> collected (by the run methods)
+# running -> pending (lease expired, released by the run methods)
+
+# open the store, wait on locks instead of failing
+def connect_task_store( store_filename , timeout = 60 ):
+    # no implicit transactions, claims use explicit ones
+    return sqlite3.connect( store_filename , timeout = timeout , isolation_level = None )
+
+# start a new, empty store
+def create_task_store( store_filename ):
+    if os.path.isfile( store_filename ):
+        os.remove( store_filename )
+
+    store = connect_task_store( store_filename )
+    store.execute( 'CREATE TABLE commands ( id INTEGER PRIMARY KEY , task_index INTEGER , command_index INTEGER , command TEXT , priority REAL , log_filename TEXT , status TEXT , worker TEXT , exit_status INTEGER , runtime REAL , started REAL , updated REAL )' )
+    store.execute( 'CREATE TABLE settings ( key TEXT PRIMARY KEY , value TEXT )' )
+    store.execute( 'INSERT INTO settings VALUES ( \'closed\' , \'0\' )' )
+    return store
+
+# add ( task index , command index , command , priority , log filename ) to be run
+# workers claim the highest priority first, then in the order they were added
+def add_commands_to_store( store , commands ):
+    store.execute( 'BEGIN IMMEDIATE' )
+    for i in commands:
+        store.execute( 'INSERT INTO commands ( task_index , command_index , command , priority , log_filename , status , updated ) VALUES ( ? , ? , ? , ? , ? , \'pending\' , ? )' ,
+            ( i[0] , i[1] , i[2] , i[3] if len( i ) > 3 else 0 , i[4] if len( i ) > 4 else '' , time.time() ) )
+    store.execute( 'COMMIT' )
+
+# the next pending command as ( id , command , log filename ), None if there are none
+def claim_command( store , worker ):
+    store.execute( 'BEGIN IMMEDIATE' )
+    command = store.execute( 'SELECT id , command , log_filename FROM commands WHERE status = \'pending\' ORDER BY priority DESC , id LIMIT 1' ).fetchone()
+    if command:
+        now = time.time()
+        store.execute( 'UPDATE commands SET status = \'running\' , worker = ? , started = ? , updated = ? WHERE id = ?' , ( worker , now , now , command[0] ) )
+    store.execute( 'COMMIT' )
+    return command
+
+# renew the lease on a claimed command, False if it is no longer this
+# worker's (it was released)
+def renew_command_lease( store , command_id , worker ):
+    return bool( store.execute( 'UPDATE commands SET updated = ? WHERE id = ? AND status = \'running\' AND worker = ?' ,
+        ( time.time() , command_id , worker ) ).rowcount )
+
+# only if it is still this worker's, a released command will run again
+def finish_command( store , command_id , worker , exit_status , runtime ):
+    store.execute( 'UPDATE commands SET status = \'finished\' , exit_status = ? , runtime = ? , updated = ? WHERE id = ? AND status = \'running\' AND worker = ?' ,
+        ( exit_status , runtime , time.time() , command_id , worker ) )
+
+# running commands whose lease was not renewed for  <lease>  seconds (the
+# worker died) go back to pending, returns them as ( task index , command index )
+# those in  <exhausted>  are finished instead, as failures (exit status -1)
+def release_expired_commands( store , lease , exhausted = [] ):
+    store.execute( 'BEGIN IMMEDIATE' )
+    now = time.time()
+    expired = store.execute( 'SELECT id , task_index , command_index , started FROM commands WHERE status = \'running\' AND updated < ? ORDER BY id' , ( now - lease , ) ).fetchall()
+    released = []
+    for command_id , task_index , command_index , started in expired:
+        if (task_index , command_index) in exhausted:
+            store.execute( 'UPDATE commands SET status = \'finished\' , exit_status = -1 , runtime = ? , updated = ? WHERE id = ?' , ( now - started , now , command_id ) )
+        else:
+            store.execute( 'UPDATE commands SET status = \'pending\' , worker = NULL , updated = ? WHERE id = ?' , ( now , command_id ) )
+            released.append( (task_index , command_index) )
+    store.execute( 'COMMIT' )
+    return released
+
+# commands the workers have finished since the last call
+# as ( task index , command index , exit status , runtime )
+def collect_finished_commands( store ):
+    store.execute( 'BEGIN IMMEDIATE' )
+    finished = store.execute( 'SELECT task_index , command_index , exit_status , runtime FROM commands WHERE status = \'finished\' ORDER BY id' ).fetchall()
+    store.execute( 'UPDATE commands SET status = \'collected\' WHERE status = \'finished\'' )
+    store.execute( 'COMMIT' )
+    return finished
+
+# how many commands are in each state
+def get_task_store_status( store ):
+    status = dict( [(i , 0) for i in ['pending' , 'running' , 'finished' , 'collected']] )
+    status.update( dict( store.execute( 'SELECT status , COUNT(*) FROM commands GROUP BY status' ).fetchall() ) )
+    return status
+
+# no more commands will be added, workers stop once the store is empty
+def close_task_store( store ):
+    store.execute( 'UPDATE settings SET value = \'1\' WHERE key = \'closed\'' )
+
+def check_task_store_closed( store ):
+    return store.execute( 'SELECT value FROM settings WHERE key = \'closed\'' ).fetchone()[0] == '1'
+
+################################################################################
+# WORKER METHODS
+
+# run commands from the store until it is closed and empty, or nothing new
+# shows up for  <idle_timeout>  seconds, renewing the lease on each command
+# every  <heartbeat>  seconds while it runs
+def run_task_store_worker( store_filename , worker , idle_timeout = 600 , heartbeat = 60 , check_interval = 5 ):
+    store = connect_task_store( store_filename )
+    print worker + ' pulling commands from ' + store_filename
+    # a qdel or walltime kill signals this worker, not the commands
+    stop_processes_on_signals()
+
+    idle = 0
+    ran = 0
+    while True:
+        command = claim_command( store , worker )
+        if not command:
+            if check_task_store_closed( store ):
+                print 'the task store is drained'
+                break
+            elif idle >= idle_timeout:
+                print 'nothing to run for ' + str( idle ) + 's, stopping'
+                break
+            time.sleep( check_interval )
+            idle += check_interval
+            continue
+
+        idle = 0
+        print '\n'+ '='*80 + '\n' + worker + ' running:\n' + command[1] + '\n' + '='*80 +'\n'
+        process = start_process( command[1] , command[2] )
+        while not wait_for_processes( [process] , timeout = heartbeat ):
+            if not renew_command_lease( store , command[0] , worker ):
+                # released, it will run again elsewhere, so nothing it
+                # started may keep writing the same output
+                print 'lost the lease on this command, stopping it'
+                kill_processes( [process] )
+                break
+        finish_command( store , command[0] , worker , process['exit_status'] , process['runtime'] )
+        ran += 1
+
+    store.close()
+    print worker + ' ran ' + str( ran ) + ' commands'
+    return ran
+
+################################################################################
+# MAIN
+
+if __name__ == '__main__':
+    if len( sys.argv ) < 3:
+        print __doc__
+        sys.exit( 1 )
+
+    idle_timeout = 600
+    if len( sys.argv ) > 3:
+        idle_timeout = int( sys.argv[3] )
+    heartbeat = 60
+    if len( sys.argv ) > 4:
+        heartbeat = float( sys.argv[4] )
+
+    run_task_store_worker( sys.argv[1] , sys.argv[2] , idle_timeout , heartbeat )
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# :noTabs=true:
+
+"""
+check that a sharded PSIBLAST search (see PSIBLAST_SHARDS) makes the same PSSM
+as run_psiblast searching the whole database at once
+
+builds a small synthetic BLAST database, a query with <homologs> mutated
+copies of it (more and more diverged, some only found in later iterations)
+among <background> random sequences, split round-robin into <shards> parts,
+then searches it both ways with PSIBLAST_OPTIONS and compares the PSSMs:
+    positions       how many positions each PSSM has
+    log-likelihood  positions whose scores differ, and the largest difference
+    frequencies     positions whose frequencies differ
+exits with 1 if they differ, the commands are logged to <out path>.log
+
+needs BLAST+ (PATH_TO_PSIBLAST, PATH_TO_BLASTDBCMD and PATH_TO_MAKEBLASTDB in
+vipur_settings.py), the fake tools do not really search
+
+usage: python validate_psiblast_shards.py [options]    (-h for the options)
+"""
+
+################################################################################
+# IMPORT
+
+# common modules
+import optparse
+import os
+import random
+import shutil
+import sys
+
+# custom modules
+from vipur_settings import PATH_TO_MAKEBLASTDB , PROTEIN_LETTERS , PSIBLAST_OPTIONS
+from helper_methods import create_executable_str , run_local_commandline
+from psiblast_feature_generation import run_psiblast , extract_pssm_from_psiblast_pssm , get_blast_database_length , search_psiblast_shard , merge_psiblast_shards
+
+################################################################################
+# SETTINGS
+
+VALIDATION_QUERY_LENGTH = 150
+VALIDATION_HOMOLOGS = 60
+VALIDATION_BACKGROUND = 5000
+VALIDATION_SHARDS = 3
+VALIDATION_THREADS = 1
+
+# amino acid background frequencies (Robinson and Robinson) so the random
+# sequences score like real ones
+VALIDATION_BACKGROUND_FREQUENCIES = {
+    'A' : .078 , 'C' : .019 , 'D' : .054 , 'E' : .063 , 'F' : .039 ,
+    'G' : .074 , 'H' : .022 , 'I' : .051 , 'K' : .057 , 'L' : .090 ,
+    'M' : .022 , 'N' : .045 , 'P' : .052 , 'Q' : .043 , 'R' : .051 ,
+    'S' : .071 , 'T' : .058 , 'V' : .064 , 'W' : .013 , 'Y' : .032
+    }
+
+################################################################################
+# SYNTHETIC DATABASE
+
+def make_random_sequence( length , generator , frequencies = VALIDATION_BACKGROUND_FREQUENCIES ):
+    letters = sorted( frequencies.keys() )
+    cumulative = []
+    total = 0
+    for i in letters:
+        total += frequencies[i]
+        cumulative.append( total )
+    sequence = ''
+    for i in xrange( length ):
+        x = generator.random()*total
+        sequence += letters[min( [j for j in xrange( len( letters ) ) if cumulative[j] >= x] )]
+    return sequence
+
+# <sequence>  with  <divergence>  of its positions substituted, and a few
+# short insertions/deletions, inside a random flanking region
+def mutate_sequence( sequence , divergence , generator ):
+    mutant = ''
+    for i in sequence:
+        x = generator.random()
+        if x < divergence:
+            mutant += make_random_sequence( 1 , generator )
+        elif x < divergence + .01:
+            # deletion
+            continue
+        elif x < divergence + .02:
+            mutant += i + make_random_sequence( generator.randint( 1 , 3 ) , generator )
+        else:
+            mutant += i
+    return make_random_sequence( generator.randint( 0 , 40 ) , generator ) + mutant + make_random_sequence( generator.randint( 0 , 40 ) , generator )
+
+# write the query to  <out_path>/query.fa  and the database (all sequences)
+# and its  <shards>  as FASTA files, returns the (database , shard) FASTA
+# filenames
+def write_synthetic_database( out_path , homologs = VALIDATION_HOMOLOGS , background = VALIDATION_BACKGROUND ,
+        shards = VALIDATION_SHARDS , query_length = VALIDATION_QUERY_LENGTH , seed = 0 ):
+    generator = random.Random( seed )
+    query = make_random_sequence( query_length , generator )
+    f = open( out_path + '/query.fa' , 'w' )
+    f.write( '>query\n' + query +'\n' )
+    f.close()
+
+    # close to distant homologs, distant ones are only found with the PSSM
+    sequences = [('homolog_' + str( i ) , mutate_sequence( query , .2 + .6*i/float( max( homologs - 1 , 1 ) ) , generator )) for i in xrange( homologs )]
+    sequences += [('background_' + str( i ) , make_random_sequence( generator.randint( 50 , 500 ) , generator )) for i in xrange( background )]
+    generator.shuffle( sequences )
+
+    database_filename = out_path + '/database.fa'
+    shard_filenames = [out_path + '/shard_' + str( i ) + '.fa' for i in xrange( shards )]
+    for filename , records in [(database_filename , sequences)] + [(shard_filenames[i] , sequences[i::shards]) for i in xrange( shards )]:
+        f = open( filename , 'w' )
+        f.write( ''.join( ['>' + i +'\n'+ j +'\n' for i , j in records] ) )
+        f.close()
+    return database_filename , shard_filenames
+
+# a BLAST database from  <fasta_filename> , returns its name
+def make_blast_database( fasta_filename ):
+    database = fasta_filename.replace( '.fa' , '' )
+    if run_local_commandline( create_executable_str( PATH_TO_MAKEBLASTDB , options = {'in' : fasta_filename , 'dbtype' : 'prot' , 'parse_seqids' : '' , 'out' : database} ) ):
+        raise IOError( 'makeblastdb failed for ' + fasta_filename + '!!!' )
+    return database
+
+################################################################################
+# COMPARISON
+
+# count the positions where the two PSSMs (as extract_pssm_from_psiblast_pssm)
+# differ
+def compare_pssms( pssm , sharded_pssm ):
+    positions = sorted( set( pssm.keys() + sharded_pssm.keys() ) )
+    missing = [i for i in positions if not i in pssm.keys() or not i in sharded_pssm.keys()]
+    positions = [i for i in positions if not i in missing]
+
+    scores = [max( [abs( pssm[i]['log-likelihood'][j] - sharded_pssm[i]['log-likelihood'][j] ) for j in PROTEIN_LETTERS] ) for i in positions]
+    frequencies = [i for i in positions if not pssm[i]['approximate frequencies'] == sharded_pssm[i]['approximate frequencies']]
+    return {
+        'positions' : (len( pssm ) , len( sharded_pssm )) ,
+        'log-likelihood' : (len( [i for i in scores if i] ) , max( [0] + scores )) ,
+        'frequencies' : len( frequencies ) ,
+        'identical' : not missing and not [i for i in scores if i] and not frequencies
+        }
+
+################################################################################
+# VALIDATION
+
+# search the synthetic database both ways in  <out_path> , returns the
+# comparison
+def validate_psiblast_shards( out_path , homologs = VALIDATION_HOMOLOGS , background = VALIDATION_BACKGROUND ,
+        shards = VALIDATION_SHARDS , threads = VALIDATION_THREADS , seed = 0 ):
+    out_path = os.path.abspath( out_path )
+    if os.path.isdir( out_path ):
+        shutil.rmtree( out_path )
+    os.makedirs( out_path +'/whole' )
+    os.makedirs( out_path +'/sharded' )
+
+    database_filename , shard_filenames = write_synthetic_database( out_path , homologs , background , shards , seed = seed )
+    database = make_blast_database( database_filename )
+    shard_databases = [make_blast_database( i ) for i in shard_filenames]
+
+    # the whole database, as run_psiblast always has
+    shutil.copy( out_path + '/query.fa' , out_path + '/whole/query.fa' )
+    command , pssm_filename = run_psiblast( out_path + '/whole/query.fa' , run = False , options = {'db' : database , 'num_threads' : threads} )
+    if run_local_commandline( command ):
+        raise IOError( 'PSIBLAST failed on the whole database!!!' )
+
+    # the same steps the sharded commands run (see run_psiblast_shards)
+    sequence_filename = out_path + '/sharded/query.fa'
+    shutil.copy( out_path + '/query.fa' , sequence_filename )
+    database_length = sum( [get_blast_database_length( i ) for i in shard_databases] )
+    for k in xrange( 1 , int( PSIBLAST_OPTIONS['num_iterations'] ) + 1 ):
+        for i in xrange( len( shard_databases ) ):
+            if search_psiblast_shard( sequence_filename , k , database_length , i , shard_databases[i] , threads ):
+                raise IOError( 'PSIBLAST failed on shard ' + str( i ) + ' in round ' + str( k ) + '!!!' )
+        if merge_psiblast_shards( sequence_filename , k , database_length , shard_databases , threads ):
+            raise IOError( 'merging round ' + str( k ) + ' failed!!!' )
+    sharded_pssm_filename = run_psiblast( sequence_filename , run = False )[1]
+
+    for i in [pssm_filename , sharded_pssm_filename]:
+        if not os.path.isfile( i ) or not os.path.getsize( i ):
+            raise IOError( 'no PSSM in ' + i + ', nothing to compare (no hits?)' )
+    return compare_pssms( extract_pssm_from_psiblast_pssm( pssm_filename ) , extract_pssm_from_psiblast_pssm( sharded_pssm_filename ) )
+
+################################################################################
+# MAIN
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option( '-s' , dest = 'shards' ,
+        default = VALIDATION_SHARDS , type = 'int' ,
+        help = 'how many parts to split the synthetic database into' )
+    parser.add_option( '-n' , dest = 'homologs' ,
+        default = VALIDATION_HOMOLOGS , type = 'int' ,
+        help = 'how many homologs of the query the database has' )
+    parser.add_option( '-b' , dest = 'background' ,
+        default = VALIDATION_BACKGROUND , type = 'int' ,
+        help = 'how many unrelated sequences the database has' )
+    parser.add_option( '-t' , dest = 'threads' ,
+        default = VALIDATION_THREADS , type = 'int' ,
+        help = 'threads for each PSIBLAST search' )
+    parser.add_option( '-r' , dest = 'seed' ,
+        default = 0 , type = 'int' ,
+        help = 'random seed for the synthetic sequences' )
+    parser.add_option( '-o' , dest = 'out_path' ,
+        default = 'psiblast_shard_validation' ,
+        help = 'where to write the synthetic database and the search output' )
+    (options , args) = parser.parse_args()
+
+    # every command is printed, keep them in a log
+    stdout = sys.stdout
+    sys.stdout = open( options.out_path.rstrip( '/' ) + '.log' , 'w' )
+    try:
+        comparison = validate_psiblast_shards( options.out_path , options.homologs , options.background ,
+            options.shards , options.threads , options.seed )
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    print 'positions (whole/sharded)\t%i/%i' % comparison['positions']
+    print 'log-likelihood (positions differing/largest difference)\t%i/%i' % comparison['log-likelihood']
+    print 'frequencies (positions differing)\t%i' % comparison['frequencies']
+    print 'the sharded PSSM is ' + 'not '*( not comparison['identical'] ) + 'identical'
+    sys.exit( not comparison['identical'] )
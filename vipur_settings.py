@@ -19,6 +19,9 @@ PATH_TO_PSIBLAST = PATH_TO_VIPUR_EXECUTABLES + '/psiblast_blast+2.2.25'
 #PATH_TO_PSIBLAST = '/home/ehb250/MEC_files/ncbi-blast-2.2.25+/bin/psiblast'#PATH_TO_VIPUR_EXECUTABLES + '/psiblast_blast+2.2.25'
 PATH_TO_BLAST_DATABASE = '/home/evan/bio/databases/blast/nr/nr'
 #PATH_TO_BLAST_DATABASE = '/scratch/ehb250/nr_db/nr'#/home/evan/bio/databases/blast/nr/nr'
+# only for searching the database in parts (see PSIBLAST_SHARDS)
+PATH_TO_BLASTDBCMD = PATH_TO_VIPUR_EXECUTABLES + '/blastdbcmd'
+PATH_TO_MAKEBLASTDB = PATH_TO_VIPUR_EXECUTABLES + '/makeblastdb'
 PATH_TO_PROBE = PATH_TO_VIPUR_EXECUTABLES + '/probe'
 #PATH_TO_PROBE = '/home/ehb250/MEC_files/probe/probe'#PATH_TO_VIPUR_EXECUTABLES + '/probe'
 
@@ -134,6 +137,44 @@ PSIBLAST_OPTIONS = {
     'export_search_strategy' : lambda x : x + '.ss'
     }
 
+# PSSMs already computed are kept here by a hash of the query sequence, the
+# PSIBLAST_OPTIONS that change the result and the database files, so the same
+# sequence (in any run, for any protein) is only searched once
+# leave empty to always run PSIBLAST
+PSSM_CACHE_PATH = ''
+# options that do not change the PSSM (output filenames are ignored anyway)
+PSSM_CACHE_IGNORED_OPTIONS = ['num_threads' , 'query']
+
+# each PSSM is parsed once into arrays (needs NumPy) kept next to it, the
+# .pssm filename + this, so postprocessing it again just loads them
+# leave empty (or without NumPy) to parse the .pssm every time
+PSSM_ARRAY_EXTENSION = '.npz'
+# otherwise only the rows needed are parsed, found with an index (where each
+# position starts) kept next to the PSSM, the .pssm filename + this
+# leave empty to parse the whole .pssm
+PSSM_INDEX_EXTENSION = '.index'
+
+# search up to this many different sequences (from all the proteins in a run)
+# with a single PSIBLAST command, the database is only read once for all of
+# them, proteins with the same sequence share its PSSM
+# 0 runs PSIBLAST separately for each protein
+PSIBLAST_BATCH_SIZE = 0
+# splits the output of each batch into the PSSM of each protein
+PSIBLAST_BATCH_SPLITTER = 'python ' + PATH_TO_VIPUR + '/psiblast_feature_generation.py split'
+
+# search these parts of the database instead (BLAST databases that together
+# make up PSIBLAST_OPTIONS['db'] e.g. its volumes nr.00, nr.01...), one command
+# per part and iteration, the hits of each iteration are merged and searched
+# again for the PSSM, with the length of the whole database so the E-values
+# (and the PSSM) are the same as searching it at once
+# (batched searches are not split up)
+# leave empty to search the whole database at once
+PSIBLAST_SHARDS = []
+PSIBLAST_SHARD_THREADS = 4    # for each command
+# searches one part, merges the hits of an iteration
+PSIBLAST_SHARD_SEARCHER = 'python ' + PATH_TO_VIPUR + '/psiblast_feature_generation.py search'
+PSIBLAST_SHARD_MERGER = 'python ' + PATH_TO_VIPUR + '/psiblast_feature_generation.py merge'
+
 PROBE_OPTIONS = {
     'rad1.4' : '' ,    # sets the radius for "sphere rolling"
     'C' : ''    # ?
@@ -193,6 +234,20 @@ ROSETTA_RELAX_PARALLEL_OPTIONS = {
     'run:multiple_processes_writing_to_one_directory' : '' ,
     }
 
+# ADAPTIVE RELAX
+# the classifier only sees how the variant relax score distributions compare
+# to the native (the Q1/Q2/Q3 quartile features), many variants are clear
+# calls long before all "nstruct" trajectories are done
+# optionally run the separate trajectories (not single_relax) in waves, after
+# each wave bootstrap the quartile features and classifier P from the
+# trajectories so far, stop once both are stable within these tolerances
+ADAPTIVE_RELAX = False
+ADAPTIVE_RELAX_WAVE_SIZE = 10    # trajectories per wave, for each variant and the native
+ADAPTIVE_RELAX_BOOTSTRAP_SAMPLES = 200
+ADAPTIVE_RELAX_P_TOLERANCE = .02    # largest standard error of P to stop
+ADAPTIVE_RELAX_FEATURE_TOLERANCE = .2    # largest standard error of any quartile feature's term in the classifier (weight x normalized value, log-odds) to stop
+ADAPTIVE_RELAX_SEED = 17    # for reproducible bootstraps
+
 ROSETTA_SCORE_OPTIONS = {
     'database' : PATH_TO_ROSETTA_DATABASE ,
     'in:file:fullatom' : '' ,
@@ -201,6 +256,99 @@ ROSETTA_SCORE_OPTIONS = {
 #    'score:weights' : 'test.wts'
     }
 
+################################################################################
+# RESOURCE PROFILES
+
+# what each kind of command occupies while it runs, the parallel and queue run
+# methods pack commands against the available cores + memory using these
+# "cores" and "memory" (in GB) can be numbers or functions of the protein length
+# commands with an explicit "-num_threads" or "mpiexec -n" use that many cores
+# "runtime" (in s) is a rough estimate, used until the command records its own
+FEATURE_RESOURCE_PROFILES = {
+    'psiblast' : {
+        'cores' : PSIBLAST_OPTIONS['num_threads'] ,
+        'memory' : 8 ,    # mostly the database
+        'runtime' : 3600
+        } ,
+    'psiblast_shard' : {
+        'cores' : PSIBLAST_SHARD_THREADS ,
+        'memory' : 2 ,    # one part of the database
+        'runtime' : 900
+        } ,
+    'psiblast_merge' : {
+        'cores' : PSIBLAST_SHARD_THREADS ,
+        'memory' : 1 ,
+        'runtime' : 120
+        } ,
+    'probe' : {
+        'cores' : 1 ,
+        'memory' : .5 ,
+        'runtime' : 60
+        } ,
+    'ddg_monomer' : {
+        'cores' : 1 ,    # single process, but long
+        'memory' : lambda x : 1 + .004*x ,
+        'runtime' : lambda x : 60 + 2*x
+        } ,
+    'relax_native' : {
+        'cores' : 1 ,
+        'memory' : lambda x : .5 + .002*x ,
+        'runtime' : lambda x : 120 + 6*x
+        } ,
+    'relax' : {
+        'cores' : 1 ,
+        'memory' : lambda x : .5 + .002*x ,
+        'runtime' : lambda x : 120 + 6*x
+        } ,
+    'relax_native_rescore' : {
+        'cores' : 1 ,
+        'memory' : .5 ,
+        'runtime' : 30
+        } ,
+    'relax_rescore' : {
+        'cores' : 1 ,
+        'memory' : .5 ,
+        'runtime' : 30
+        }
+    }
+
+# for anything else
+DEFAULT_RESOURCE_PROFILE = {
+    'cores' : 1 ,
+    'memory' : 1 ,
+    'runtime' : 600
+    }
+
+# SCHEDULING POLICY
+# "critical_path" launches the ready commands with the longest chain of work
+# behind them first (e.g. a relax and its rescore), from the runtime estimates
+# above corrected by how long each feature has actually taken so far, smaller
+# commands backfill around them
+# "in_order" launches them in the order they are listed in the task summaries
+SCHEDULING_POLICY = 'critical_path'
+
+# SPECULATIVE EXECUTION
+# a few of the independent relax trajectories always land on slow or busy
+# nodes and hold up the merge + rescore, optionally launch a duplicate of any
+# command that has run longer than most of its finished siblings (same task,
+# feature and variant), keep whichever copy finishes first and stop the other
+# the duplicate runs the same command (same "run:jran" seed) into its own
+# output files, the winner's output is moved into place
+SPECULATIVE_EXECUTION = False
+SPECULATIVE_FEATURES = ['relax_native' , 'relax']    # only commands whose siblings are interchangeable
+SPECULATIVE_PERCENTILE = 90    # a straggler has run longer than this percentile of its siblings' runtimes
+SPECULATIVE_MIN_SIBLINGS = 5    # how many siblings must finish before judging
+SPECULATIVE_SUFFIX = '_speculative'    # added to the output filenames of the duplicate
+
+# JOB PACKING
+# short commands are run together in one queue job instead of waiting in the
+# queue one at a time, batch_driver.py runs them inside the job
+PACKED_JOB_FEATURES = ['probe' , 'ddg_monomer' , 'relax_native_rescore' , 'relax_rescore']
+PACKED_JOB_MAX_RUNTIME = 1800    # s, only pack commands expected to finish sooner
+PACKED_JOB_WALLTIME = 3600    # s, how long each packed job should take
+PACKED_JOB_CORES = 12    # how many cores each packed job uses (commands run at once)
+PACKED_JOB_DRIVER = 'python ' + PATH_TO_VIPUR + '/batch_driver.py'
+
 ################################################################################
 # PBS QUEUE SYSTEM INTERACTION
 
@@ -212,6 +360,8 @@ PBS_USER = 'ehb250'
 PBS_ENVIRONMENT_SETUP = 'module load pymol'
 
 PBS_QUEUE_QUOTA = 20    # how many jobs can be in the queue simultaneously (excludes "R"unning jobs, that quota is set elsewhere now...)
+PBS_ALLOCATION_CORES = 72    # how many cores our jobs (running or queued) can ask for at once
+PBS_ALLOCATION_MEMORY = 256    # GB, how much memory our jobs can ask for at once
 PBS_QUEUE_MONITOR_DELAY = 60    # seconds, how long to wait between checking the queue
 
 # simply add the flanking text necessary
@@ -244,16 +394,33 @@ PBS_PARALLEL_ROSETTA_ENDING = '.mpi.linuxiccrelease'    # gccrelease on butinah
 
 PBS_PARALLEL_ROSETTA_EXECUTION_COMMAND = '' #module load mvapich2/gnu/1.8.1;/share/apps/mvapich2/1.8.1/gnu/bin/mpiexec -n ' + str( PBS_PARALLEL_NODE_ALLOCATION*PBS_PARALLEL_PROCESSES_ALLOCATION )
 
+# submit the separate relax trajectories (single_relax = False) as array jobs
+# one script and one qsub per protein + feature instead of one per trajectory
+PBS_USE_JOB_ARRAYS = True
+PBS_ARRAY_FEATURES = ['relax_native' , 'relax']
+PBS_ARRAY_OPTION = 't'    # Torque, use 'J' for PBS Pro (ranges only, no lists)
+PBS_ARRAY_INDEX_VARIABLE = 'PBS_ARRAYID'    # Torque, use 'PBS_ARRAY_INDEX' for PBS Pro
+
 ################################################################################
 # SLURM QUEUE SYSTEM INTERACTION
 
 SLURM_USER = 'ebaugh'
 
-SLURM_QUEUE_QUOTA = 10    # deprecated?
-SLURM_QUEUE_MONITOR_DELAY = 60    # less then this?
+SLURM_QUEUE_QUOTA = 10    # deprecated? replaced by the allocation below
+SLURM_ALLOCATION_CORES = 40    # how many cores our jobs (running or queued) can ask for at once, also the size of the batch job
+SLURM_ALLOCATION_MEMORY = 120    # GB, how much memory our jobs can ask for at once
+SLURM_QUEUE_MONITOR_DELAY = 60    # seconds, the longest wait between checking the queue, when nothing is changing
+SLURM_QUEUE_MONITOR_MIN_DELAY = 2    # seconds, the shortest wait, used while jobs are finishing or being submitted
+SLURM_SENTINEL_CHECK_INTERVAL = 1    # seconds, how often to look for the files jobs write when they finish
 
 SLURM_BASH_SCRIPT = lambda x : '#!/bin/bash\n\n' + x.replace( ';' , '\n\n' ) +'\n\n'
 
+# submit the separate relax trajectories (single_relax = False) as job arrays
+# one script and one sbatch per protein + feature instead of one per trajectory
+SLURM_USE_JOB_ARRAYS = True
+SLURM_ARRAY_FEATURES = ['relax_native' , 'relax']    # can add any other homogeneous commands e.g. 'relax_rescore'
+SLURM_ARRAY_MAX_SIMULTANEOUS = 0    # the "%" limit for each array, 0 fits as many as the allocation allows
+
 SLURM_JOB_OPTIONS = {
 #    'n' : ,    # how many to request? is it actually threaded? just do 1 for now, later we can combine multiple for arrays or array like implementation
     # lol, these two are the same
@@ -263,9 +430,74 @@ SLURM_JOB_OPTIONS = {
 
 # no parallel options for now, Rosetta does not optimize this anyway...so SLURM's interface should make Rosetta MPI obsolete other than resource sharing...
 
+################################################################################
+# LOCAL PARALLEL INTERACTION
+
+# for running many commands at once on a single (large) machine, no queue
+LOCAL_PARALLEL_WORKERS = 0    # how many cores the commands can occupy at once, 0 uses every core found on this machine
+LOCAL_PARALLEL_MEMORY = 0    # GB, how much memory the commands can occupy at once, 0 uses all the memory found on this machine
+LOCAL_PARALLEL_MONITOR_DELAY = 1    # seconds, the longest wait between checking the running commands, stops waiting as soon as any finish
+
+# local commands (serial, local parallel, pilot workers, packed jobs) write
+# their stdout + stderr to their output filename + this, leave empty to print it
+LOCAL_COMMAND_LOG_EXTENSION = '.log'
+
+# every command (in any run mode) runs in its own scratch directory, its output
+# filename + this, so commands that write into their working directory
+# (ddg_monomer) can run side by side, leave empty to run them wherever they
+# are started
+# if the command succeeds the file in COMMAND_SCRATCH_OUTPUTS is moved to its
+# output filename, the scratch directory is always removed
+COMMAND_SCRATCH_EXTENSION = '.scratch'
+# feature : the file its command writes into the working directory
+COMMAND_SCRATCH_OUTPUTS = {
+    'ddg_monomer' : 'ddg_predictions.out'
+    }
+
+# optionally put the scratch directories of COMMAND_STAGING_FEATURES on
+# node-local storage instead, e.g. '${TMPDIR:-/tmp}' or '/dev/shm' (expanded
+# by the shell running the command), leave empty to keep them in the out_path
+# their input files are copied there first and Rosetta writes its output there
+# as it runs, if the command succeeds the output files are moved into the
+# out_path together, otherwise thrown away
+# (only for commands on a single node, not mpiexec across several)
+COMMAND_STAGING_PATH = ''
+COMMAND_STAGING_FEATURES = ['relax' , 'relax_native']
+# the options naming the files these commands read and write
+COMMAND_STAGING_INPUT_OPTIONS = ['s' , 'native' , 'in:file:s' , 'in:file:native' , 'in:file:silent']
+COMMAND_STAGING_OUTPUT_OPTIONS = ['out:file:silent' , 'out:file:scorefile']
+
+################################################################################
+# PRE PROCESSING
+
+# preprocessing is independent for each target, run several at once
+PREPROCESSING_PROCESSES = 0    # how many targets to preprocess at once, 0 uses every core, 1 does them one at a time
+
+################################################################################
+# PILOT JOB INTERACTION
+
+# a few long-lived workers pull commands from a shared task store (SQLite)
+# instead of one queue job per command, see pilot_run_methods.py
+PILOT_WORKERS = 4    # how many workers to start
+PILOT_QUEUE = 'local'    # where to start them: local, slurm, or pbs
+PILOT_WORKER_CORES = 4    # cores requested for each queued worker
+PILOT_WORKER_MEMORY = 8    # GB requested for each queued worker
+PILOT_WORKER_IDLE_TIMEOUT = 600    # seconds, workers stop if nothing new is added for this long
+PILOT_WORKER_HEARTBEAT = 60    # seconds, how often workers renew the lease on the command they are running
+PILOT_WORKER_LEASE = 300    # seconds, commands whose lease was not renewed for this long are run again (the worker died)
+PILOT_MONITOR_DELAY = 5    # seconds, how long to wait between checking the task store
+PILOT_TASK_STORE_FILENAME = 'VIPUR_task_store.db'    # must be on a filesystem the workers can see, with working file locks
+PILOT_WORKER_COMMAND = 'python ' + PATH_TO_VIPUR + '/task_store_methods.py'
+
 ################################################################################
 # POST PROCESSING
 
+# each protein is post processed as soon as all of its commands are successful,
+# a summary of how far along each protein is gets written here (in the run's
+# out_path, unless it is an absolute path) whenever anything finishes, leave
+# empty to only print it
+PROGRESS_FILENAME = 'VIPUR_progress.txt'
+
 # for feature extraction
 ROSETTA_TERMS_TO_COMPARE = [
     'score' ,